@@ -0,0 +1,226 @@
+'''
+Offline benchmark for the rotation scripts.
+
+Starts the local stand-in server of a backend (see mock_backends.py), points the rotation script at it and
+calls the script's rotate() function for a number of jobs with bounded concurrency. Reports the p50/p99
+latency per rotation and the throughput in jobs per second, without touching any real Cisco, Meraki,
+Tenable or Snowflake system.
+
+Usage:
+    bench_rotation.py <backend> [--jobs 200] [--concurrency 8] [--latency 0.02] [--users 100]
+                      [--rate-limit 0] [--retry-after 1] [--set NAME=VALUE ...] [--json] [--max-p99 MS] [--min-throughput JOBS]
+
+--set overrides a setting at the top of the rotation script for the run, e.g. --set MERAKI_RATE_LIMIT=50.
+--max-p99 and --min-throughput make the benchmark exit with an error when the result is worse, for regression checks.
+'''
+
+import io
+import os
+import ast
+import sys
+import json
+import math
+import time
+import argparse
+import logging
+import tempfile
+import warnings
+import functools
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'pam_rotate'))
+import rotation_runner
+import mock_backends
+
+# Settings of the rotation scripts that point at files in the home directory, moved to a temporary directory for the run.
+CACHE_FILE_SETTINGS = ['MERAKI_USER_CACHE_FILE', 'TENABLE_USER_CACHE_FILE', 'TENABLE_SC_USER_CACHE_FILE', 'SNOWFLAKE_SESSION_CACHE_FILE',
+                       'SNOWFLAKE_SESSION_CACHE_KEY_FILE']
+
+def prepare_backend(backend, module, port, users):
+    """
+    Points a loaded rotation script at the stand-in server and builds the rotation of one job.
+
+    Args:
+    - backend (str): The backend name.
+    - module (module): The loaded rotation script.
+    - port (int): The port of the stand-in server.
+    - users (int): The number of users the stand-in server holds. Job i rotates user i modulo users.
+
+    Returns:
+    - callable: Runs the rotation of job i.
+    """
+    # The Tenable and Snowflake scripts import their SDK on first use, import it now so it can be pointed at the stand-in
+    if hasattr(module, 'load_sdk'):
+        module.load_sdk()
+
+    if backend == 'cisco-ios-xe':
+        url = f"http://127.0.0.1:{port}/restconf/data/Cisco-IOS-XE-native:native/"
+        return lambda i: module.rotate(url, 'admin', 'admin', f"user{i % users}", 'NewPassword1')
+
+    if backend == 'cisco-meraki':
+        module.MERAKI_API_URL = f"http://127.0.0.1:{port}/api/v1"
+        return lambda i: module.rotate('N1', 'api-key', f"user{i % users}@example.com", 'NewPassword1')
+
+    if backend == 'tenable-io-user':
+        module.TenableIO = functools.partial(module.TenableIO, url=f"http://127.0.0.1:{port}")
+        return lambda i: module.rotate('access-key', 'secret-key', f"user{i % users}", 'OldPassword1', 'NewPassword1')
+
+    if backend == 'tenable-credential':
+        module.TenableIO = functools.partial(module.TenableIO, url=f"http://127.0.0.1:{port}")
+        return lambda i: module.rotate('access-key', 'secret-key', f"user{i % users}", 'NewPassword1')
+
+    if backend == 'tenable-sc-user':
+        module.TenableSC = functools.partial(module.TenableSC, scheme='http', port=port)
+        return lambda i: module.rotate('127.0.0.1', 'access-key', 'secret-key', f"user{i % users}", 'OldPassword1', 'NewPassword1')
+
+    if backend == 'snowflake':
+        connect = module.snowflake.connector.connect
+        module.snowflake.connector.connect = functools.partial(connect, host='127.0.0.1', port=port, protocol='http')
+        return lambda i: module.rotate('bench', 'admin', 'AdminPassword1', f"user{i % users}", 'NewPassword1')
+
+    raise KeyError(f"Unknown backend: {backend}")
+
+def run_job(rotate_job, i):
+    """
+    Runs and times one rotation.
+
+    Args:
+    - rotate_job (callable): The rotation of job i, see prepare_backend.
+    - i (int): The job number.
+
+    Returns:
+    - (float, bool): The duration in seconds, and True if the rotation did not exit with an error.
+    """
+    start = time.perf_counter()
+    try:
+        rotate_job(i)
+        success = True
+    except SystemExit as e:
+        success = not e.code
+    except Exception:
+        success = False
+    return time.perf_counter() - start, success
+
+def percentile(values, fraction):
+    """
+    Nearest-rank percentile.
+
+    Args:
+    - values (list): The sorted values.
+    - fraction (float): The percentile as a fraction, e.g. 0.99.
+
+    Returns:
+    - float: The value at the percentile.
+    """
+    return values[min(len(values) - 1, max(0, math.ceil(fraction * len(values)) - 1))]
+
+def benchmark(backend, jobs, concurrency, latency, users, rate_limit, settings, retry_after=1):
+    """
+    Runs the benchmark of one backend.
+
+    Args:
+    - backend (str): The backend name.
+    - jobs (int): Number of rotations.
+    - concurrency (int): Number of rotations run at the same time.
+    - latency (float): Latency of every request to the stand-in server, in seconds.
+    - users (int): Number of users the stand-in server holds.
+    - rate_limit (int): Requests per second above which the stand-in server answers 429. 0 disables it.
+    - settings (dict): Settings of the rotation script to override.
+    - retry_after (int): Seconds the stand-in server asks for in the Retry-After header of a throttled request.
+
+    Returns:
+    - dict: The result of the benchmark.
+    """
+    state = mock_backends.BackendState(users=users, latency=latency, rate_limit=rate_limit, retry_after=retry_after)
+    server = mock_backends.start_backend(backend, state)
+    module = rotation_runner.load_backend(backend)
+
+    with tempfile.TemporaryDirectory() as cache_dir:
+        for name in CACHE_FILE_SETTINGS:
+            if hasattr(module, name):
+                setattr(module, name, os.path.join(cache_dir, os.path.basename(getattr(module, name))))
+        for name, value in settings.items():
+            if not hasattr(module, name):
+                raise KeyError(f"The {backend} script has no setting {name}")
+            setattr(module, name, value)
+        rotate_job = prepare_backend(backend, module, server.server_address[1], users)
+
+        # The scripts report every rotation with print(), and the SDKs log every throttled request. Keep that out of the report.
+        with contextlib.redirect_stdout(io.StringIO()), warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            logging.disable(logging.CRITICAL)
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                results = list(executor.map(functools.partial(run_job, rotate_job), range(jobs)))
+            elapsed = time.perf_counter() - start
+            logging.disable(logging.NOTSET)
+
+    server.shutdown()
+    server.server_close()
+
+    durations = sorted(duration for duration, _ in results)
+    return {
+        'backend': backend,
+        'jobs': jobs,
+        'failed': sum(1 for _, success in results if not success),
+        'concurrency': concurrency,
+        'latency_ms': latency * 1000,
+        'users': users,
+        'p50_ms': round(percentile(durations, 0.50) * 1000, 2),
+        'p99_ms': round(percentile(durations, 0.99) * 1000, 2),
+        'max_ms': round(durations[-1] * 1000, 2),
+        'jobs_per_sec': round(jobs / elapsed, 2),
+        'requests': state.requests,
+        'throttled': state.throttled,
+    }
+
+def parse_setting(text):
+    """
+    Parses a NAME=VALUE override. The value is read as a Python literal, or kept as a string.
+    """
+    name, _, value = text.partition('=')
+    try:
+        return name, ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return name, value
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline benchmark for the rotation scripts.')
+    parser.add_argument('backend', choices=list(mock_backends.HANDLERS), help='Backend to benchmark.')
+    parser.add_argument('--jobs', type=int, default=200, help='Number of rotations.')
+    parser.add_argument('--concurrency', type=int, default=8, help='Number of rotations run at the same time.')
+    parser.add_argument('--latency', type=float, default=0.02, help='Latency of every request to the stand-in server, in seconds.')
+    parser.add_argument('--users', type=int, default=100, help='Number of users (or credentials) the stand-in server holds.')
+    parser.add_argument('--rate-limit', type=int, default=0, help='Requests per second above which the server answers 429. 0 disables it.')
+    parser.add_argument('--retry-after', type=int, default=1, help='Seconds the server asks for in the Retry-After header of a 429.')
+    parser.add_argument('--set', dest='settings', action='append', default=[], metavar='NAME=VALUE',
+                        help='Override a setting at the top of the rotation script.')
+    parser.add_argument('--json', action='store_true', help='Print the result as one JSON line.')
+    parser.add_argument('--max-p99', type=float, help='Exit with an error if the p99 latency is above this many milliseconds.')
+    parser.add_argument('--min-throughput', type=float, help='Exit with an error if fewer jobs per second are completed.')
+    args = parser.parse_args()
+
+    result = benchmark(args.backend, args.jobs, max(1, args.concurrency), args.latency, args.users, args.rate_limit,
+                       dict(parse_setting(text) for text in args.settings), args.retry_after)
+
+    if args.json:
+        print(json.dumps(result))
+    else:
+        print(f"Backend        {result['backend']}")
+        print(f"Jobs           {result['jobs']} ({result['failed']} failed), concurrency {result['concurrency']}")
+        print(f"Server         {result['users']} users, {result['latency_ms']:.0f} ms latency, {result['requests']} requests, {result['throttled']} throttled")
+        print(f"Latency        p50 {result['p50_ms']} ms, p99 {result['p99_ms']} ms, max {result['max_ms']} ms")
+        print(f"Throughput     {result['jobs_per_sec']} jobs/s")
+
+    failed = result['failed'] > 0
+    if args.max_p99 is not None and result['p99_ms'] > args.max_p99:
+        print(f"# Error: p99 latency {result['p99_ms']} ms is above {args.max_p99} ms", file=sys.stderr)
+        failed = True
+    if args.min_throughput is not None and result['jobs_per_sec'] < args.min_throughput:
+        print(f"# Error: throughput {result['jobs_per_sec']} jobs/s is below {args.min_throughput}", file=sys.stderr)
+        failed = True
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
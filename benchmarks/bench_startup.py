@@ -0,0 +1,162 @@
+'''
+Cold start benchmark for the rotation scripts.
+
+The Keeper Gateway starts a new interpreter for every rotation, so the time until a script can do its first
+request is paid on every rotation. For each backend this benchmark starts fresh interpreters and measures:
+
+- reject: running the rotation script with a payload that fails validation. The script exits before it imports
+  its SDK, so this is the cost of the interpreter, the script and requests.
+- ready: loading the rotation script and importing its SDK, as a rotation does before its first request.
+
+Each measurement is repeated, after one warm-up run that fills the OS file cache, and the median and the fastest
+run are reported.
+
+--bundle measures a bundle built by pam_rotate/build_bundle.py in place of the scripts of this repository. The
+reject path then runs the bundle with the backend name. --no-bytecode-cache makes every interpreter compile its
+modules from source, as on a host where no bytecode was written and the cache directories are not writable.
+Compare a run with and without --bundle to see what the bundle changes.
+
+Usage:
+    bench_startup.py [backend ...] [--runs 10] [--bundle PATH] [--no-bytecode-cache] [--json] [--max-ms MS] [--max-reject-ms MS]
+
+The benchmark exits with an error when the median of a backend is slower than its threshold, for regression checks.
+The default thresholds (DEFAULT_MAX_MS, DEFAULT_MAX_REJECT_MS) are about twice the medians of a typical host.
+--max-ms and --max-reject-ms replace them for every backend, 0 turns the check off.
+'''
+
+import os
+import sys
+import json
+import time
+import base64
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'pam_rotate'))
+import rotation_runner
+import pam_rotate
+
+# A payload without records: every rotation script rejects it before it imports its SDK
+REJECT_PAYLOAD = base64.b64encode(json.dumps({'records': base64.b64encode(b'[]').decode()}).encode()).decode()
+
+# Backend name -> highest median ready time in milliseconds, when --max-ms is not given.
+DEFAULT_MAX_MS = {
+    'snowflake': 450,
+    'tenable-io-user': 350,
+    'tenable-credential': 350,
+    'tenable-sc-user': 250,
+    'cisco-ios-xe': 150,
+    'cisco-meraki': 150,
+}
+# Highest median reject time in milliseconds of every backend, when --max-reject-ms is not given.
+DEFAULT_MAX_REJECT_MS = 150
+
+def time_reject(backend, bundle=None, env=None):
+    """
+    Runs the rotation script of a backend with a payload that fails validation, in a fresh interpreter.
+
+    Args:
+    - backend (str): The backend name.
+    - bundle (str): Run this bundle with the backend name in place of the rotation script.
+    - env (dict): Environment of the interpreter, by default the environment of this process.
+
+    Returns:
+    - float: The wall time in milliseconds. Raises RuntimeError if the script did not reject the payload.
+    """
+    if bundle:
+        command = [sys.executable, bundle, backend]
+    else:
+        command = [sys.executable, os.path.join(rotation_runner.SCRIPTS_DIR, rotation_runner.BACKENDS[backend])]
+    start = time.perf_counter()
+    process = subprocess.run(command, input=REJECT_PAYLOAD + '\n', capture_output=True, text=True, env=env)
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    if '# Error:' not in process.stdout:
+        raise RuntimeError(f"The {backend} script did not reject the payload: {process.stdout.strip() or process.stderr.strip()}")
+    return elapsed_ms
+
+def benchmark(backend, runs, bundle=None, env=None):
+    """
+    Runs the cold start benchmark of one backend.
+
+    Args:
+    - backend (str): The backend name.
+    - runs (int): Number of measured runs of each path.
+    - bundle (str): Measure this bundle in place of the scripts of this repository.
+    - env (dict): Environment of the interpreters, by default the environment of this process.
+
+    Returns:
+    - dict: The result of the benchmark.
+    """
+    time_reject(backend, bundle, env)
+    pam_rotate.measure_startup(backend, path=bundle, env=env)
+    reject = sorted(time_reject(backend, bundle, env) for _ in range(runs))
+    ready = [pam_rotate.measure_startup(backend, path=bundle, env=env) for _ in range(runs)]
+    ready_ms = sorted(result['total_ms'] for result in ready)
+    return {
+        'backend': backend,
+        'bundle': bundle,
+        'runs': runs,
+        'reject_median_ms': round(statistics.median(reject), 1),
+        'reject_min_ms': round(reject[0], 1),
+        'ready_median_ms': round(statistics.median(ready_ms), 1),
+        'ready_min_ms': round(ready_ms[0], 1),
+        'interpreter_ms': round(statistics.median(result['interpreter_ms'] for result in ready), 1),
+        'script_ms': round(statistics.median(result['script_ms'] for result in ready), 1),
+        'sdk_ms': round(statistics.median(result['sdk_ms'] for result in ready), 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Cold start benchmark for the rotation scripts.')
+    parser.add_argument('backends', nargs='*', metavar='backend', help=f"Backends to benchmark, all by default: {', '.join(rotation_runner.BACKENDS)}.")
+    parser.add_argument('--runs', type=int, default=10, help='Number of measured runs of each path.')
+    parser.add_argument('--bundle', help='Measure this bundle, built by pam_rotate/build_bundle.py, in place of the scripts.')
+    parser.add_argument('--no-bytecode-cache', action='store_true', help='Compile every module from source, without reading or writing bytecode caches.')
+    parser.add_argument('--json', action='store_true', help='Print the result of each backend as one JSON line.')
+    parser.add_argument('--max-ms', type=float, help='Exit with an error if the median ready time of a backend is above this many milliseconds. '
+                                                      'Replaces DEFAULT_MAX_MS, 0 turns the check off.')
+    parser.add_argument('--max-reject-ms', type=float, default=DEFAULT_MAX_REJECT_MS,
+                        help='Exit with an error if the median reject time of a backend is above this many milliseconds. 0 turns the check off.')
+    args = parser.parse_args()
+
+    unknown = [backend for backend in args.backends if backend not in rotation_runner.BACKENDS]
+    if unknown:
+        parser.error(f"unknown backend: {', '.join(unknown)}")
+    bundle = os.path.abspath(args.bundle) if args.bundle else None
+
+    env = None
+    if args.no_bytecode_cache:
+        # An empty cache directory that is never written to: nothing is found there, so every module is compiled.
+        # Bytecode inside a bundle is not affected, it is not a cache.
+        cache_dir = tempfile.TemporaryDirectory()
+        env = dict(os.environ, PYTHONPYCACHEPREFIX=cache_dir.name, PYTHONDONTWRITEBYTECODE='1')
+
+    failed = False
+    if not args.json:
+        print(f"{'Backend':<20} {'Reject p50':>11} {'Ready p50':>10} {'Ready min':>10} {'Interpreter':>12} {'Script':>7} {'SDK':>7}")
+    for backend in args.backends or list(rotation_runner.BACKENDS):
+        try:
+            result = benchmark(backend, max(1, args.runs), bundle, env)
+        except RuntimeError as err:
+            print(f"# Error: {err}", file=sys.stderr)
+            failed = True
+            continue
+
+        if args.json:
+            print(json.dumps(result))
+        else:
+            print(f"{backend:<20} {result['reject_median_ms']:>8.1f} ms {result['ready_median_ms']:>7.1f} ms {result['ready_min_ms']:>7.1f} ms "
+                  f"{result['interpreter_ms']:>9.1f} ms {result['script_ms']:>4.1f} ms {result['sdk_ms']:>4.1f} ms")
+
+        max_ms = args.max_ms if args.max_ms is not None else DEFAULT_MAX_MS[backend]
+        if max_ms and result['ready_median_ms'] > max_ms:
+            print(f"# Error: {backend} cold start {result['ready_median_ms']} ms is above {max_ms} ms", file=sys.stderr)
+            failed = True
+        if args.max_reject_ms and result['reject_median_ms'] > args.max_reject_ms:
+            print(f"# Error: {backend} reject time {result['reject_median_ms']} ms is above {args.max_reject_ms} ms", file=sys.stderr)
+            failed = True
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,330 @@
+'''
+Local stand-in servers for the rotation backends, used by bench_rotation.py and the tests in tests/.
+
+Each stand-in implements just the endpoints the rotation scripts call:
+
+- RESTCONF (Cisco IOS XE): GET .../native/username=<name>, GET .../native/username/ and PATCH .../native/
+- Meraki Dashboard API: merakiAuthUsers of a network, the networks of an organization and action batches
+- Tenable.io: users, users/<id>/chpasswd and credentials
+- Tenable.sc: /rest/user and /rest/user/<id>
+- Snowflake: the login, query, query status and session endpoints used by snowflake-connector-python
+
+All of them share the same knobs: a fixed latency per request, the number of users (or credentials) they hold,
+an optional rate limit above which they answer 429 Too Many Requests with a Retry-After header, and an optional
+pause between the pieces of a reply body. They count the requests of each endpoint and the highest number of
+requests in progress at once, for the tests in tests/.
+'''
+
+import re
+import gzip
+import sys
+import json
+import time
+import uuid
+import threading
+import collections
+from urllib.parse import urlsplit, parse_qs, unquote
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+class BackendState:
+    """
+    Configuration and counters of one stand-in server.
+    """
+    def __init__(self, users=100, latency=0.0, rate_limit=0, retry_after=1, trickle=0.0):
+        # Names of the users the backend holds: user0 ... user<n-1>
+        self.users = [f"user{i}" for i in range(users)]
+        self.latency = latency
+        self.rate_limit = rate_limit
+        # Seconds sent in the Retry-After header of a throttled request
+        self.retry_after = retry_after
+        # Seconds to wait before each TRICKLE_SIZE bytes of a reply body, for a backend that keeps sending slowly
+        self.trickle = trickle
+        self.requests = 0
+        self.throttled = 0
+        self.lock = threading.Lock()
+        # Sliding one second window of the request times, for the rate limit
+        self.window = []
+        self.batches = {}
+        # Requests by 'METHOD path', without the query, and the parsed query of each of them
+        self.paths = collections.Counter()
+        self.queries = collections.defaultdict(list)
+        self.in_flight = 0
+        self.max_in_flight = 0
+        # Password set last, by user name, for the stand-ins that receive the password in clear
+        self.passwords = {}
+
+    def admit(self):
+        """
+        Counts a request and decides whether it is throttled.
+
+        Returns:
+        - bool: False if the request exceeds the rate limit.
+        """
+        with self.lock:
+            self.requests += 1
+            if not self.rate_limit:
+                return True
+            now = time.monotonic()
+            self.window = [t for t in self.window if now - t < 1.0]
+            if len(self.window) >= self.rate_limit:
+                self.throttled += 1
+                return False
+            self.window.append(now)
+            return True
+
+# Size of the pieces of a reply body sent with the trickle setting, in bytes
+TRICKLE_SIZE = 256
+
+class MockHandler(BaseHTTPRequestHandler):
+    """
+    Base handler: keeps connections alive, applies the latency and the rate limit, and dispatches to route().
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def reply(self, status, body=None, headers=None):
+        data = json.dumps(body).encode() if body is not None else b''
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        if not self.state.trickle:
+            return self.wfile.write(data)
+        for start in range(0, len(data), TRICKLE_SIZE):
+            time.sleep(self.state.trickle)
+            self.wfile.write(data[start:start + TRICKLE_SIZE])
+
+    def read_body(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        data = self.rfile.read(length) if length else b''
+        if self.headers.get('Content-Encoding') == 'gzip':
+            data = gzip.decompress(data)
+        return json.loads(data) if data else None
+
+    def handle_request(self):
+        body = self.read_body()
+        url = urlsplit(self.path)
+        with self.state.lock:
+            self.state.paths[f"{self.command} {unquote(url.path)}"] += 1
+            self.state.queries[f"{self.command} {unquote(url.path)}"].append(parse_qs(url.query))
+        if not self.state.admit():
+            return self.reply(429, {'errors': ['Too Many Requests']}, {'Retry-After': str(self.state.retry_after)})
+        with self.state.lock:
+            self.state.in_flight += 1
+            self.state.max_in_flight = max(self.state.max_in_flight, self.state.in_flight)
+        try:
+            if self.state.latency:
+                time.sleep(self.state.latency)
+            self.route(self.command, unquote(url.path), parse_qs(url.query), body)
+        finally:
+            with self.state.lock:
+                self.state.in_flight -= 1
+
+    do_GET = do_PUT = do_POST = do_PATCH = do_DELETE = handle_request
+
+    def route(self, method, path, query, body):
+        self.reply(404)
+
+class RestconfHandler(MockHandler):
+    """
+    Cisco IOS XE RESTCONF stand-in under /restconf/data/Cisco-IOS-XE-native:native/.
+    """
+    def route(self, method, path, query, body):
+        native = path.split('Cisco-IOS-XE-native:native/', 1)[-1]
+        if method == 'GET' and native.startswith('username='):
+            name = native[len('username='):]
+            if name in self.state.users:
+                return self.reply(200, {'Cisco-IOS-XE-native:username': [{'name': name}]})
+            return self.reply(404)
+        if method == 'GET' and native.rstrip('/') == 'username':
+            return self.reply(200, {'Cisco-IOS-XE-native:username': [{'name': name, 'privilege': 15} for name in self.state.users]})
+        if method == 'PATCH':
+            return self.reply(204)
+        self.reply(404)
+
+class MerakiHandler(MockHandler):
+    """
+    Meraki Dashboard API stand-in under /api/v1. Networks N1 and N2 of organization O1 hold the users as
+    user<i>@example.com. Its network N3 has no Meraki authentication users and answers 400.
+    """
+    def route(self, method, path, query, body):
+        parts = path.split('/api/v1/', 1)[-1].strip('/').split('/')
+        user_ids = {f"{name}@example.com": str(i) for i, name in enumerate(self.state.users)}
+        if parts[0] == 'networks' and len(parts) >= 3 and parts[2] == 'merakiAuthUsers':
+            if parts[1] == 'N3':
+                return self.reply(400, {'errors': ['This network does not support Meraki authentication users']})
+            if method == 'GET':
+                return self.reply(200, [{'id': user_id, 'email': email} for email, user_id in user_ids.items()])
+            if method == 'PUT' and len(parts) == 4:
+                if parts[3] in user_ids.values():
+                    return self.reply(200, {'id': parts[3]})
+                return self.reply(404, {'errors': ['Not found']})
+        if parts[0] == 'organizations' and len(parts) >= 3:
+            if parts[2] == 'networks':
+                return self.reply(200, [{'id': network_id, 'name': f"Network {network_id}"} for network_id in ('N1', 'N2', 'N3')])
+            if parts[2] == 'actionBatches' and method == 'POST':
+                batch_id = uuid.uuid4().hex
+                # Batches are transactional: an update of an unknown user fails the whole batch
+                unknown = [action['resource'] for action in (body or {}).get('actions', []) if action['resource'].rsplit('/', 1)[-1] not in user_ids.values()]
+                if unknown:
+                    batch = {'id': batch_id, 'status': {'completed': False, 'failed': True, 'errors': [f"Merakiauthuser not found: {resource}" for resource in unknown]}}
+                else:
+                    batch = {'id': batch_id, 'status': {'completed': True, 'failed': False, 'errors': []}}
+                with self.state.lock:
+                    self.state.batches[batch_id] = batch
+                return self.reply(201, batch)
+            if parts[2] == 'actionBatches' and len(parts) == 4:
+                return self.reply(200, self.state.batches.get(parts[3], {'id': parts[3], 'status': {'failed': True, 'errors': ['unknown batch']}}))
+        self.reply(404, {'errors': ['Not found']})
+
+class TenableIOHandler(MockHandler):
+    """
+    Tenable.io stand-in. Users are user<i> with id i, credentials are user<i> with uuid cred-<i>.
+    """
+    def route(self, method, path, query, body):
+        parts = path.strip('/').split('/')
+        if parts[0] == 'users':
+            if method == 'GET' and len(parts) == 1:
+                return self.reply(200, {'users': [{'id': i, 'username': name} for i, name in enumerate(self.state.users)]})
+            if method == 'PUT' and len(parts) == 3 and parts[2] == 'chpasswd':
+                if parts[1].isdigit() and int(parts[1]) < len(self.state.users):
+                    return self.reply(200)
+                return self.reply(404, {'error': 'User not found'})
+        if parts[0] == 'credentials':
+            credentials = [{'uuid': f"cred-{i}", 'name': name} for i, name in enumerate(self.state.users)]
+            if method == 'GET' and len(parts) == 1:
+                for value in query.get('f', []):
+                    field, _, text = value.split(':', 2)
+                    credentials = [credential for credential in credentials if credential.get(field) == text]
+                offset = int(query.get('offset', ['0'])[0])
+                limit = int(query.get('limit', ['1000'])[0])
+                return self.reply(200, {'credentials': credentials[offset:offset + limit],
+                                        'pagination': {'total': len(credentials), 'offset': offset, 'limit': limit}})
+            if len(parts) == 2:
+                if method == 'GET':
+                    return self.reply(200, {'name': parts[1], 'description': '', 'ad_hoc': False,
+                                            'settings': {'username': 'scan', 'auth_method': 'Password'}})
+                if method == 'PUT':
+                    return self.reply(200, {'updated': True})
+        self.reply(404, {'error': 'Not found'})
+
+class TenableSCHandler(MockHandler):
+    """
+    Tenable.sc stand-in under /rest. Users are user<i> with id i.
+    """
+    def route(self, method, path, query, body):
+        parts = path.strip('/').split('/')
+        # pyTenable reads the version of the Security Center when it connects
+        if parts == ['rest', 'system']:
+            return self.reply(200, {'type': 'regular', 'response': {'version': '6.4.0', 'buildID': '20240101', 'uuid': 'bench'},
+                                    'error_code': 0, 'error_msg': ''})
+        if parts[:2] == ['rest', 'user']:
+            if method == 'GET' and len(parts) == 2:
+                users = [{'id': str(i), 'username': name} for i, name in enumerate(self.state.users)]
+                return self.reply(200, {'type': 'regular', 'response': users, 'error_code': 0, 'error_msg': ''})
+            if method == 'PATCH' and len(parts) == 3:
+                if parts[2].isdigit() and int(parts[2]) < len(self.state.users):
+                    return self.reply(200, {'type': 'regular', 'response': {'id': parts[2]}, 'error_code': 0, 'error_msg': ''})
+                return self.reply(403, {'type': 'regular', 'response': '', 'error_code': 146, 'error_msg': 'User not found'})
+        self.reply(404, {'type': 'regular', 'response': '', 'error_code': 1, 'error_msg': 'Not found'})
+
+# ALTER USER IDENTIFIER('<name>') SET PASSWORD = '<password>', as the connector sends it with the parameters bound
+ALTER_USER = re.compile(r"ALTER USER IDENTIFIER\('((?:[^'\\]|\\.)*)'\) SET PASSWORD = '((?:[^'\\]|\\.)*)'$")
+
+def unescape(value):
+    """
+    Returns:
+    - str: A string literal of a statement, without the escaping of the connector.
+    """
+    return re.sub(r"\\(.)", lambda match: {'n': '\n', 'r': '\r'}.get(match.group(1), match.group(1)), value)
+
+# SHOW USERS LIKE '<pattern>' of a sweep
+SHOW_USERS = re.compile(r"SHOW USERS LIKE '((?:[^'\\]|\\.)*)'$")
+
+class SnowflakeHandler(MockHandler):
+    """
+    Snowflake stand-in for snowflake-connector-python over plain HTTP. Every statement succeeds,
+    except ALTER USER for a user the backend does not hold or in another form than the script sends.
+    SHOW USERS LIKE returns the matching users, exactly as stored.
+    """
+    def reply_rows(self, column, rows):
+        self.reply(200, {'success': True, 'data': {
+            'queryId': uuid.uuid4().hex, 'queryResultFormat': 'json', 'parameters': [],
+            'rowtype': [{'name': column, 'type': 'text', 'nullable': True, 'length': 256,
+                         'precision': None, 'scale': None, 'byteLength': 256}],
+            'rowset': rows, 'total': len(rows), 'returned': len(rows),
+            'statementTypeId': 0}})
+
+    def route(self, method, path, query, body):
+        if path.startswith('/session/v1/login-request'):
+            return self.reply(200, {'success': True, 'data': {
+                'token': uuid.uuid4().hex, 'masterToken': uuid.uuid4().hex,
+                'validityInSeconds': 3600, 'masterValidityInSeconds': 14400,
+                'sessionId': 1, 'parameters': [],
+                'sessionInfo': {'databaseName': None, 'schemaName': None, 'warehouseName': None, 'roleName': 'ACCOUNTADMIN'}}})
+        if path.startswith('/queries/v1/query-request'):
+            statement = (body or {}).get('sqlText', '')
+            if statement.upper().startswith('ALTER USER'):
+                match = ALTER_USER.match(statement)
+                if not match:
+                    return self.reply(200, {'success': False, 'code': '001003', 'message': 'SQL compilation error: syntax error',
+                                            'data': {'queryId': uuid.uuid4().hex, 'sqlState': '42000'}})
+                name = unescape(match.group(1))
+                if name.strip('"').lower() not in self.state.users:
+                    return self.reply(200, {'success': False, 'code': '002003', 'message': f"User '{name}' does not exist or not authorized.",
+                                            'data': {'queryId': uuid.uuid4().hex, 'sqlState': '02000'}})
+                with self.state.lock:
+                    self.state.passwords[name.strip('"').lower()] = unescape(match.group(2))
+            match = SHOW_USERS.match(statement)
+            if match:
+                like = re.escape(unescape(match.group(1))).replace('%', '.*').replace('_', '.')
+                return self.reply_rows('name', [[name] for name in self.state.users if re.fullmatch(like, name, re.IGNORECASE)])
+            return self.reply_rows('status', [['Statement executed successfully.']])
+        # Status of an asynchronous statement, which completed when it was submitted
+        if path.startswith('/monitoring/queries/'):
+            return self.reply(200, {'success': True, 'data': {'queries': [{'id': path.rsplit('/', 1)[1], 'status': 'SUCCESS'}]}})
+        # Session delete, heartbeat and telemetry
+        self.reply(200, {'success': True, 'data': {}})
+
+class MockServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default listen backlog of 5 drops connections when many rotations connect at once
+    request_queue_size = 128
+
+    def handle_error(self, request, client_address):
+        # A rotation that timed out closes its connection before the delayed reply is sent
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+HANDLERS = {
+    'cisco-ios-xe': RestconfHandler,
+    'cisco-meraki': MerakiHandler,
+    'tenable-io-user': TenableIOHandler,
+    'tenable-credential': TenableIOHandler,
+    'tenable-sc-user': TenableSCHandler,
+    'snowflake': SnowflakeHandler,
+}
+
+def start_backend(backend, state):
+    """
+    Starts the stand-in server of a backend on a free local port, in a daemon thread.
+
+    Args:
+    - backend (str): The backend name, one of HANDLERS.
+    - state (BackendState): The configuration and counters of the server.
+
+    Returns:
+    - MockServer: The running server. Its port is server.server_address[1].
+    """
+    server = MockServer(('127.0.0.1', 0), HANDLERS[backend])
+    server.state = state
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
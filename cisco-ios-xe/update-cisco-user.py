@@ -10,10 +10,17 @@ NOTE: If spaces are present in the path to the python interpreter, the script wi
     For example: sudo ln -s "/usr/local/bin/my python3.7" /usr/local/bin/pam_rotation_venv_python3
 '''
 
+import os
 import sys
+import time
 import base64
 import json
+import threading
+from contextlib import nullcontext
 import urllib3
+from urllib.parse import quote
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 '''
 Optionally display installed packages for debugging. Uncomment if needed.
@@ -32,6 +39,146 @@ except ImportError:
     print("# Error: The 'requests' package is not installed. Run 'pip install requests' to install it.")
     exit(1)
 
+# The timing spans are recorded with rotation_trace of the pam_rotate directory of pam-scripts, when that directory is
+# next to the directory of this script, as in the repository. Without it the script runs without tracing.
+try:
+    import rotation_trace
+except ImportError:
+    sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'pam_rotate'))
+    try:
+        import rotation_trace
+    except ImportError:
+        rotation_trace = None
+        if os.environ.get('PAM_TRACE_FILE'):
+            print("# Warning: PAM_TRACE_FILE is set, but the 'rotation_trace' module of the pam_rotate directory could not be imported. No spans are recorded.")
+
+# Fleet mode settings: maximum number of devices rotated at the same time, and per site.
+FLEET_MAX_WORKERS = 32
+FLEET_PER_SITE_LIMIT = 4
+
+# Size of the HTTP connection pool shared by all requests of this script.
+# Matches the fleet workers so every device being rotated keeps its connection open.
+HTTP_POOL_SIZE = FLEET_MAX_WORKERS
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
+    """
+    Returns the HTTP session shared by all requests of this script.
+    The session keeps its connections alive, so the lookup and the update of a rotation reuse
+    the same TCP and TLS connection instead of doing a new handshake for every request.
+    Returns:
+    - requests.Session: The shared session.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+            _session.mount('https://', adapter)
+            _session.mount('http://', adapter)
+    return _session
+
+# Overall time budget of one rotation on one device, in seconds. Looking up the user and updating the password
+# draw from the same budget. A request that would run past it is cut off and the rotation is reported as timed out.
+# Can be overridden with the CISCO_ROTATION_TIMEOUT environment variable.
+CISCO_ROTATION_TIMEOUT = float(os.environ.get('CISCO_ROTATION_TIMEOUT', 60))
+# Maximum time to open the connection to a device, in seconds, within the budget.
+CISCO_CONNECT_TIMEOUT = 10
+
+class DeadlineExceeded(requests.exceptions.Timeout):
+    """
+    Raised instead of sending a request when the time budget of the rotation is used up.
+    """
+
+_deadline = threading.local()
+
+def start_deadline(seconds=None):
+    """
+    Starts the time budget of a rotation on the current thread.
+    Args:
+    - seconds (float): The budget in seconds, CISCO_ROTATION_TIMEOUT if not given.
+    Returns:
+    - None
+    """
+    if seconds is None:
+        seconds = CISCO_ROTATION_TIMEOUT
+    _deadline.expires = time.monotonic() + seconds
+
+def request_timeout():
+    """
+    Returns the timeouts for the next request, from the time left in the budget of the rotation on this thread.
+    Returns:
+    - (float, float): The connect and read timeouts. Raises DeadlineExceeded if no time is left.
+    """
+    expires = getattr(_deadline, 'expires', None)
+    remaining = CISCO_ROTATION_TIMEOUT if expires is None else expires - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceeded(f"the rotation did not complete within {CISCO_ROTATION_TIMEOUT} seconds")
+    return (min(CISCO_CONNECT_TIMEOUT, remaining), remaining)
+
+# Size of the chunks a response body is read in, in bytes. The budget of the rotation is checked after each chunk.
+HTTP_CHUNK_SIZE = 1024
+
+def restconf_request(method, url, cisco_admin_username, cisco_admin_password, **kwargs):
+    """
+    Sends a RESTCONF request within the time budget of the rotation on this thread.
+    The timeouts of requests apply to opening the connection and to each read from the socket, not to the whole
+    response, so a device that keeps sending slowly could hold the rotation past its budget. The body is read in
+    chunks of HTTP_CHUNK_SIZE bytes instead, and the budget is checked after each of them.
+    Args:
+    - method (str): The HTTP method.
+    - url (str): The request URL.
+    - cisco_admin_username (str): The username of the Cisco admin account.
+    - cisco_admin_password (str): The password of the Cisco admin account.
+    - kwargs: Further arguments of requests.Session.request, e.g. headers, params or data.
+    Returns:
+    - requests.Response: The response, with its body read. Raises DeadlineExceeded if the budget is used up.
+    """
+    response = get_session().request(method, url, auth=(cisco_admin_username,cisco_admin_password), verify=False, timeout=request_timeout(), stream=True, **kwargs)
+    try:
+        body = bytearray()
+        for chunk in response.iter_content(HTTP_CHUNK_SIZE):
+            body += chunk
+            request_timeout()
+        response._content = bytes(body)
+    finally:
+        response.close()
+    return response
+
+# Optional timing spans, recorded with rotation_trace of the pam_rotate directory. Set the PAM_TRACE_FILE environment
+# variable to a file path to append one JSON line per phase of each rotation. Without the pam_rotate directory next
+# to the directory of this script, the script runs without tracing.
+PAM_TRACE_SERVICE = 'cisco-ios-xe'
+
+def start_trace(trace_id=None):
+    """
+    Starts a trace for one rotation, see rotation_trace.start_trace.
+
+    Args:
+    - trace_id (str): The trace to join. A new trace is started if None.
+
+    Returns:
+    - str: The trace id, None without tracing.
+    """
+    return rotation_trace.start_trace(trace_id) if rotation_trace else None
+
+def current_trace_id():
+    """
+    Returns:
+    - str: The trace id of the rotation on this thread, to pass to start_trace() on worker threads.
+    """
+    return rotation_trace.current_trace_id() if rotation_trace else None
+
+def trace_span(name, **attributes):
+    """
+    Records the duration of one phase of the rotation if PAM_TRACE_FILE is set, see rotation_trace.trace_span.
+    """
+    if rotation_trace is None:
+        return nullcontext()
+    return rotation_trace.trace_span(name, PAM_TRACE_SERVICE, **attributes)
+
 def get_username_details(cisco_url, cisco_admin_username, cisco_admin_password, cisco_user_name):
     """
     Verify the Cisco user.
@@ -41,38 +188,96 @@ def get_username_details(cisco_url, cisco_admin_username, cisco_admin_password,
     - cisco_admin_password (str): The password of the Cisco admin account.
     - cisco_user_name (str): The name of the Cisco user whose password needs to be rotated.
     Returns:
-    - True if username found.
+    - True if username found. Raises requests.exceptions.Timeout if the device does not answer in time, and
+      requests.exceptions.ConnectionError if it cannot be reached.
     """
     
-    # Constructs the request URL for the username API endpoint
-    request_url = f"{cisco_url}username/"
-    
     # Sets the headers for the RESTCONF request, specifying that we expect and send YANG data in JSON format
     headers = {
     'Accept': 'application/yang-data+json',
     'Content-Type': 'application/yang-data+json'
     }
+
+    with trace_span('target_lookup', target=cisco_url):
+        # Looks up the single username list entry first, and only falls back to the full list if the device does not support it
+        user_found = lookup_username_entry(cisco_url, headers, cisco_admin_username, cisco_admin_password, cisco_user_name)
+        if user_found is not None:
+            return user_found
+
+        # Fetches the full username list and checks it for the specified user
+        usernames = fetch_usernames(cisco_url, headers, cisco_admin_username, cisco_admin_password)
+    # Returns True if the specified username is found
+    return usernames is not None and cisco_user_name in usernames
+
+def fetch_usernames(cisco_url, headers, cisco_admin_username, cisco_admin_password):
+    """
+    Fetches the names of all local users of the Cisco device.
+    Args:
+    - cisco_url (str): The host endpoint of the Cisco account to connect to.
+    - headers (dict): The RESTCONF request headers.
+    - cisco_admin_username (str): The username of the Cisco admin account.
+    - cisco_admin_password (str): The password of the Cisco admin account.
+    Returns:
+    - set: The usernames found on the device, or None if they could not be fetched.
+      Raises requests.exceptions.Timeout if the device does not answer in time, and
+      requests.exceptions.ConnectionError if it cannot be reached.
+    """
+
+    # Constructs the request URL for the username API endpoint
+    request_url = f"{cisco_url}username/"
+    
     try:
         # Sends a GET request to the Cisco router to fetch user details
-        response = requests.get(request_url, headers=headers, auth=(cisco_admin_username,cisco_admin_password), verify=False)
+        response = restconf_request('GET', request_url, cisco_admin_username, cisco_admin_password, headers=headers)
         response.raise_for_status()
         data = response.json()
         # Extracts the list of usernames from the response data
-        usernames = data["Cisco-IOS-XE-native:username"]
-        # Iterates through the list of usernames to find the specified user
-        for user in usernames:
-            if user["name"]==cisco_user_name:
-                # Returns True if the specified username is found
-                return True
+        return {user["name"] for user in data["Cisco-IOS-XE-native:username"]}
+    except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
+        raise
     except requests.exceptions.HTTPError as http_err:
         print(f"HTTP error occurred while fetching username details from Cisco router: {http_err}")
     except Exception as err:
         print(f"An error occurred: {err}")
-    return False
+    return None
 
-def rotate(cisco_url, cisco_admin_username, cisco_admin_password, cisco_user_name, new_password):
+def lookup_username_entry(cisco_url, headers, cisco_admin_username, cisco_admin_password, cisco_user_name):
     """
-    Rotate the password for a given Cisco user.
+    Checks whether the Cisco user exists by fetching only its username list entry.
+    The response is restricted to the name field, so it does not contain password hashes and its size
+    does not depend on the number of local users on the device.
+    Args:
+    - cisco_url (str): The host endpoint of the Cisco account to connect to.
+    - headers (dict): The RESTCONF request headers.
+    - cisco_admin_username (str): The username of the Cisco admin account.
+    - cisco_admin_password (str): The password of the Cisco admin account.
+    - cisco_user_name (str): The name of the Cisco user whose password needs to be rotated.
+    Returns:
+    - True if username found, False if it does not exist, None if the keyed lookup is not supported.
+      Raises requests.exceptions.Timeout if the device does not answer in time, and
+      requests.exceptions.ConnectionError if it cannot be reached.
+    """
+
+    # Constructs the request URL for the list entry of the user, e.g. .../native/username=admin
+    request_url = f"{cisco_url}username={quote(cisco_user_name, safe='')}"
+    try:
+        response = restconf_request('GET', request_url, cisco_admin_username, cisco_admin_password, headers=headers, params={'fields': 'name'})
+        # RESTCONF answers 404 for a list entry that does not exist
+        if response.status_code == 404:
+            return False
+        if response.status_code == 200:
+            usernames = response.json().get("Cisco-IOS-XE-native:username", [])
+            return any(user.get("name") == cisco_user_name for user in usernames)
+    except (requests.exceptions.Timeout, requests.exceptions.ConnectionError):
+        # A device that does not answer in time, or cannot be reached, would not answer the full list either
+        raise
+    except (requests.exceptions.RequestException, ValueError):
+        pass
+    return None
+
+def update_user_password(cisco_url, cisco_admin_username, cisco_admin_password, cisco_user_name, new_password):
+    """
+    Sends the RESTCONF PATCH request that sets the password of a Cisco user.
     Args:
     - cisco_url (str): The host endpoint of the Cisco account to connect to.
     - cisco_admin_username (str): The username of the Cisco admin account.
@@ -80,24 +285,30 @@ def rotate(cisco_url, cisco_admin_username, cisco_admin_password, cisco_user_nam
     - cisco_user_name (str): The name of the Cisco user whose password needs to be rotated.
     - new_password (str): The new password to be set for the Cisco user.
     Returns:
-    - None
+    - None. Raises requests.exceptions.RequestException if the update fails.
+    """
+    update_user_passwords(cisco_url, cisco_admin_username, cisco_admin_password, {cisco_user_name: new_password})
+
+def update_user_passwords(cisco_url, cisco_admin_username, cisco_admin_password, new_passwords):
+    """
+    Sends one RESTCONF PATCH request that sets the passwords of several Cisco users.
+    The device applies the whole payload as one configuration change.
+    Args:
+    - cisco_url (str): The host endpoint of the Cisco account to connect to.
+    - cisco_admin_username (str): The username of the Cisco admin account.
+    - cisco_admin_password (str): The password of the Cisco admin account.
+    - new_passwords (dict): The new password to be set, by Cisco user name.
+    Returns:
+    - None. Raises requests.exceptions.RequestException if the update fails.
     """
-    
-    # Calls the function get_username_details to check if the specified user exists on the Cisco router
-    user = get_username_details(cisco_url, cisco_admin_username, cisco_admin_password, cisco_user_name)
 
-    # If the user does not exist, print an error message and exit the program
-    if not user:
-        print(f"No user found with the username: {cisco_user_name}")
-        exit(1)
-    
     # Sets the headers for the RESTCONF request, specifying that we expect and send YANG data in JSON format
     headers = {
     'Accept': 'application/yang-data+json',
     'Content-Type': 'application/yang-data+json'
     }
 
-    # Creates the data payload for the PATCH request to update the user's password
+    # Creates the data payload for the PATCH request to update the users' passwords
     data = {
     "Cisco-IOS-XE-native:native": {
         "username": [
@@ -107,20 +318,265 @@ def rotate(cisco_url, cisco_admin_username, cisco_admin_password, cisco_user_nam
                     "password": new_password
                     }
                 }
+                for cisco_user_name, new_password in new_passwords.items()
             ]
         }
     }
+
+    with trace_span('update', target=cisco_url, users=len(new_passwords)):
+        response = restconf_request('PATCH', cisco_url, cisco_admin_username, cisco_admin_password, headers=headers, data=json.dumps(data))
+        response.raise_for_status()
+
+def rotate(cisco_url, cisco_admin_username, cisco_admin_password, cisco_user_name, new_password):
+    """
+    Rotate the password for a given Cisco user.
+    Args:
+    - cisco_url (str): The host endpoint of the Cisco account to connect to.
+    - cisco_admin_username (str): The username of the Cisco admin account.
+    - cisco_admin_password (str): The password of the Cisco admin account.
+    - cisco_user_name (str): The name of the Cisco user whose password needs to be rotated.
+    - new_password (str): The new password to be set for the Cisco user.
+    Returns:
+    - None
+    """
+    
+    start_deadline()
+
+    # Calls the function get_username_details to check if the specified user exists on the Cisco router
+    try:
+        user = get_username_details(cisco_url, cisco_admin_username, cisco_admin_password, cisco_user_name)
+    except requests.exceptions.Timeout as timeout_err:
+        print(f"# Error: Timed out while looking up the user {cisco_user_name}: {timeout_err}")
+        exit(1)
+    except requests.exceptions.ConnectionError as conn_err:
+        print(f"# Error: Unable to connect to the Cisco router: {conn_err}")
+        exit(1)
+
+    # If the user does not exist, print an error message and exit the program
+    if not user:
+        print(f"No user found with the username: {cisco_user_name}")
+        exit(1)
     
     try:
         # Sends a PATCH request to the Cisco router to update the user's password
-        response = requests.patch(cisco_url, headers=headers, auth=(cisco_admin_username,cisco_admin_password), data=json.dumps(data), verify=False)
-        response.raise_for_status()
+        update_user_password(cisco_url, cisco_admin_username, cisco_admin_password, cisco_user_name, new_password)
         print(f"Password updated successfully for user {cisco_user_name}")
+    except requests.exceptions.Timeout as timeout_err:
+        print(f"# Error: Timed out while updating the password for the given user: {timeout_err}")
+        exit(1)
     except requests.exceptions.HTTPError as http_err:
         print(f"HTTP error occurred while updating the password for the given user: {http_err}")
     except Exception as err:
         print(f"An error occurred: {err}")
 
+def update_users(cisco_url, cisco_admin_username, cisco_admin_password, new_passwords):
+    """
+    Rotate the passwords for several Cisco users of the same device with a single PATCH request, without printing.
+    Args:
+    - cisco_url (str): The host endpoint of the Cisco account to connect to.
+    - cisco_admin_username (str): The username of the Cisco admin account.
+    - cisco_admin_password (str): The password of the Cisco admin account.
+    - new_passwords (dict): The new password to be set, by Cisco user name.
+    Returns:
+    - dict: The status of every user, by Cisco user name.
+    """
+
+    # Sets the headers for the RESTCONF request, specifying that we expect and send YANG data in JSON format
+    headers = {
+    'Accept': 'application/yang-data+json',
+    'Content-Type': 'application/yang-data+json'
+    }
+
+    # Checks all users against a single fetch of the username list
+    failure = "failed: username list could not be fetched"
+    try:
+        usernames = fetch_usernames(cisco_url, headers, cisco_admin_username, cisco_admin_password)
+    except requests.exceptions.Timeout:
+        usernames, failure = None, "timed out"
+    except requests.exceptions.ConnectionError as conn_err:
+        usernames, failure = None, f"failed: {conn_err}"
+    if usernames is None:
+        return {cisco_user_name: failure for cisco_user_name in new_passwords}
+
+    results = {cisco_user_name: "user not found" for cisco_user_name in new_passwords if cisco_user_name not in usernames}
+    found = {cisco_user_name: new_password for cisco_user_name, new_password in new_passwords.items() if cisco_user_name in usernames}
+    if found:
+        # The PATCH is applied as a whole, so all users in it share its outcome
+        try:
+            update_user_passwords(cisco_url, cisco_admin_username, cisco_admin_password, found)
+            status = "updated"
+        except requests.exceptions.Timeout:
+            status = "timed out"
+        except requests.exceptions.HTTPError as http_err:
+            status = f"HTTP error: {http_err}"
+        except Exception as err:
+            status = f"error: {err}"
+        results.update({cisco_user_name: status for cisco_user_name in found})
+    return results
+
+def rotate_batch(cisco_url, cisco_admin_username, cisco_admin_password, new_passwords):
+    """
+    Rotate the passwords for several Cisco users of the same device with a single PATCH request.
+    Args:
+    - cisco_url (str): The host endpoint of the Cisco account to connect to.
+    - cisco_admin_username (str): The username of the Cisco admin account.
+    - cisco_admin_password (str): The password of the Cisco admin account.
+    - new_passwords (dict): The new password to be set, by Cisco user name.
+    Returns:
+    - dict: The status of every user, by Cisco user name.
+    """
+
+    start_deadline()
+    results = update_users(cisco_url, cisco_admin_username, cisco_admin_password, new_passwords)
+
+    # Print the per-user result table
+    width = max(len('User'), *(len(cisco_user_name) for cisco_user_name in new_passwords))
+    print(f"{'User':<{width}}  Status")
+    for cisco_user_name in new_passwords:
+        print(f"{cisco_user_name:<{width}}  {results[cisco_user_name]}")
+    return results
+
+def rotate_device(device, cisco_user_name, new_password):
+    """
+    Rotate the password for a Cisco user on one device of a fleet.
+    Args:
+    - device (dict): The device with its 'endpoint', 'site', 'url', 'login' and 'password'.
+    - cisco_user_name (str): The name of the Cisco user whose password needs to be rotated.
+    - new_password (str): The new password to be set for the Cisco user.
+    Returns:
+    - (bool, str): True if the password was updated, and the status of the device.
+    """
+    # The budget starts once the device has its turn, waiting for the other devices of the site is not counted
+    start_deadline()
+    try:
+        # Check that the user exists on this device before updating it
+        if not get_username_details(device['url'], device['login'], device['password'], cisco_user_name):
+            return False, "user not found"
+        update_user_password(device['url'], device['login'], device['password'], cisco_user_name, new_password)
+        return True, "updated"
+    except requests.exceptions.Timeout:
+        return False, "timed out"
+    except requests.exceptions.HTTPError as http_err:
+        return False, f"HTTP error: {http_err}"
+    except Exception as err:
+        return False, f"error: {err}"
+
+def rotate_device_batch(device, new_passwords):
+    """
+    Rotate the passwords for several Cisco users on one device of a fleet, with a single PATCH request.
+    Args:
+    - device (dict): The device, see rotate_device.
+    - new_passwords (dict): The new password to be set, by Cisco user name.
+    Returns:
+    - dict: The status of every user, by Cisco user name.
+    """
+    # The budget starts once the device has its turn, as in rotate_device
+    start_deadline()
+    return update_users(device['url'], device['login'], device['password'], new_passwords)
+
+def schedule_fleet(devices, rotate_one, max_workers=FLEET_MAX_WORKERS, per_site_limit=FLEET_PER_SITE_LIMIT):
+    """
+    Runs a rotation on many devices concurrently.
+    The devices wait in one queue per site. A device is handed to a worker only when its site is below per_site_limit,
+    taking the sites in turn, so no worker ever waits for a busy site while devices of other sites are waiting.
+    Args:
+    - devices (list): The devices to update, see rotate_device.
+    - rotate_one (callable): Called with a device on a worker thread, returns its result. Must not print.
+    - max_workers (int): Maximum number of devices rotated at the same time.
+    - per_site_limit (int): Maximum number of devices of the same site rotated at the same time.
+    Returns:
+    - list: The result of rotate_one for each device, in the order of the given devices.
+    """
+    workers = min(max_workers, len(devices))
+    queues = {}
+    for index, device in enumerate(devices):
+        queues.setdefault(device['site'], deque()).append(index)
+    running = {site: 0 for site in queues}
+    sites = deque(queues)
+    results = [None] * len(devices)
+
+    with ThreadPoolExecutor(max_workers=workers, initializer=start_trace, initargs=(current_trace_id(),)) as executor:
+        futures = {}
+
+        def submit_ready():
+            # Take the sites in turn, one device at a time, until the workers are busy or no site can start another device
+            skipped = 0
+            while len(futures) < workers and skipped < len(sites):
+                site = sites[0]
+                sites.rotate(-1)
+                if not queues[site] or running[site] >= per_site_limit:
+                    skipped += 1
+                    continue
+                skipped = 0
+                index = queues[site].popleft()
+                running[site] += 1
+                futures[executor.submit(rotate_one, devices[index])] = index
+
+        submit_ready()
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = futures.pop(future)
+                running[devices[index]['site']] -= 1
+                results[index] = future.result()
+            submit_ready()
+    return results
+
+def rotate_fleet(devices, cisco_user_name, new_password, max_workers=FLEET_MAX_WORKERS, per_site_limit=FLEET_PER_SITE_LIMIT):
+    """
+    Rotate the password for the same Cisco user on many devices concurrently, see schedule_fleet.
+    Args:
+    - devices (list): The devices to update, see rotate_device.
+    - cisco_user_name (str): The name of the Cisco user whose password needs to be rotated.
+    - new_password (str): The new password to be set for the Cisco user.
+    - max_workers (int): Maximum number of devices rotated at the same time.
+    - per_site_limit (int): Maximum number of devices of the same site rotated at the same time.
+    Returns:
+    - list: One (device, success, status) tuple per device, in the order of the given devices.
+    """
+    outcomes = schedule_fleet(devices, lambda device: rotate_device(device, cisco_user_name, new_password), max_workers, per_site_limit)
+    results = [(device, *outcome) for device, outcome in zip(devices, outcomes)]
+
+    # Print the per-device result table
+    width = max(len('Device'), *(len(device['endpoint']) for device in devices))
+    site_width = max(len('Site'), *(len(device['site']) for device in devices))
+    print(f"{'Device':<{width}}  {'Site':<{site_width}}  Status")
+    for device, success, status in results:
+        print(f"{device['endpoint']:<{width}}  {device['site']:<{site_width}}  {status}")
+
+    updated = sum(1 for _, success, _ in results if success)
+    print(f"Password updated for user {cisco_user_name} on {updated} of {len(results)} devices")
+    return results
+
+def rotate_fleet_batch(devices, new_passwords, max_workers=FLEET_MAX_WORKERS, per_site_limit=FLEET_PER_SITE_LIMIT):
+    """
+    Rotate the passwords for several Cisco users on many devices concurrently, with a single PATCH request per device.
+    The devices are scheduled like in rotate_fleet, see schedule_fleet.
+    Args:
+    - devices (list): The devices to update, see rotate_device.
+    - new_passwords (dict): The new password to be set, by Cisco user name.
+    - max_workers (int): Maximum number of devices rotated at the same time.
+    - per_site_limit (int): Maximum number of devices of the same site rotated at the same time.
+    Returns:
+    - list: One (device, results) tuple per device, in the order of the given devices. results is the status of every
+      user, by Cisco user name.
+    """
+    outcomes = schedule_fleet(devices, lambda device: rotate_device_batch(device, new_passwords), max_workers, per_site_limit)
+    results = list(zip(devices, outcomes))
+
+    # Print the per-device and per-user result table
+    width = max(len('Device'), *(len(device['endpoint']) for device in devices))
+    site_width = max(len('Site'), *(len(device['site']) for device in devices))
+    user_width = max(len('User'), *(len(cisco_user_name) for cisco_user_name in new_passwords))
+    print(f"{'Device':<{width}}  {'Site':<{site_width}}  {'User':<{user_width}}  Status")
+    for device, statuses in results:
+        for cisco_user_name in new_passwords:
+            print(f"{device['endpoint']:<{width}}  {device['site']:<{site_width}}  {cisco_user_name:<{user_width}}  {statuses[cisco_user_name]}")
+
+    updated = sum(1 for _, statuses in results if all(status == "updated" for status in statuses.values()))
+    print(f"Passwords updated for {len(new_passwords)} users on {updated} of {len(results)} devices")
+    return results
+
 def main():
     """
     Main function to rotate the password for a Cisco device user.
@@ -129,46 +585,102 @@ def main():
     and the new password. Then, updates the password of the specified Cisco device user.
     """
     record_title = 'Cisco Authentication Record' #This should be same as the title of the record containing username, password and host endpoint details. 
-    api_access_token_record = None
+    api_access_token_records = []
     params = None
     
+    start_trace()
     # Read and decode input parameters from stdin
     for base64_params in sys.stdin:
-        params = json.loads(base64.b64decode(base64_params).decode())
+        with trace_span('decode'):
+            params = json.loads(base64.b64decode(base64_params).decode())
 
-        # Decode and load records passed in as JSON strings from the PAM Script section as "Rotation Credential" records
-        records = json.loads(base64.b64decode(params.get('records')).decode())
-        # Find the record that matches the specified title
-        api_access_token_record = next((record for record in records if record['title'].lower() == record_title.lower()), None)
+        with trace_span('record_lookup'):
+            # Decode and load records passed in as JSON strings from the PAM Script section as "Rotation Credential" records
+            records = json.loads(base64.b64decode(params.get('records')).decode())
+            # Find the records that match the specified title. Several records are rotated in fleet mode.
+            api_access_token_records = [record for record in records if record['title'].lower() == record_title.lower()]
         break
 
-    if api_access_token_record is None:
+    if not api_access_token_records:
         print(f"# Error: No Record with the access token found. Title: {record_title}")
         exit(1)
-    
-    # Extract Details from the record
-    # HostName endpoint of the Cisco device endpoint.
-    cisco_router_endpoint = api_access_token_record.get('host_endpoint') 
-    # Admin username for the Cisco device
-    cisco_admin_username = api_access_token_record.get('login')
-    # Admin password for the Cisco device
-    cisco_admin_password = api_access_token_record.get('password')
 
+    rotate_from_params(params, api_access_token_records)
+
+def rotate_from_params(params, api_access_token_records):
+    """
+    Rotates the password(s) described by a decoded params payload.
+    Used by main() and by the shared pam_rotate entry point, which decode the payload and find the records.
+
+    Args:
+    - params (dict): The decoded params payload.
+    - api_access_token_records (list): The Rotation Credential records titled 'Cisco Authentication Record'.
+
+    Returns:
+    - None. Exits with an error if a password was not updated.
+    """
     # Username of the Cisco device user whose password needs to be rotated
     cisco_user_name = params.get('user')
     # New password to set for the Cisco device user
     new_password = params.get('newPassword')
-    
-    # Check if all required fields are present
-    if not all([cisco_router_endpoint, cisco_admin_username, cisco_admin_password, cisco_user_name]):
-        print("# Error: One or more required fields are missing in the access token record.")
-        exit(1)
-    
-    # Construct the Cisco API URL
-    cisco_url = f"https://{cisco_router_endpoint}/restconf/data/Cisco-IOS-XE-native:native/"
+    # Optional list of {"user": ..., "newPassword": ...} entries to rotate several users of the device at once
+    batch = params.get('users')
 
-    # Rotate the password for the specified Cisco device user
-    rotate(cisco_url, cisco_admin_username, cisco_admin_password, cisco_user_name, new_password)
+    devices = []
+    for api_access_token_record in api_access_token_records:
+        # Extract Details from the record
+        # HostName endpoint of the Cisco device endpoint. A comma separated list of endpoints enables fleet mode.
+        cisco_router_endpoints = [endpoint.strip() for endpoint in (api_access_token_record.get('host_endpoint') or '').split(',') if endpoint.strip()]
+        # Admin username for the Cisco device
+        cisco_admin_username = api_access_token_record.get('login')
+        # Admin password for the Cisco device
+        cisco_admin_password = api_access_token_record.get('password')
+        # Optional site of the devices, used to cap the concurrent rotations per site in fleet mode
+        site = api_access_token_record.get('site')
+
+        # Check if all required fields are present
+        if not all([cisco_router_endpoints, cisco_admin_username, cisco_admin_password, cisco_user_name or batch]):
+            print("# Error: One or more required fields are missing in the access token record.")
+            exit(1)
+
+        for cisco_router_endpoint in cisco_router_endpoints:
+            devices.append({
+                'endpoint': cisco_router_endpoint,
+                'site': site or cisco_router_endpoint,
+                # Construct the Cisco API URL
+                'url': f"https://{cisco_router_endpoint}/restconf/data/Cisco-IOS-XE-native:native/",
+                'login': cisco_admin_username,
+                'password': cisco_admin_password
+            })
+
+    if batch:
+        if not isinstance(batch, list) or not all(isinstance(entry, dict) and entry.get('user') and entry.get('newPassword') for entry in batch):
+            print("# Error: Every entry of the users list needs a user and a newPassword.")
+            exit(1)
+        # Batch mode: rotate all given users of each device with a single PATCH request
+        new_passwords = {entry['user']: entry['newPassword'] for entry in batch}
+        if len(devices) == 1:
+            device = devices[0]
+            results = rotate_batch(device['url'], device['login'], device['password'], new_passwords)
+            updated = all(status == "updated" for status in results.values())
+        else:
+            # Several devices are rotated concurrently, like in fleet mode
+            results = rotate_fleet_batch(devices, new_passwords)
+            updated = all(status == "updated" for _, statuses in results for status in statuses.values())
+        if not updated:
+            exit(1)
+        return
+
+    if len(devices) == 1:
+        # Rotate the password for the specified Cisco device user
+        device = devices[0]
+        rotate(device['url'], device['login'], device['password'], cisco_user_name, new_password)
+        return
+
+    # Fleet mode: rotate the password for the user on every device
+    results = rotate_fleet(devices, cisco_user_name, new_password)
+    if not all(success for _, success, _ in results):
+        exit(1)
 
 if __name__ == "__main__":
     main()
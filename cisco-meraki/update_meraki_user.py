@@ -10,10 +10,15 @@ NOTE: If spaces are present in the path to the python interpreter, the script wi
     For example: sudo ln -s "/usr/local/bin/my python3.7" /usr/local/bin/pam_rotation_venv_python3
 '''
 
+import os
 import sys
 import base64
 import json
+import time
+import threading
 import urllib3
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 '''
 Optionally display installed packages for debugging. Uncomment if needed.
@@ -32,37 +37,398 @@ except ImportError:
     print("# Error: The 'requests' package is not installed. Run 'pip install requests' to install it.")
     exit(1)
 
-def fetch_meraki_user_by_email(api_key, network_id, email):
+# The timing spans are recorded with rotation_trace of the pam_rotate directory of pam-scripts, when that directory is
+# next to the directory of this script, as in the repository. Without it the script runs without tracing.
+try:
+    import rotation_trace
+except ImportError:
+    sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'pam_rotate'))
+    try:
+        import rotation_trace
+    except ImportError:
+        rotation_trace = None
+        if os.environ.get('PAM_TRACE_FILE'):
+            print("# Warning: PAM_TRACE_FILE is set, but the 'rotation_trace' module of the pam_rotate directory could not be imported. No spans are recorded.")
+
+# Base URL of the Meraki Dashboard API. Regional dashboards, e.g. China or Canada, use a different host.
+MERAKI_API_URL = 'https://api.meraki.com/api/v1'
+
+# Size of the HTTP connection pool shared by all requests of this script.
+HTTP_POOL_SIZE = 10
+
+_session = None
+_session_lock = threading.Lock()
+
+def get_session():
     """
-    Fetches User details by email.
+    Returns the HTTP session shared by all requests of this script.
+    The session keeps its connections alive, so the lookup and the update of a rotation reuse
+    the same TCP and TLS connection instead of doing a new handshake for every request.
+    Returns:
+    - requests.Session: The shared session.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = requests.adapters.HTTPAdapter(pool_connections=HTTP_POOL_SIZE, pool_maxsize=HTTP_POOL_SIZE)
+            _session.mount('https://', adapter)
+            _session.mount('http://', adapter)
+    return _session
+
+# Meraki allows 10 API requests per second for each organization.
+MERAKI_RATE_LIMIT = 10
+# Number of times a throttled (429) request is retried before it is reported as failed.
+MERAKI_MAX_RETRIES = 5
+
+# Overall time budget of one rotation, in seconds. Waiting for the rate limit, looking up the user and updating the
+# password all draw from the same budget. A request that would run past it is cut off and reported as timed out.
+# Can be overridden with the MERAKI_ROTATION_TIMEOUT environment variable.
+MERAKI_ROTATION_TIMEOUT = float(os.environ.get('MERAKI_ROTATION_TIMEOUT', 60))
+# Maximum time to open the connection to the Meraki API, in seconds, within the budget.
+MERAKI_CONNECT_TIMEOUT = 10
+
+class DeadlineExceeded(requests.exceptions.Timeout):
+    """
+    Raised instead of sending or waiting for a request when the time budget of the rotation is used up.
+    """
+
+_deadline = threading.local()
+
+def start_deadline(seconds=None):
+    """
+    Starts the time budget of a rotation on the current thread.
+    Args:
+    - seconds (float): The budget in seconds, MERAKI_ROTATION_TIMEOUT if not given.
+    Returns:
+    - None
+    """
+    if seconds is None:
+        seconds = MERAKI_ROTATION_TIMEOUT
+    _deadline.seconds = seconds
+    _deadline.expires = time.monotonic() + seconds
+
+def remaining_time():
+    """
+    Returns the time left in the budget of the rotation on this thread.
+    Returns:
+    - float: The number of seconds left, or None if no budget was started. Raises DeadlineExceeded if no time is left.
+    """
+    expires = getattr(_deadline, 'expires', None)
+    if expires is None:
+        return None
+    remaining = expires - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceeded(f"the rotation did not complete within {_deadline.seconds} seconds")
+    return remaining
+
+def request_timeout():
+    """
+    Returns the timeouts for the next request, from the time left in the budget of the rotation on this thread.
+    Returns:
+    - (float, float): The connect and read timeouts. Raises DeadlineExceeded if no time is left.
+    """
+    remaining = remaining_time()
+    if remaining is None:
+        remaining = MERAKI_ROTATION_TIMEOUT
+    return (min(MERAKI_CONNECT_TIMEOUT, remaining), remaining)
+
+# Optional timing spans, recorded with rotation_trace of the pam_rotate directory. Set the PAM_TRACE_FILE environment
+# variable to a file path to append one JSON line per phase of each rotation. Without the pam_rotate directory next
+# to the directory of this script, the script runs without tracing.
+PAM_TRACE_SERVICE = 'cisco-meraki'
+
+def start_trace(trace_id=None):
+    """
+    Starts a trace for one rotation, see rotation_trace.start_trace.
+
+    Args:
+    - trace_id (str): The trace to join. A new trace is started if None.
+
+    Returns:
+    - str: The trace id, None without tracing.
+    """
+    return rotation_trace.start_trace(trace_id) if rotation_trace else None
+
+def current_trace_id():
+    """
+    Returns:
+    - str: The trace id of the rotation on this thread, to pass to start_trace() on worker threads.
+    """
+    return rotation_trace.current_trace_id() if rotation_trace else None
+
+def trace_span(name, **attributes):
+    """
+    Records the duration of one phase of the rotation if PAM_TRACE_FILE is set, see rotation_trace.trace_span.
+    """
+    if rotation_trace is None:
+        return nullcontext()
+    return rotation_trace.trace_span(name, PAM_TRACE_SERVICE, **attributes)
+
+class TokenBucket:
+    """
+    Token bucket that paces the requests sent for one Meraki organization.
+    It is shared by all threads, and records how long callers waited for it.
+    """
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.waited = 0.0
+        self.throttled = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Takes one token from the bucket, waiting until one is available.
+
+        Returns:
+        - float: The number of seconds waited. Raises DeadlineExceeded if the wait would outlast the budget of the rotation.
+        """
+        waited = 0.0
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    self.waited += waited
+                    return waited
+                delay = (1 - self.tokens) / self.rate
+            # Give up instead of waiting for a token the rotation has no time left to use
+            remaining = remaining_time()
+            if remaining is not None and delay >= remaining:
+                raise DeadlineExceeded(f"the rotation did not complete within {_deadline.seconds} seconds")
+            time.sleep(delay)
+            waited += delay
+
+    def pause(self, delay):
+        """
+        Empties the bucket and keeps it empty for the given number of seconds, e.g. after a 429 response.
+
+        Args:
+        - delay (float): The number of seconds to pause.
+
+        Returns:
+        - None
+        """
+        with self.lock:
+            self.tokens = min(self.tokens, -delay * self.rate)
+            self.throttled += 1
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+def get_bucket(bucket_key):
+    """
+    Returns the token bucket shared by all requests for the same organization.
+
+    Args:
+    - bucket_key (str): The organization ID, or the API key if the organization is not known.
+
+    Returns:
+    - TokenBucket: The shared token bucket.
+    """
+    with _buckets_lock:
+        if bucket_key not in _buckets:
+            _buckets[bucket_key] = TokenBucket(MERAKI_RATE_LIMIT, MERAKI_RATE_LIMIT)
+        return _buckets[bucket_key]
+
+def meraki_request(method, url, bucket_key, **kwargs):
+    """
+    Sends a request to the Meraki API within the organization's rate limit.
+    Requests answered with 429 are retried after the delay given in the Retry-After header.
+
+    Args:
+    - method (str): The HTTP method.
+    - url (str): The request URL.
+    - bucket_key (str): The organization ID, or the API key if the organization is not known.
+    - kwargs: Passed on to requests.Session.request.
+
+    Returns:
+    - requests.Response: The last response received. Raises requests.exceptions.Timeout if the budget of the rotation runs out.
+    """
+    bucket = get_bucket(bucket_key)
+    for attempt in range(MERAKI_MAX_RETRIES + 1):
+        bucket.acquire()
+        response = get_session().request(method, url, timeout=request_timeout(), **kwargs)
+        if response.status_code != 429 or attempt == MERAKI_MAX_RETRIES:
+            return response
+        try:
+            delay = float(response.headers.get('Retry-After', 1))
+        except ValueError:
+            delay = 1.0
+        bucket.pause(delay)
+    return response
+
+# File with the email to user ID index of each network, kept between runs.
+MERAKI_USER_CACHE_FILE = os.path.join(os.path.expanduser('~'), '.cache', 'keeper-pam-scripts', 'meraki_users.json')
+# Number of seconds the index of a network is used before the users are listed again. 0 disables the index.
+MERAKI_USER_CACHE_TTL = 3600
+
+_user_index_lock = threading.Lock()
+
+def load_user_index():
+    """
+    Loads the email to user ID index of all networks from the cache file.
+
+    Returns:
+    - dict: {network_id: {'updated': timestamp, 'users': {email: user_id}}}, empty if there is no usable cache file.
+    """
+    try:
+        with open(MERAKI_USER_CACHE_FILE) as cache_file:
+            return json.load(cache_file)
+    except (OSError, ValueError):
+        return {}
+
+def save_user_index(index):
+    """
+    Writes the email to user ID index of all networks to the cache file.
+
+    Args:
+    - index (dict): The index, as returned by load_user_index.
+
+    Returns:
+    - None
+    """
+    try:
+        os.makedirs(os.path.dirname(MERAKI_USER_CACHE_FILE), mode=0o700, exist_ok=True)
+        temp_file = f"{MERAKI_USER_CACHE_FILE}.{os.getpid()}.tmp"
+        with open(os.open(temp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as cache_file:
+            json.dump(index, cache_file)
+        os.replace(temp_file, MERAKI_USER_CACHE_FILE)
+    except OSError as e:
+        print(f"# Warning: Unable to write the Meraki user cache: {e}")
+
+def get_cached_user_id(network_id, email, index=None):
+    """
+    Looks up the ID of a user in the cached index of the network.
+
+    Args:
+    - network_id (str): The network ID the user belongs to.
+    - email (str): The email of the user.
+    - index (dict): The index of all networks, already loaded with load_user_index. Read from the cache file if None.
+
+    Returns:
+    - The user ID if the index of the network is still valid and contains the email, otherwise None.
+    """
+    if MERAKI_USER_CACHE_TTL <= 0:
+        return None
+    if index is None:
+        with _user_index_lock:
+            index = load_user_index()
+    entry = index.get(network_id)
+    if not entry or time.time() - entry['updated'] > MERAKI_USER_CACHE_TTL:
+        return None
+    return entry['users'].get(email)
+
+def cache_network_users(network_id, users):
+    """
+    Replaces the cached index of the network with the given users.
+
+    Args:
+    - network_id (str): The network ID the users belong to.
+    - users (list): The merakiAuthUsers of the network.
+
+    Returns:
+    - None
+    """
+    update_user_index({network_id: users or []})
+
+def update_user_index(updates):
+    """
+    Replaces or drops the cached index of many networks with a single write of the cache file.
+
+    Args:
+    - updates (dict): The merakiAuthUsers of each network to cache, or None to drop the index of the network.
+
+    Returns:
+    - None
+    """
+    if MERAKI_USER_CACHE_TTL <= 0 or not updates:
+        return
+    with _user_index_lock:
+        index = load_user_index()
+        for network_id, users in updates.items():
+            if users is None:
+                index.pop(network_id, None)
+            else:
+                index[network_id] = {'updated': time.time(), 'users': {user['email']: user['id'] for user in users}}
+        save_user_index(index)
+
+def invalidate_network_users(network_id):
+    """
+    Drops the cached index of the network, e.g. after an update failed because a cached ID no longer exists.
+
+    Args:
+    - network_id (str): The network ID.
+
+    Returns:
+    - None
+    """
+    with _user_index_lock:
+        index = load_user_index()
+        if index.pop(network_id, None) is not None:
+            save_user_index(index)
+
+def list_meraki_users(api_key, network_id, organization_id=None, index_updates=None):
+    """
+    Lists the merakiAuthUsers of a network and caches their IDs.
     
     Args:
     - api_key (str): The Meraki API key.
-    - network_id (str): The network ID to search within.
-    - email (str): The email of the user to fetch.
+    - network_id (str): The network ID to list.
+    - organization_id (str): Optional organization ID of the network, used to share its rate limit.
+    - index_updates (dict): Receives the users of the network instead of writing them to the cache file right away,
+      see update_user_index.
     
     Returns:
-    - User details if found, otherwise None.
+    - list: The users of the network. Raises requests.exceptions.RequestException if they could not be listed.
     """
-    if not network_id:
-        print("Invalid network ID.")
-        return None
-
     # URL to fetch Meraki dashboard users
-    users_url = f"https://api.meraki.com/api/v1/networks/{network_id}/merakiAuthUsers"
+    users_url = f"{MERAKI_API_URL}/networks/{network_id}/merakiAuthUsers"
     headers = {
         'X-Cisco-Meraki-API-Key': api_key,
         'Content-Type': 'application/json',
         'Accept': 'application/json'
     }
 
-    try:
-        # Make GET request to fetch users
-        response = requests.get(users_url, headers=headers)
+    # Make GET request to fetch users
+    with trace_span('target_lookup', network=network_id):
+        response = meraki_request('GET', users_url, organization_id or api_key, headers=headers)
         response.raise_for_status()
         # Parse response JSON
         users = response.json()
 
+    # Remember the ID of every user of the network for the next rotations
+    if index_updates is not None:
+        index_updates[network_id] = users or []
+    else:
+        cache_network_users(network_id, users)
+    return users
+
+def fetch_meraki_user_by_email(api_key, network_id, email, organization_id=None):
+    """
+    Fetches User details by email.
+    
+    Args:
+    - api_key (str): The Meraki API key.
+    - network_id (str): The network ID to search within.
+    - email (str): The email of the user to fetch.
+    - organization_id (str): Optional organization ID of the network, used to share its rate limit.
+    
+    Returns:
+    - User details if found, otherwise None. Raises requests.exceptions.Timeout if the budget of the rotation runs out.
+    """
+    if not network_id:
+        print("Invalid network ID.")
+        return None
+
+    try:
+        users = list_meraki_users(api_key, network_id, organization_id)
+
         if users:
             for user in users:
                 if user['email'] == email:
@@ -70,11 +436,43 @@ def fetch_meraki_user_by_email(api_key, network_id, email):
                     return user
         return None
 
+    except requests.exceptions.Timeout:
+        raise
     except requests.exceptions.RequestException as e:
         print(f"Error fetching Meraki dashboard users: {e}")
         return None
 
-def update_meraki_user_password(api_key, network_id, user_id, new_password):
+def fetch_organization_networks(api_key, organization_id):
+    """
+    Fetches all networks of a Meraki organization.
+    
+    Args:
+    - api_key (str): The Meraki API key.
+    - organization_id (str): The organization ID.
+    
+    Returns:
+    - list: The networks of the organization. Raises requests.exceptions.RequestException if they could not be fetched.
+    """
+    networks_url = f"{MERAKI_API_URL}/organizations/{organization_id}/networks"
+    headers = {
+        'X-Cisco-Meraki-API-Key': api_key,
+        'Content-Type': 'application/json',
+        'Accept': 'application/json'
+    }
+    params = {'perPage': 1000}
+
+    networks = []
+    with trace_span('target_lookup', organization=organization_id):
+        while networks_url:
+            response = meraki_request('GET', networks_url, organization_id, headers=headers, params=params)
+            response.raise_for_status()
+            networks.extend(response.json())
+            # Follow the pagination links until the last page
+            networks_url = response.links.get('next', {}).get('url')
+            params = None
+    return networks
+
+def update_meraki_user_password(api_key, network_id, user_id, new_password, organization_id=None):
     """
     Updates the password for a Meraki dashboard user.
     
@@ -83,6 +481,7 @@ def update_meraki_user_password(api_key, network_id, user_id, new_password):
     - network_id (str): The network ID the user belongs to.
     - user_id (str): The ID of the user to update.
     - new_password (str): The new password to set.
+    - organization_id (str): Optional organization ID of the network, used to share its rate limit.
     
     Returns:
     - bool: True if successful, otherwise False.
@@ -92,7 +491,7 @@ def update_meraki_user_password(api_key, network_id, user_id, new_password):
         return False
 
     # URL to update a specific user's password
-    user_url = f"https://api.meraki.com/api/v1/networks/{network_id}/merakiAuthUsers/{user_id}"
+    user_url = f"{MERAKI_API_URL}/networks/{network_id}/merakiAuthUsers/{user_id}"
     headers = {
         'X-Cisco-Meraki-API-Key': api_key,
         'Content-Type': 'application/json',
@@ -102,11 +501,12 @@ def update_meraki_user_password(api_key, network_id, user_id, new_password):
     payload = {'password': new_password}
 
     # Make PUT request to update user's password
-    response = requests.put(user_url, headers=headers, json=payload)
+    with trace_span('update', network=network_id):
+        response = meraki_request('PUT', user_url, organization_id or api_key, headers=headers, json=payload)
     
     return response
 
-def rotate(meraki_network_id, meraki_api_key, meraki_user_email, new_password):
+def rotate(meraki_network_id, meraki_api_key, meraki_user_email, new_password, meraki_organization_id=None):
     """
     Rotate the password for a given Cisco user.
     Args:
@@ -114,33 +514,313 @@ def rotate(meraki_network_id, meraki_api_key, meraki_user_email, new_password):
     - meraki_api_key (str): API access key for authorization.
     - meraki_user_email (str): Email of the user whose password needs to be rotated.
     - new_password (str): The new password to be set for the Cisco user.
+    - meraki_organization_id (str): Optional organization ID of the network, used to share its rate limit.
     Returns:
     - None
     """
+    bucket = get_bucket(meraki_organization_id or meraki_api_key)
+    waited, throttled = bucket.waited, bucket.throttled
+    start_deadline()
     
-    # Calls the function fetch_meraki_user_by_email to fetch the user details using user email.
-    user = fetch_meraki_user_by_email(meraki_api_key, meraki_network_id, meraki_user_email)
-
-    # If the user does not exist, print the message and exit the program
-    if not user:
-        print(f"No user found with the email: {meraki_user_email}")
-        exit(1)
+    # Looks up the user ID in the cached index of the network first, to skip listing all users of the network
+    meraki_user_id = get_cached_user_id(meraki_network_id, meraki_user_email)
+    response = None
+    
+    rate_limited = False
     
     try:
-        meraki_user_id = user['id']
+        if meraki_user_id is not None:
+            # Updating password for the given user using the cached ID
+            response = update_meraki_user_password(meraki_api_key, meraki_network_id, meraki_user_id, new_password, meraki_organization_id)
+            # The cached ID no longer exists, drop the index of the network and look the user up again
+            if response.status_code == 404:
+                invalidate_network_users(meraki_network_id)
+                response = None
+
+        if response is None:
+            # Calls the function fetch_meraki_user_by_email to fetch the user details using user email.
+            user = fetch_meraki_user_by_email(meraki_api_key, meraki_network_id, meraki_user_email, meraki_organization_id)
+
+            # If the user does not exist, print the message and exit the program
+            if not user:
+                print(f"No user found with the email: {meraki_user_email}")
+                exit(1)
+
+            meraki_user_id = user['id']
+
+            # Updating password for the given user using ID
+            response = update_meraki_user_password(meraki_api_key, meraki_network_id, meraki_user_id, new_password, meraki_organization_id)
 
-        # Updating password for the given user using ID
-        response = update_meraki_user_password(meraki_api_key, meraki_network_id, meraki_user_id, new_password)
         if response.status_code == 200:
             print(f"Password updated successfully for user with email {meraki_user_email}")
+        elif response.status_code == 429:
+            print(f"Failed to update password. Meraki rate limit still exceeded after {MERAKI_MAX_RETRIES} retries.")
+            rate_limited = True
         else:
             print(f"Failed to update password. Status code: {response.status_code}, Error: {response.text}")
 
+    except requests.exceptions.Timeout as timeout_err:
+        print(f"Timed out while rotating the password for the given user email: {timeout_err}")
+        exit(1)
     except requests.exceptions.HTTPError as http_err:
         print(f"HTTP error occurred while updating the password for the given user email: {http_err}")
     except Exception as err:
         print(f"An error occurred: {err}")
 
+    if bucket.waited > waited or bucket.throttled > throttled:
+        print(f"Waited {bucket.waited - waited:.2f}s for the Meraki rate limit ({bucket.throttled - throttled} throttled responses)")
+    if rate_limited:
+        exit(1)
+
+# Maximum number of networks rotated at the same time in organization-wide mode.
+# The shared token bucket still keeps all of them within the organization's rate limit.
+MERAKI_ORG_WORKERS = 10
+
+def rotate_network(meraki_api_key, meraki_organization_id, network, meraki_user_email, new_password, index, index_updates):
+    """
+    Rotate the password for a Meraki user in one network of an organization, if the user exists there.
+    Args:
+    - meraki_api_key (str): API access key for authorization.
+    - meraki_organization_id (str): Organization ID of the network.
+    - network (dict): The network, as returned by fetch_organization_networks.
+    - meraki_user_email (str): Email of the user whose password needs to be rotated.
+    - new_password (str): The new password to be set for the user.
+    - index (dict): The cached user index of all networks, as returned by load_user_index.
+    - index_updates (dict): Receives the changes to the cached index of the network, see update_user_index.
+    Returns:
+    - str: The outcome for the network: 'updated', 'user not found', 'timed out', or the error.
+    """
+    network_id = network['id']
+    # Every network has its own budget, the shared rate limit already paces them
+    start_deadline()
+    try:
+        meraki_user_id = get_cached_user_id(network_id, meraki_user_email, index)
+        if meraki_user_id is not None:
+            response = update_meraki_user_password(meraki_api_key, network_id, meraki_user_id, new_password, meraki_organization_id)
+            if response.status_code != 404:
+                return "updated" if response.status_code == 200 else f"failed: status code {response.status_code}"
+            # The cached ID no longer exists, look the user up again
+            index_updates[network_id] = None
+
+        users = list_meraki_users(meraki_api_key, network_id, meraki_organization_id, index_updates)
+        meraki_user_id = next((user['id'] for user in users or [] if user['email'] == meraki_user_email), None)
+        if meraki_user_id is None:
+            return "user not found"
+
+        response = update_meraki_user_password(meraki_api_key, network_id, meraki_user_id, new_password, meraki_organization_id)
+        return "updated" if response.status_code == 200 else f"failed: status code {response.status_code}"
+    except requests.exceptions.Timeout:
+        return "timed out"
+    except requests.exceptions.HTTPError as http_err:
+        # Networks without Meraki authentication users answer 400
+        if http_err.response is not None and http_err.response.status_code == 400:
+            return "user not found"
+        return f"failed: {http_err}"
+    except Exception as err:
+        return f"failed: {err}"
+
+def rotate_organization(meraki_organization_id, meraki_api_key, meraki_user_email, new_password):
+    """
+    Rotate the password for a Meraki user in every network of the organization that contains the user.
+    Args:
+    - meraki_organization_id (str): Organization ID whose networks are searched.
+    - meraki_api_key (str): API access key for authorization.
+    - meraki_user_email (str): Email of the user whose password needs to be rotated.
+    - new_password (str): The new password to be set for the user.
+    Returns:
+    - dict: The outcome per network ID.
+    """
+    bucket = get_bucket(meraki_organization_id)
+    waited, throttled = bucket.waited, bucket.throttled
+
+    start_deadline()
+    try:
+        networks = fetch_organization_networks(meraki_api_key, meraki_organization_id)
+    except requests.exceptions.Timeout as e:
+        print(f"Timed out while fetching the networks of the Meraki organization: {e}")
+        exit(1)
+    except requests.exceptions.RequestException as e:
+        print(f"Error fetching the networks of the Meraki organization: {e}")
+        exit(1)
+
+    # The cache file is read once, and the changes of all networks are written once when they are done
+    with _user_index_lock:
+        index = load_user_index()
+    index_updates = {}
+    with ThreadPoolExecutor(max_workers=MERAKI_ORG_WORKERS, initializer=start_trace, initargs=(current_trace_id(),)) as executor:
+        futures = [executor.submit(rotate_network, meraki_api_key, meraki_organization_id, network, meraki_user_email, new_password, index, index_updates) for network in networks]
+        results = {network['id']: future.result() for network, future in zip(networks, futures)}
+    update_user_index(index_updates)
+
+    # Print the per-network outcome, skipping networks where the user does not exist
+    found = [network for network in networks if results[network['id']] != "user not found"]
+    if found:
+        width = max(len(network.get('name') or network['id']) for network in found)
+        for network in found:
+            print(f"{network.get('name') or network['id']:<{width}}  {results[network['id']]}")
+    updated = sum(1 for status in results.values() if status == "updated")
+    print(f"Password updated for user with email {meraki_user_email} in {updated} of {len(found)} networks containing the user ({len(networks)} networks searched)")
+
+    if bucket.waited > waited or bucket.throttled > throttled:
+        print(f"Waited {bucket.waited - waited:.2f}s for the Meraki rate limit ({bucket.throttled - throttled} throttled responses)")
+    return results
+
+# Meraki accepts up to 100 actions in an asynchronous action batch, and runs up to 5 batches per organization at a time.
+MERAKI_ACTION_BATCH_SIZE = 100
+MERAKI_MAX_RUNNING_BATCHES = 5
+# Seconds between two status checks of a submitted action batch, and before it is reported as not completed.
+MERAKI_ACTION_BATCH_POLL_INTERVAL = 2
+MERAKI_ACTION_BATCH_TIMEOUT = 300
+
+def submit_action_waves(batches_url, headers, meraki_organization_id, chunks, results):
+    """
+    Submits the action batches in waves of up to MERAKI_MAX_RUNNING_BATCHES and polls each wave until it completes.
+    Args:
+    - batches_url (str): The action batches URL of the organization.
+    - headers (dict): The request headers.
+    - meraki_organization_id (str): Organization ID the actions belong to.
+    - chunks (list): The actions of each batch, as (key, action) tuples.
+    - results (dict): Receives the outcome per key as the batches complete.
+    Returns:
+    - None. Raises requests.exceptions.Timeout if the budget of the rotation runs out.
+    """
+    for wave in range(0, len(chunks), MERAKI_MAX_RUNNING_BATCHES):
+        wave_chunks = chunks[wave:wave + MERAKI_MAX_RUNNING_BATCHES]
+        with trace_span('update', organization=meraki_organization_id, actions=sum(len(chunk) for chunk in wave_chunks)):
+            # Submit up to MERAKI_MAX_RUNNING_BATCHES batches, then wait for all of them before submitting more
+            running = []
+            for chunk in wave_chunks:
+                payload = {'confirmed': True, 'synchronous': False, 'actions': [action for _, action in chunk]}
+                response = meraki_request('POST', batches_url, meraki_organization_id, headers=headers, json=payload)
+                if response.status_code not in (200, 201):
+                    results.update({key: f"failed: status code {response.status_code}, {response.text}" for key, _ in chunk})
+                    continue
+                running.append((chunk, response.json()))
+
+            deadline = time.monotonic() + MERAKI_ACTION_BATCH_TIMEOUT
+            while running:
+                pending = []
+                for chunk, batch in running:
+                    status = batch.get('status', {})
+                    if status.get('completed'):
+                        results.update({key: "updated" for key, _ in chunk})
+                    elif status.get('failed'):
+                        errors = '; '.join(status.get('errors') or []) or 'action batch failed'
+                        results.update({key: f"failed: {errors}" for key, _ in chunk})
+                    elif time.monotonic() > deadline:
+                        results.update({key: f"failed: action batch {batch['id']} did not complete in time" for key, _ in chunk})
+                    else:
+                        pending.append((chunk, batch))
+                if not pending:
+                    break
+                time.sleep(MERAKI_ACTION_BATCH_POLL_INTERVAL)
+                running = []
+                for chunk, batch in pending:
+                    response = meraki_request('GET', f"{batches_url}/{batch['id']}", meraki_organization_id, headers=headers)
+                    running.append((chunk, response.json() if response.status_code == 200 else batch))
+
+def submit_action_batches(meraki_api_key, meraki_organization_id, action_groups):
+    """
+    Submits password updates as asynchronous action batches and waits for them to complete.
+    Action batches are transactional: if one action of a batch fails, none of its actions are applied.
+    Actions of different groups never share a batch.
+    Args:
+    - meraki_api_key (str): API access key for authorization.
+    - meraki_organization_id (str): Organization ID the actions belong to.
+    - action_groups (list): Lists of (key, action) tuples, where action is a Meraki action batch action.
+    Returns:
+    - dict: The outcome per key: 'updated', 'timed out', or the error of its batch.
+    """
+    batches_url = f"{MERAKI_API_URL}/organizations/{meraki_organization_id}/actionBatches"
+    headers = {
+        'X-Cisco-Meraki-API-Key': meraki_api_key,
+        'Content-Type': 'application/json',
+        'Accept': 'application/json'
+    }
+
+    chunks = [actions[i:i + MERAKI_ACTION_BATCH_SIZE] for actions in action_groups for i in range(0, len(actions), MERAKI_ACTION_BATCH_SIZE)]
+    results = {}
+    try:
+        submit_action_waves(batches_url, headers, meraki_organization_id, chunks, results)
+    except requests.exceptions.Timeout:
+        # Batches already submitted may still complete, but the rotation can no longer confirm them
+        results.update({key: "timed out" for chunk in chunks for key, _ in chunk if key not in results})
+    return results
+
+def is_not_found_failure(status):
+    """
+    Tells whether an action batch failed because one of its resources does not exist, e.g. a user with a stale cached ID.
+    Args:
+    - status (str): The outcome of an action, as returned by submit_action_batches.
+    Returns:
+    - bool: True if the batch was rejected or failed with a not found error. Timed out batches are not included,
+      they may still complete.
+    """
+    return status.startswith("failed") and ("not found" in status.lower() or status.startswith("failed: status code 404"))
+
+def rotate_bulk(meraki_network_id, meraki_api_key, meraki_organization_id, new_passwords):
+    """
+    Rotate the passwords for many Meraki users of a network with action batches.
+    Args:
+    - meraki_network_id (str): Network ID of the network where the users are located.
+    - meraki_api_key (str): API access key for authorization.
+    - meraki_organization_id (str): Organization ID of the network.
+    - new_passwords (dict): The new password to be set, by user email.
+    Returns:
+    - dict: The outcome per user email.
+    """
+    results = {}
+    # Polling the action batches gets its own timeout on top of the budget of the rotation
+    start_deadline(MERAKI_ROTATION_TIMEOUT + MERAKI_ACTION_BATCH_TIMEOUT)
+    # Resolve the user IDs from the cached index, and list the users of the network once for the rest
+    user_ids = {email: get_cached_user_id(meraki_network_id, email) for email in new_passwords}
+    from_cache = {email for email, user_id in user_ids.items() if user_id is not None}
+    if len(from_cache) < len(new_passwords):
+        try:
+            users = {user['email']: user['id'] for user in list_meraki_users(meraki_api_key, meraki_network_id, meraki_organization_id) or []}
+        except requests.exceptions.Timeout as e:
+            print(f"Timed out while fetching Meraki dashboard users: {e}")
+            exit(1)
+        except requests.exceptions.RequestException as e:
+            print(f"Error fetching Meraki dashboard users: {e}")
+            exit(1)
+        user_ids = {email: user_id if user_id is not None else users.get(email) for email, user_id in user_ids.items()}
+
+    def build_actions(emails):
+        return [(email, {
+            'resource': f"/networks/{meraki_network_id}/merakiAuthUsers/{user_ids[email]}",
+            'operation': 'update',
+            'body': {'password': new_passwords[email]}
+        }) for email in emails]
+
+    # Cached IDs get batches of their own, so a stale one cannot fail the updates of the users that were just listed
+    results.update({email: "user not found" for email, user_id in user_ids.items() if user_id is None})
+    results.update(submit_action_batches(meraki_api_key, meraki_organization_id, [
+        build_actions([email for email in new_passwords if email in from_cache]),
+        build_actions([email for email in new_passwords if email not in from_cache and user_ids[email] is not None]),
+    ]))
+
+    # A batch of cached IDs that failed with not found holds a stale ID: list the users again and retry those batches once.
+    # Batches that timed out may still complete and are left to the operator.
+    retry = [email for email in new_passwords if email in from_cache and is_not_found_failure(results[email])]
+    if retry:
+        invalidate_network_users(meraki_network_id)
+        try:
+            users = {user['email']: user['id'] for user in list_meraki_users(meraki_api_key, meraki_network_id, meraki_organization_id) or []}
+            user_ids.update({email: users.get(email) for email in retry})
+            results.update({email: "user not found" for email in retry if user_ids[email] is None})
+            results.update(submit_action_batches(meraki_api_key, meraki_organization_id, [build_actions([email for email in retry if user_ids[email] is not None])]))
+        except requests.exceptions.RequestException as e:
+            print(f"Error fetching Meraki dashboard users: {e}")
+
+    # Print the per-user outcome
+    width = max(len(email) for email in new_passwords)
+    for email in new_passwords:
+        print(f"{email:<{width}}  {results[email]}")
+    updated = sum(1 for status in results.values() if status == "updated")
+    print(f"Password updated for {updated} of {len(new_passwords)} users")
+    return results
+
 def main():
     """
     Main function to rotate the password for a Cisco meraki user.
@@ -152,19 +832,38 @@ def main():
     api_access_token_record = None
     params = None
     
+    start_trace()
     # Read and decode input parameters from stdin
     for base64_params in sys.stdin:
-        params = json.loads(base64.b64decode(base64_params).decode())
+        with trace_span('decode'):
+            params = json.loads(base64.b64decode(base64_params).decode())
 
-        # Decode and load records passed in as JSON strings from the PAM Script section as "Rotation Credential" records
-        records = json.loads(base64.b64decode(params.get('records')).decode())
-        # Find the record that matches the specified title
-        api_access_token_record = next((record for record in records if record['title'].lower() == record_title.lower()), None)
+        with trace_span('record_lookup'):
+            # Decode and load records passed in as JSON strings from the PAM Script section as "Rotation Credential" records
+            records = json.loads(base64.b64decode(params.get('records')).decode())
+            # Find the record that matches the specified title
+            api_access_token_record = next((record for record in records if record['title'].lower() == record_title.lower()), None)
         break
 
     if api_access_token_record is None:
         print(f"# Error: No Record with the access token found. Title: {record_title}")
         exit(1)
+
+    rotate_from_params(params, [api_access_token_record])
+
+def rotate_from_params(params, api_access_token_records):
+    """
+    Rotates the password(s) described by a decoded params payload.
+    Used by main() and by the shared pam_rotate entry point, which decode the payload and find the records.
+
+    Args:
+    - params (dict): The decoded params payload.
+    - api_access_token_records (list): The Rotation Credential records titled 'Cisco Authentication Record'. The first one is used.
+
+    Returns:
+    - None. Exits with an error if a password was not updated.
+    """
+    api_access_token_record = api_access_token_records[0]
     
     # Extract Details from the record
     
@@ -174,19 +873,46 @@ def main():
     # API Key for Cisco meraki api authentication
     meraki_api_key = api_access_token_record.get('password')
 
+    # Optional organization ID of the network. Requests for the same organization share its rate limit.
+    meraki_organization_id = api_access_token_record.get('organization_id')
+
     # Email of the Cisco meraki user whose password needs to be rotated
     meraki_user_email = params.get('user')
 
     # New password to set for the Cisco meraki user
     new_password = params.get('newPassword')
+
+    # Optional list of {"user": ..., "newPassword": ...} entries to rotate many users of the network with action batches
+    batch = params.get('users')
     
-    # Check if all required fields are present
-    if not all([meraki_network_id, meraki_api_key, meraki_user_email]):
+    # Check if all required fields are present. Without a network ID, every network of the organization is searched.
+    if not all([meraki_network_id or meraki_organization_id, meraki_api_key, meraki_user_email or batch]):
         print("# Error: One or more required fields are missing in the access token record.")
         exit(1)
 
+    if batch:
+        if not isinstance(batch, list) or not all(isinstance(entry, dict) and entry.get('user') and entry.get('newPassword') for entry in batch):
+            print("# Error: Every entry of the users list needs a user and a newPassword.")
+            exit(1)
+        # Action batches are submitted to the organization of the network
+        if not all([meraki_network_id, meraki_organization_id]):
+            print("# Error: Bulk rotation requires both the network_id and the organization_id fields in the access token record.")
+            exit(1)
+        results = rotate_bulk(meraki_network_id, meraki_api_key, meraki_organization_id, {entry['user']: entry['newPassword'] for entry in batch})
+        if any(status != "updated" for status in results.values()):
+            exit(1)
+        return
+
+    if not meraki_network_id:
+        # Rotate the password for the user in every network of the organization
+        results = rotate_organization(meraki_organization_id, meraki_api_key, meraki_user_email, new_password)
+        found = [status for status in results.values() if status != "user not found"]
+        if not found or any(status != "updated" for status in found):
+            exit(1)
+        return
+
     # Rotate the password for the specified Cisco meraki user
-    rotate(meraki_network_id, meraki_api_key, meraki_user_email, new_password)
+    rotate(meraki_network_id, meraki_api_key, meraki_user_email, new_password, meraki_organization_id)
 
 if __name__ == "__main__":
     main()
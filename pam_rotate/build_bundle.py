@@ -0,0 +1,285 @@
+'''
+Builds a single-file zipapp of the rotation scripts for deployment on the Keeper Gateway.
+
+The bundle holds the shared entry point (pam_rotate.py), the modules it shares with the rotation scripts
+(BUNDLE_MODULES), the rotation scripts of the given backends (all of them by default) and the Python packages
+they need, each module with precompiled bytecode next to its source. The
+packages are resolved from the metadata of the interpreter that runs this script, starting from the packages the
+scripts import, and only the requirements that apply without extras are followed. Tests, type stubs, C sources
+and the installer files of the packages are left out.
+
+Python cannot import native extensions from a zip file. A package whose native extensions have a pure Python
+fallback next to them (charset_normalizer, python-box) is bundled without them and uses the fallback. A package
+that cannot work without its native code (cryptography, pydantic-core, snowflake-connector-python, ...) is left
+out of the bundle and imported from the virtual environment of the interpreter that runs the bundle, so the
+bundle still needs that environment for the Snowflake and Tenable backends. The build prints these packages.
+
+The bytecode is written for the Python version that runs this script, so build the bundle with the Python of the
+Keeper Gateway virtual environment. A bundle run by another Python version still works, but compiles every module
+from source on each start.
+
+Usage:
+    build_bundle.py [backend ...] [--output pam_rotate.pyz] [--python /usr/local/bin/pam_rotation_venv_python3]
+                    [--exclude PACKAGE ...] [--compress]
+
+Run the bundle like pam_rotate.py, e.g. pam_rotate.pyz snowflake < payload. A bundle built for a single backend
+runs that backend when no backend is given.
+'''
+
+import os
+import re
+import sys
+import shutil
+import zipapp
+import argparse
+import tempfile
+import py_compile
+import importlib.machinery
+import importlib.metadata
+
+import rotation_runner
+
+# Interpreter written to the shebang line of the bundle.
+BUNDLE_PYTHON = '/usr/local/bin/pam_rotation_venv_python3'
+
+# Modules of this directory that go into every bundle.
+BUNDLE_MODULES = ['pam_rotate.py', 'rotation_runner.py', 'rotation_trace.py', 'tenable_common.py']
+
+# Backend name -> packages its rotation script imports. Their requirements are added by the build.
+BACKEND_PACKAGES = {
+    'snowflake': ['snowflake-connector-python'],
+    'tenable-io-user': ['pytenable', 'restfly', 'requests'],
+    'tenable-credential': ['pytenable', 'restfly', 'requests'],
+    'tenable-sc-user': ['pytenable', 'restfly', 'requests'],
+    'cisco-ios-xe': ['requests'],
+    'cisco-meraki': ['requests'],
+}
+
+# Files of a package that are never imported.
+PRUNED_DIRS = {'__pycache__', 'tests'}
+PRUNED_SUFFIXES = ('.pyc', '.pyo', '.pyi', '.pyx', '.pxd', '.c', '.h', '.cpp')
+NATIVE_SUFFIXES = tuple(importlib.machinery.EXTENSION_SUFFIXES) + ('.so', '.pyd', '.dylib', '.dll')
+# Files of the .dist-info directory that are kept, so importlib.metadata still finds the bundled packages.
+KEPT_METADATA = {'METADATA', 'entry_points.txt', 'top_level.txt'}
+
+MAIN_TEMPLATE = '''# Generated by build_bundle.py
+import sys
+import rotation_runner
+import pam_rotate
+
+BUNDLED_BACKENDS = {backends!r}
+
+for backends in (pam_rotate.BACKENDS, rotation_runner.BACKENDS):
+    for name in list(backends):
+        if name not in BUNDLED_BACKENDS:
+            del backends[name]
+if len(BUNDLED_BACKENDS) == 1 and len(sys.argv) == 1:
+    sys.argv.append(BUNDLED_BACKENDS[0])
+pam_rotate.main()
+'''
+
+def normalize(name):
+    """
+    Returns the normalized form of a package name, e.g. python_dateutil -> python-dateutil.
+    """
+    return re.sub(r'[-_.]+', '-', name).lower()
+
+def requirement_names(distribution):
+    """
+    Returns the requirements of a package that apply without extras on this interpreter.
+
+    Args:
+    - distribution (importlib.metadata.Distribution): The installed package.
+
+    Returns:
+    - list: The names of the required packages.
+    """
+    try:
+        from packaging.requirements import Requirement
+    except ImportError:
+        Requirement = None
+
+    names = []
+    for text in distribution.requires or []:
+        if Requirement is not None:
+            requirement = Requirement(text)
+            if requirement.marker is None or requirement.marker.evaluate({'extra': ''}):
+                names.append(requirement.name)
+        elif 'extra' not in text.partition(';')[2]:
+            # Without packaging the markers cannot be evaluated, follow every requirement that is not an extra
+            names.append(re.match(r'[A-Za-z0-9._-]+', text).group())
+    return names
+
+def resolve_packages(roots, excluded):
+    """
+    Finds the installed packages needed by the given packages, including their requirements.
+
+    Args:
+    - roots (list): The package names the rotation scripts import.
+    - excluded (set): Normalized names of packages to leave out. Requirements that are only reached through them are left out too.
+
+    Returns:
+    - (dict, list): The installed packages by normalized name, and the names of required packages that are not installed.
+    """
+    packages = {}
+    missing = []
+    pending = list(roots)
+    while pending:
+        name = normalize(pending.pop())
+        if name in packages or name in missing or name in excluded:
+            continue
+        try:
+            distribution = importlib.metadata.distribution(name)
+        except importlib.metadata.PackageNotFoundError:
+            missing.append(name)
+            continue
+        packages[name] = distribution
+        pending.extend(requirement_names(distribution))
+    return packages, missing
+
+def package_files(distribution):
+    """
+    Lists the files of an installed package that belong in the bundle.
+
+    Args:
+    - distribution (importlib.metadata.Distribution): The installed package.
+
+    Returns:
+    - (list, list): The files as (archive path, file path) tuples, and the native extensions without a pure Python
+      fallback. The package cannot be bundled if the second list is not empty.
+    """
+    names = {str(path).replace(os.sep, '/') for path in distribution.files or []}
+    files = []
+    native = []
+    for name in sorted(names):
+        parts = name.split('/')
+        # Scripts, headers and data files that are installed outside of site-packages
+        if parts[0] == '..' or parts[0].endswith('.data'):
+            continue
+        if parts[0].endswith('.dist-info'):
+            if len(parts) == 2 and parts[1] in KEPT_METADATA:
+                files.append((name, distribution.locate_file(name)))
+            continue
+        if PRUNED_DIRS.intersection(parts[:-1]) or name.endswith(PRUNED_SUFFIXES) or name.endswith('.pth'):
+            continue
+        if name.endswith(NATIVE_SUFFIXES):
+            # e.g. charset_normalizer/md.cpython-311-x86_64-linux-gnu.so next to charset_normalizer/md.py
+            if f"{name.split('.')[0]}.py" not in names:
+                native.append(name)
+            continue
+        files.append((name, distribution.locate_file(name)))
+    return files, native
+
+def compile_bytecode(staging):
+    """
+    Writes the bytecode of every module in the staging directory next to its source, as module.pyc.
+
+    zipimport loads module.pyc in place of module.py. The bytecode is not checked against the source, the bundle is
+    never changed after the build.
+
+    Args:
+    - staging (str): The staging directory of the bundle.
+
+    Returns:
+    - (int, list): The number of compiled modules and the modules that could not be compiled.
+    """
+    compiled = 0
+    failed = []
+    for directory, _, filenames in os.walk(staging):
+        for filename in filenames:
+            if not filename.endswith('.py'):
+                continue
+            path = os.path.join(directory, filename)
+            archive_path = os.path.relpath(path, staging).replace(os.sep, '/')
+            try:
+                py_compile.compile(path, cfile=path + 'c', dfile=archive_path, doraise=True,
+                                   invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH)
+                compiled += 1
+            except py_compile.PyCompileError:
+                # e.g. templates of a package that are not Python 3 code, they are kept as plain files
+                failed.append(archive_path)
+    return compiled, failed
+
+def build(backends, output, interpreter=BUNDLE_PYTHON, excluded=(), compressed=False):
+    """
+    Builds the bundle.
+
+    Args:
+    - backends (list): The backend names, see rotation_runner.BACKENDS.
+    - output (str): Path of the bundle to write.
+    - interpreter (str): Interpreter written to the shebang line.
+    - excluded (list): Names of packages to leave out of the bundle. They are imported from the virtual environment.
+    - compressed (bool): Compress the files in the bundle. A compressed bundle is smaller but starts slower.
+
+    Returns:
+    - dict: What went into the bundle: bundled, venv_only and missing packages, compiled and uncompiled modules, and the size.
+    """
+    source_dir = os.path.dirname(os.path.abspath(__file__))
+    roots = [name for backend in backends for name in BACKEND_PACKAGES[backend]]
+    packages, missing = resolve_packages(roots, {normalize(name) for name in excluded})
+
+    bundled = []
+    venv_only = []
+    with tempfile.TemporaryDirectory() as staging:
+        for name in BUNDLE_MODULES:
+            shutil.copy(os.path.join(source_dir, name), os.path.join(staging, name))
+        # The scripts are named like the modules rotation_runner.load_backend() loads them as
+        for backend in backends:
+            shutil.copy(os.path.join(rotation_runner.SCRIPTS_DIR, rotation_runner.BACKENDS[backend]),
+                        os.path.join(staging, f"pam_rotate_{backend.replace('-', '_')}.py"))
+        with open(os.path.join(staging, '__main__.py'), 'w') as f:
+            f.write(MAIN_TEMPLATE.format(backends=list(backends)))
+
+        for name, distribution in sorted(packages.items()):
+            files, native = package_files(distribution)
+            if native:
+                venv_only.append(name)
+                continue
+            for archive_path, path in files:
+                target = os.path.join(staging, *archive_path.split('/'))
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.copy(path, target)
+            bundled.append(name)
+
+        compiled, uncompiled = compile_bytecode(staging)
+        zipapp.create_archive(staging, output, interpreter=interpreter, compressed=compressed)
+
+    return {
+        'backends': list(backends),
+        'output': output,
+        'bundled': bundled,
+        'venv_only': venv_only,
+        'missing': missing,
+        'compiled': compiled,
+        'uncompiled': uncompiled,
+        'size': os.path.getsize(output),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Builds a single-file zipapp of the rotation scripts.')
+    parser.add_argument('backends', nargs='*', metavar='backend', help=f"Backends to bundle, all by default: {', '.join(rotation_runner.BACKENDS)}.")
+    parser.add_argument('--output', default='pam_rotate.pyz', help='Path of the bundle to write.')
+    parser.add_argument('--python', default=BUNDLE_PYTHON, help='Interpreter written to the shebang line of the bundle.')
+    parser.add_argument('--exclude', action='append', default=[], metavar='PACKAGE',
+                        help='Leave a package out of the bundle and import it from the virtual environment. Can be repeated.')
+    parser.add_argument('--compress', action='store_true', help='Compress the files in the bundle.')
+    args = parser.parse_args()
+
+    unknown = [backend for backend in args.backends if backend not in rotation_runner.BACKENDS]
+    if unknown:
+        parser.error(f"unknown backend: {', '.join(unknown)}")
+
+    result = build(args.backends or list(rotation_runner.BACKENDS), args.output, args.python, args.exclude, args.compress)
+
+    print(f"Bundle         {result['output']} ({result['size'] / 1024 / 1024:.1f} MB)")
+    print(f"Backends       {', '.join(result['backends'])}")
+    print(f"Bundled        {', '.join(result['bundled']) or 'none'}")
+    print(f"From the venv  {', '.join(result['venv_only']) or 'none'}")
+    print(f"Bytecode       {result['compiled']} modules compiled for Python {sys.version_info.major}.{sys.version_info.minor}"
+          + (f", {len(result['uncompiled'])} could not be compiled" if result['uncompiled'] else ''))
+    if result['missing']:
+        print(f"# Error: Required packages are not installed: {', '.join(result['missing'])}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,305 @@
+#!/usr/local/bin/pam_rotation_venv_python3
+
+'''
+Shared entry point for all PAM rotation scripts.
+
+Every rotation script decodes the base64 params payload, finds its Rotation Credential record by title and
+checks the record fields in its own main(). This script does that once for all backends: it decodes the
+payload, selects the backend, finds and validates its records, and only then imports the rotation script of
+that backend, the first time it is needed, and calls its rotate_from_params() function. A payload that fails
+validation never pays for importing snowflake.connector, tenable.io/tenable.sc or requests, and one warm
+interpreter (rotation_daemon.py, rotation_stream.py) only imports the backends its payloads actually use.
+
+The backend is given on the command line, or selected from the records of the payload: the backend whose
+record title and identifying field are present. The Tenable.io user and Tenable Credential backends use the
+same record, so they always have to be named.
+
+Usage:
+    pam_rotate.py [backend] < payload
+    pam_rotate.py --profile-startup [backend ...]
+
+--profile-startup starts a fresh interpreter for each backend (all of them by default), loads its rotation script
+and imports its SDK, and reports how the cold start splits between the interpreter, the script and the SDK,
+together with the imports that took longest according to python -X importtime.
+
+NOTE: If spaces are present in the path to the python interpreter, the script will fail to execute.
+    This is a known limitation of the shebang line in Linux and you will need to create a symlink
+    to the python interpreter in a path that does not contain spaces.
+    For example: sudo ln -s "/usr/local/bin/my python3.7" /usr/local/bin/pam_rotation_venv_python3
+'''
+
+import os
+import sys
+import json
+import time
+import base64
+import subprocess
+
+import rotation_runner
+import rotation_trace
+
+# Backend name -> how to find and validate its records before the rotation script is imported.
+# - record_title: title of the Rotation Credential records of the backend.
+# - marker: record field that identifies the backend when it is not named.
+# - record_fields: record fields that must be set. A tuple means that any one of its fields is enough.
+# - params: params that must be set, in the same form.
+# The rotation script of each backend is listed in rotation_runner.BACKENDS.
+BACKENDS = {
+    'snowflake': {
+        'record_title': 'Snowflake Authentication Record',
+        'marker': 'snowflake_account_name',
+        'record_fields': ['snowflake_account_name', 'login', 'password'],
+        'params': [('user', 'users', 'sweep')],
+    },
+    'tenable-io-user': {
+        'record_title': 'Tenable Authentication Record',
+        'marker': None,
+        'record_fields': ['tenable_access_key', 'tenable_secret_key'],
+        'params': ['user'],
+    },
+    'tenable-credential': {
+        'record_title': 'Tenable Authentication Record',
+        'marker': None,
+        'record_fields': ['tenable_access_key', 'tenable_secret_key'],
+        'params': [('user', 'users')],
+    },
+    'tenable-sc-user': {
+        'record_title': 'Tenable Authentication Record',
+        'marker': 'tenable_sc_host',
+        'record_fields': ['tenable_sc_host', 'tenable_access_key', 'tenable_secret_key'],
+        'params': ['user', 'oldPassword', 'newPassword'],
+    },
+    'cisco-ios-xe': {
+        'record_title': 'Cisco Authentication Record',
+        'marker': 'host_endpoint',
+        'record_fields': ['host_endpoint', 'login', 'password'],
+        'params': [('user', 'users')],
+    },
+    'cisco-meraki': {
+        'record_title': 'Cisco Authentication Record',
+        'marker': ('network_id', 'organization_id'),
+        'record_fields': [('network_id', 'organization_id'), 'password'],
+        'params': [('user', 'users')],
+    },
+}
+
+# service.name of the timing spans recorded by this script, see rotation_trace. The spans of the backend follow in the same trace.
+PAM_TRACE_SERVICE = 'pam_rotate'
+
+# Number of imports listed per backend by --profile-startup.
+PROFILE_TOP_IMPORTS = 10
+
+# Code run in a fresh interpreter to time the cold start of a backend. Prints the timings as one JSON line.
+STARTUP_PROBE = """
+import sys, json, time
+start = time.perf_counter()
+sys.path.insert(0, {path!r})
+import rotation_runner
+module = rotation_runner.load_backend({backend!r})
+loaded = time.perf_counter()
+getattr(module, 'load_sdk', lambda: None)()
+ready = time.perf_counter()
+print(json.dumps({{'script_ms': (loaded - start) * 1000, 'sdk_ms': (ready - loaded) * 1000}}))
+"""
+
+def decode_payload(base64_params):
+    """
+    Decodes a params payload and the Rotation Credential records it carries.
+
+    Args:
+    - base64_params (str): The base64 encoded params line the gateway writes to the script's stdin.
+
+    Returns:
+    - (dict, list): The params and the records. Raises ValueError if the payload cannot be decoded.
+    """
+    try:
+        params = json.loads(base64.b64decode(base64_params).decode())
+        records = json.loads(base64.b64decode(params.get('records')).decode())
+    except (TypeError, ValueError, AttributeError) as err:
+        raise ValueError(f"The params payload could not be decoded: {err}")
+    return params, records
+
+def has_fields(values, fields):
+    """
+    Checks that the given fields are set.
+
+    Args:
+    - values (dict): A record or the params.
+    - fields (list): Field names. A tuple means that any one of its fields is enough.
+
+    Returns:
+    - bool: True if all fields are set.
+    """
+    return all(any(values.get(name) for name in (field if isinstance(field, tuple) else (field,))) for field in fields)
+
+def find_records(backend, records):
+    """
+    Returns the records of a backend, matched by title like the rotation scripts do.
+
+    Args:
+    - backend (str): The backend name, one of BACKENDS.
+    - records (list): The records of the payload.
+
+    Returns:
+    - list: The records with the backend's record title.
+    """
+    record_title = BACKENDS[backend]['record_title']
+    return [record for record in records if str(record.get('title', '')).lower() == record_title.lower()]
+
+def select_backend(records):
+    """
+    Selects the backend of a payload that does not name one, from its records.
+
+    Args:
+    - records (list): The records of the payload.
+
+    Returns:
+    - str: The backend name. Raises KeyError if no backend or more than one backend matches.
+    """
+    matches = []
+    for backend, spec in BACKENDS.items():
+        if spec['marker'] is None:
+            continue
+        if any(has_fields(record, [spec['marker']]) for record in find_records(backend, records)):
+            matches.append(backend)
+    if len(matches) != 1:
+        found = ', '.join(matches) if matches else 'none'
+        raise KeyError(f"The backend could not be selected from the records (matching: {found}). Pass the backend name.")
+    return matches[0]
+
+def rotate_payload(base64_params, backend=None):
+    """
+    Runs one rotation: decodes and validates the payload, then imports the backend and calls its rotate_from_params().
+
+    Args:
+    - base64_params (str): The base64 encoded params line the gateway writes to the script's stdin.
+    - backend (str): The backend name, one of BACKENDS, or None to select it from the records.
+
+    Returns:
+    - None. Exits with an error if the payload is invalid or the rotation failed.
+    """
+    # The rotation scripts record their spans with the same module, so they join this trace
+    rotation_trace.start_trace()
+    try:
+        with rotation_trace.trace_span('decode', PAM_TRACE_SERVICE):
+            params, records = decode_payload(base64_params)
+        backend = backend or select_backend(records)
+    except (ValueError, KeyError) as err:
+        print(f"# Error: {err.args[0]}")
+        exit(1)
+    if backend not in BACKENDS:
+        print(f"# Error: Unknown backend: {backend}")
+        exit(1)
+
+    spec = BACKENDS[backend]
+    with rotation_trace.trace_span('record_lookup', PAM_TRACE_SERVICE, backend=backend):
+        backend_records = find_records(backend, records)
+        if not backend_records:
+            print(f"# Error: No Record with the access token found. Title: {spec['record_title']}")
+            exit(1)
+        if not all(has_fields(record, spec['record_fields']) for record in backend_records) or not has_fields(params, spec['params']):
+            print("# Error: One or more required fields are missing in the access token record.")
+            exit(1)
+
+    # Only now import the rotation script, and with it its SDK
+    module = rotation_runner.load_backend(backend)
+    module.rotate_from_params(params, backend_records)
+
+def run_payload(base64_params, backend=None):
+    """
+    Runs one rotation in this interpreter and collects its output, for the daemon and the streaming runner.
+
+    Args:
+    - base64_params (str): The base64 encoded params line the gateway writes to the script's stdin.
+    - backend (str): The backend name, one of BACKENDS, or None to select it from the records.
+
+    Returns:
+    - (int, str): The exit code and the output of the rotation.
+    """
+    return rotation_runner.capture(backend or 'auto', base64_params, rotate_payload, base64_params, backend)
+
+def measure_startup(backend, importtime=False, path=None, env=None):
+    """
+    Measures the cold start of a backend in a fresh interpreter: loading its rotation script and importing its SDK.
+
+    Args:
+    - backend (str): The backend name, one of BACKENDS.
+    - importtime (bool): Run the interpreter with -X importtime and return the time of each import.
+    - path (str): Directory or bundle to load rotation_runner from, by default the directory of this script.
+    - env (dict): Environment of the interpreter, by default the environment of this process.
+
+    Returns:
+    - dict: total_ms, interpreter_ms, script_ms and sdk_ms, and with importtime the imports as
+      (cumulative_ms, module) tuples of the top-level imports, slowest first. Raises RuntimeError if the probe failed.
+    """
+    command = [sys.executable] + (['-X', 'importtime'] if importtime else [])
+    command += ['-c', STARTUP_PROBE.format(path=path or os.path.dirname(os.path.abspath(__file__)), backend=backend)]
+    start = time.perf_counter()
+    process = subprocess.run(command, capture_output=True, text=True, env=env)
+    total_ms = (time.perf_counter() - start) * 1000
+    if process.returncode != 0 or not process.stdout.strip():
+        raise RuntimeError(f"The startup probe of backend '{backend}' failed: {process.stderr.strip().splitlines()[-1:] or process.stdout.strip()}")
+
+    result = json.loads(process.stdout.strip().splitlines()[-1])
+    result['total_ms'] = total_ms
+    result['interpreter_ms'] = total_ms - result['script_ms'] - result['sdk_ms']
+    if importtime:
+        # Lines look like "import time:       251 |     152657 | tenable.io", nested imports are indented
+        imports = []
+        for line in process.stderr.splitlines():
+            if not line.startswith('import time:') or line.endswith('imported package'):
+                continue
+            _, cumulative, name = line[len('import time:'):].split('|')
+            if not name.startswith('  '):
+                imports.append((int(cumulative) / 1000, name.strip()))
+        result['imports'] = sorted(imports, reverse=True)
+    return result
+
+def profile_startup(backends, top=PROFILE_TOP_IMPORTS):
+    """
+    Prints the cold start breakdown and the slowest imports of each backend.
+
+    Args:
+    - backends (list): The backend names.
+    - top (int): Number of imports to list per backend.
+
+    Returns:
+    - bool: True if all backends could be profiled.
+    """
+    success = True
+    for backend in backends:
+        try:
+            result = measure_startup(backend, importtime=True)
+        except RuntimeError as err:
+            print(f"# Error: {err}")
+            success = False
+            continue
+        print(f"{backend}: {result['total_ms']:.0f} ms cold start (interpreter {result['interpreter_ms']:.0f} ms, "
+              f"script {result['script_ms']:.0f} ms, SDK {result['sdk_ms']:.0f} ms)")
+        for cumulative_ms, name in result['imports'][:top]:
+            print(f"  {cumulative_ms:8.1f} ms  {name}")
+    print("Import times include the overhead of -X importtime, compare them with each other rather than with the cold start.")
+    return success
+
+def main():
+    if len(sys.argv) > 1 and sys.argv[1] == '--profile-startup':
+        unknown = [backend for backend in sys.argv[2:] if backend not in BACKENDS]
+        if unknown:
+            print(f"# Error: Unknown backend: {', '.join(unknown)}")
+            exit(1)
+        sys.exit(0 if profile_startup(sys.argv[2:] or list(BACKENDS)) else 1)
+
+    if len(sys.argv) > 2 or (len(sys.argv) == 2 and sys.argv[1] not in BACKENDS):
+        print(f"# Error: Usage: pam_rotate.py [{'|'.join(BACKENDS)}]")
+        exit(1)
+    backend = sys.argv[1] if len(sys.argv) == 2 else None
+
+    base64_params = sys.stdin.readline()
+    if not base64_params.strip():
+        print("# Error: No params received on stdin.")
+        exit(1)
+
+    rotate_payload(base64_params.strip(), backend)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,139 @@
+#!/usr/local/bin/pam_rotation_venv_python3
+
+'''
+Long-lived rotation worker for the PAM rotation scripts.
+
+Starting a rotation script as a fresh process means paying for the interpreter start and for importing
+snowflake.connector, tenable.io/tenable.sc or requests on every rotation. This daemon listens on a local Unix
+socket and runs every params payload it receives from rotation_shim.py through the shared pam_rotate entry
+point. Each rotation script is imported the first time a payload needs it and stays loaded for later ones.
+
+Protocol: the client sends one JSON line {"backend": "<name>", "params": "<base64 params>"} and the daemon
+answers with one JSON line {"exit_code": <int>, "output": "<script output>"}. Without a backend, it is
+selected from the records of the payload.
+
+Usage:
+    rotation_daemon.py [--socket /run/pam_rotate.sock] [backend ...]
+
+NOTE: If spaces are present in the path to the python interpreter, the script will fail to execute.
+    This is a known limitation of the shebang line in Linux and you will need to create a symlink
+    to the python interpreter in a path that does not contain spaces.
+    For example: sudo ln -s "/usr/local/bin/my python3.7" /usr/local/bin/pam_rotation_venv_python3
+'''
+
+import os
+import sys
+import json
+import stat
+import socket
+import argparse
+import socketserver
+
+import rotation_runner
+import pam_rotate
+
+# Default path of the Unix socket shared with rotation_shim.py.
+DEFAULT_SOCKET_PATH = rotation_runner.default_socket_path()
+
+class RotationRequestHandler(socketserver.StreamRequestHandler):
+    """
+    Handles one rotation request per connection.
+    """
+    def handle(self):
+        # Only the user running the daemon may hand it payloads
+        uid = rotation_runner.peer_uid(self.connection)
+        if uid is not None and uid != os.getuid():
+            return
+        line = self.rfile.readline()
+        if not line:
+            return
+        try:
+            request = json.loads(line.decode())
+            exit_code, output = pam_rotate.run_payload(request['params'], request.get('backend'))
+        except Exception as err:
+            exit_code, output = 1, f"# Error: Invalid rotation request: {err}\n"
+        self.wfile.write((json.dumps({'exit_code': exit_code, 'output': output}) + '\n').encode())
+
+class RotationServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+def remove_stale_socket(socket_path):
+    """
+    Removes the socket left behind by a daemon that is no longer running. Exits with an error if the path is
+    something else, belongs to another user, or a daemon is still listening on it.
+
+    Args:
+    - socket_path (str): Path of the Unix socket.
+
+    Returns:
+    - None
+    """
+    try:
+        info = os.lstat(socket_path)
+    except FileNotFoundError:
+        return
+    if not stat.S_ISSOCK(info.st_mode) or info.st_uid != os.getuid():
+        print(f"# Error: {socket_path} exists and is not a socket of this user. Remove it or choose another path.")
+        exit(1)
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as probe:
+        try:
+            probe.connect(socket_path)
+        except OSError:
+            os.unlink(socket_path)
+            return
+    print(f"# Error: Another rotation daemon is listening on {socket_path}.")
+    exit(1)
+
+def serve(socket_path, backends):
+    """
+    Preloads the given backends and serves rotation requests until interrupted.
+
+    Args:
+    - socket_path (str): Path of the Unix socket to listen on.
+    - backends (list): Backend names to import before accepting requests.
+
+    Returns:
+    - None
+    """
+    for name in backends:
+        try:
+            rotation_runner.load_backend(name)
+            print(f"# Loaded backend: {name}")
+        except Exception as err:
+            print(f"# Warning: Backend {name} not loaded: {err}")
+
+    # The directory must be private, otherwise another user could replace the socket after it is created
+    try:
+        rotation_runner.check_private_dir(os.path.dirname(os.path.abspath(socket_path)), create=True)
+    except OSError as err:
+        print(f"# Error: The socket directory is not safe: {err}")
+        exit(1)
+    remove_stale_socket(socket_path)
+
+    # Payloads carry credentials, restrict the socket to the user running the gateway.
+    old_umask = os.umask(0o177)
+    try:
+        server = RotationServer(socket_path, RotationRequestHandler)
+    finally:
+        os.umask(old_umask)
+
+    print(f"# Rotation daemon listening on {socket_path}")
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(socket_path)
+
+def main():
+    parser = argparse.ArgumentParser(description='Long-lived worker for the PAM rotation scripts.')
+    parser.add_argument('--socket', default=DEFAULT_SOCKET_PATH, help='Path of the Unix socket to listen on.')
+    parser.add_argument('backends', nargs='*', default=[],
+                        help='Backends to preload. By default each backend is loaded by its first rotation.')
+    args = parser.parse_args()
+    serve(args.socket, args.backends)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+'''
+In-process runner for the PAM rotation scripts.
+
+This module loads the rotation scripts of this repository as regular Python modules and runs their
+main() function against a base64 encoded params payload, exactly as the Keeper Gateway would when
+it starts the script as a separate process. It is shared by the rotation daemon and its shim.
+
+The scripts read their payload from sys.stdin and report progress with print(), so both streams are
+replaced with thread-local proxies. This lets several rotations run at the same time in one
+interpreter while each of them still sees its own stdin and produces its own output.
+
+It also holds the helpers that keep the socket between the daemon and the shim private to the gateway user.
+'''
+
+import io
+import os
+import sys
+import stat
+import socket
+import struct
+import tempfile
+import threading
+import importlib.util
+
+# Root directory of the pam-scripts repository. Can be overridden when the scripts are deployed elsewhere.
+SCRIPTS_DIR = os.environ.get('PAM_ROTATE_SCRIPTS_DIR', os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Backend name -> path of the rotation script relative to SCRIPTS_DIR.
+BACKENDS = {
+    'snowflake': os.path.join('snowflake', 'update_snowflake_user.py'),
+    'tenable-io-user': os.path.join('tenable', 'tenable_io_user', 'update_tenable_user.py'),
+    'tenable-credential': os.path.join('tenable', 'tenable_credential_record', 'update_tenable_credential.py'),
+    'tenable-sc-user': os.path.join('tenable', 'tenable_sc_user', 'update_tenablesc_user.py'),
+    'cisco-ios-xe': os.path.join('cisco-ios-xe', 'update-cisco-user.py'),
+    'cisco-meraki': os.path.join('cisco-meraki', 'update_meraki_user.py'),
+}
+
+_local = threading.local()
+_modules = {}
+_modules_lock = threading.Lock()
+_install_lock = threading.Lock()
+
+class _ThreadLocalStdout(io.TextIOBase):
+    """
+    Stand-in for sys.stdout that writes into the buffer of the rotation running on the current thread.
+    Threads without a rotation keep writing to the original stream.
+    """
+    def __init__(self, original):
+        self.original = original
+
+    def write(self, text):
+        buffer = getattr(_local, 'stdout', None)
+        return (buffer or self.original).write(text)
+
+    def flush(self):
+        buffer = getattr(_local, 'stdout', None)
+        (buffer or self.original).flush()
+
+class _ThreadLocalStdin(io.TextIOBase):
+    """
+    Stand-in for sys.stdin that reads the payload of the rotation running on the current thread.
+    """
+    def __init__(self, original):
+        self.original = original
+
+    def _stream(self):
+        return getattr(_local, 'stdin', None) or self.original
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        return self._stream().read(size)
+
+    def readline(self, size=-1):
+        return self._stream().readline(size)
+
+    def __iter__(self):
+        return iter(self._stream())
+
+    def close(self):
+        # exit() closes sys.stdin before raising SystemExit; only close the payload of the current rotation.
+        stream = getattr(_local, 'stdin', None)
+        if stream is not None:
+            stream.close()
+
+def _install_proxies():
+    """
+    Replaces sys.stdin and sys.stdout with the thread-local proxies, once per interpreter.
+    """
+    with _install_lock:
+        if not isinstance(sys.stdout, _ThreadLocalStdout):
+            sys.stdout = _ThreadLocalStdout(sys.stdout)
+        if not isinstance(sys.stdin, _ThreadLocalStdin):
+            sys.stdin = _ThreadLocalStdin(sys.stdin)
+
+def load_backend(name):
+    """
+    Imports the rotation script of a backend and keeps it loaded for later rotations.
+
+    Args:
+    - name (str): The backend name, one of BACKENDS.
+
+    Returns:
+    - module: The loaded rotation script.
+    """
+    if name not in BACKENDS:
+        raise KeyError(f"Unknown backend: {name}")
+
+    with _modules_lock:
+        module = _modules.get(name)
+        if module is None:
+            module_name = f"pam_rotate_{name.replace('-', '_')}"
+            # In a bundle built by build_bundle.py the script is a module of the bundle, with precompiled bytecode
+            spec = importlib.util.find_spec(module_name)
+            if spec is None:
+                spec = importlib.util.spec_from_file_location(module_name, os.path.join(SCRIPTS_DIR, BACKENDS[name]))
+            module = importlib.util.module_from_spec(spec)
+            # The Cisco scripts call exit(1) at import when requests is missing, surface that as an import error.
+            # The Tenable and Snowflake scripts import their SDK on first use, in their load_sdk() function.
+            try:
+                spec.loader.exec_module(module)
+            except SystemExit:
+                raise ImportError(f"The rotation script for backend '{name}' could not be loaded: {spec.origin}")
+            _modules[name] = module
+    return module
+
+def capture(name, base64_params, func, *args):
+    """
+    Runs a rotation function with the payload as its stdin and collects what it prints.
+
+    Args:
+    - name (str): The backend name, used in the error message of an unhandled exception.
+    - base64_params (str): The base64 encoded params line the gateway writes to the script's stdin.
+    - func (callable): The function to run, e.g. the main() function of a rotation script.
+    - args: Passed on to func.
+
+    Returns:
+    - (int, str): The exit code and the output the function printed.
+    """
+    _install_proxies()
+
+    _local.stdin = io.StringIO(base64_params if base64_params.endswith('\n') else base64_params + '\n')
+    _local.stdout = io.StringIO()
+    exit_code = 0
+    try:
+        func(*args)
+    except SystemExit as e:
+        if isinstance(e.code, int):
+            exit_code = e.code
+        elif e.code is not None:
+            print(e.code)
+            exit_code = 1
+    except Exception as err:
+        print(f"# Error: Unhandled exception in backend '{name}': {err}")
+        exit_code = 1
+    finally:
+        output = _local.stdout.getvalue()
+        _local.stdin = None
+        _local.stdout = None
+    return exit_code, output
+
+def run_backend(name, base64_params):
+    """
+    Runs the rotation script of a backend for one params payload.
+
+    Args:
+    - name (str): The backend name, one of BACKENDS.
+    - base64_params (str): The base64 encoded params line the gateway writes to the script's stdin.
+
+    Returns:
+    - (int, str): The exit code and the output the script printed.
+    """
+    module = load_backend(name)
+    return capture(name, base64_params, module.main)
+
+def default_socket_path():
+    """
+    Returns the path of the Unix socket shared by the rotation daemon and the shim.
+
+    The socket carries credential payloads, so it lives in a directory only the current user can enter:
+    PAM_ROTATE_SOCKET if set, else $XDG_RUNTIME_DIR/pam_rotate.sock, else pam_rotate-<uid>/pam_rotate.sock
+    in the temporary directory. The daemon creates that directory with mode 0700.
+
+    Returns:
+    - str: The socket path.
+    """
+    if os.environ.get('PAM_ROTATE_SOCKET'):
+        return os.environ['PAM_ROTATE_SOCKET']
+    if os.environ.get('XDG_RUNTIME_DIR'):
+        return os.path.join(os.environ['XDG_RUNTIME_DIR'], 'pam_rotate.sock')
+    return os.path.join(tempfile.gettempdir(), f"pam_rotate-{os.getuid()}", 'pam_rotate.sock')
+
+def check_private_dir(directory, create=False):
+    """
+    Checks that a directory belongs to the current user and that no other user can write to it,
+    so no other user can replace the socket in it.
+
+    Args:
+    - directory (str): The directory of the socket.
+    - create (bool): Create the directory with mode 0700 if it does not exist.
+
+    Returns:
+    - None. Raises PermissionError if the directory is not private.
+    """
+    if create:
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+    info = os.lstat(directory)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid():
+        raise PermissionError(f"{directory} is not a directory owned by this user")
+    if info.st_mode & (stat.S_IWGRP | stat.S_IWOTH) and not info.st_mode & stat.S_ISVTX:
+        raise PermissionError(f"{directory} can be written by other users")
+
+def peer_uid(sock):
+    """
+    Returns the user id of the process at the other end of a connected Unix socket.
+
+    Args:
+    - sock (socket.socket): The connected socket.
+
+    Returns:
+    - int: The user id, or None if the platform cannot tell (no SO_PEERCRED).
+    """
+    if not hasattr(socket, 'SO_PEERCRED'):
+        return None
+    credentials = sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize('3i'))
+    return struct.unpack('3i', credentials)[1]
+
+def check_socket_owner(sock, socket_path):
+    """
+    Checks that the other end of a connected Unix socket runs as the current user.
+    Falls back to the owner of the socket file where the peer cannot be queried.
+
+    Args:
+    - sock (socket.socket): The connected socket.
+    - socket_path (str): The path the socket is connected to.
+
+    Returns:
+    - None. Raises PermissionError if the socket belongs to another user.
+    """
+    uid = peer_uid(sock)
+    if uid is None:
+        info = os.lstat(socket_path)
+        if not stat.S_ISSOCK(info.st_mode):
+            raise PermissionError(f"{socket_path} is not a socket")
+        uid = info.st_uid
+    if uid != os.getuid():
+        raise PermissionError(f"{socket_path} belongs to user id {uid}, not to this user")
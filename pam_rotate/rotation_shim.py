@@ -0,0 +1,111 @@
+#!/usr/local/bin/pam_rotation_venv_python3
+
+'''
+Thin entry point that forwards a rotation to the rotation daemon.
+
+Attach this script instead of the backend script and pass the backend name as its argument, e.g.
+"rotation_shim.py snowflake". Without the argument the daemon selects the backend from the records of the
+payload, see pam_rotate.py. It reads the base64 params payload from stdin like every rotation script,
+hands it to rotation_daemon.py over the local Unix socket and prints the output of the rotation.
+The exit code of the rotation becomes the exit code of the shim, so the gateway contract is unchanged.
+
+If the daemon is not running the rotation is executed in this process instead. The payload is only sent to a
+daemon that runs as the same user. Once it has been sent the rotation may have run, so any later failure is
+reported as an error and the rotation is never run a second time in this process.
+
+NOTE: If spaces are present in the path to the python interpreter, the script will fail to execute.
+    This is a known limitation of the shebang line in Linux and you will need to create a symlink
+    to the python interpreter in a path that does not contain spaces.
+    For example: sudo ln -s "/usr/local/bin/my python3.7" /usr/local/bin/pam_rotation_venv_python3
+'''
+
+import sys
+import json
+import socket
+
+import rotation_runner
+
+# Path of the Unix socket the rotation daemon listens on.
+SOCKET_PATH = rotation_runner.default_socket_path()
+# Seconds to wait for the daemon to accept the connection.
+CONNECT_TIMEOUT = 5
+# Seconds to wait for the result of the rotation. Longer than the longest time budget of a rotation, the Snowflake sweep.
+REPLY_TIMEOUT = 1200
+
+class DaemonUnavailable(Exception):
+    """
+    The daemon could not be reached, or is not trusted. The payload was not sent.
+    """
+
+def connect():
+    """
+    Connects to the rotation daemon and checks that it runs as the same user.
+
+    Returns:
+    - socket.socket: The connected socket. Raises DaemonUnavailable if there is no trusted daemon.
+    """
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.settimeout(CONNECT_TIMEOUT)
+        client.connect(SOCKET_PATH)
+        rotation_runner.check_socket_owner(client, SOCKET_PATH)
+    except OSError as err:
+        client.close()
+        raise DaemonUnavailable(err)
+    return client
+
+def forward(client, backend, base64_params):
+    """
+    Sends one rotation request to the rotation daemon and waits for its result.
+
+    Args:
+    - client (socket.socket): The connection to the daemon, see connect().
+    - backend (str): The backend name, or None to select it from the records.
+    - base64_params (str): The base64 encoded params payload.
+
+    Returns:
+    - (int, str): The exit code and output of the rotation. Failures after the payload was sent are reported as
+      exit code 1, because the rotation may have run.
+    """
+    request = json.dumps({'backend': backend, 'params': base64_params.strip()}) + '\n'
+    try:
+        with client:
+            client.settimeout(REPLY_TIMEOUT)
+            client.sendall(request.encode())
+            with client.makefile('rb') as reader:
+                line = reader.readline()
+        if not line:
+            return 1, "# Error: The rotation daemon closed the connection without a result. The rotation may have run, check the user before rotating it again.\n"
+        response = json.loads(line.decode())
+        return response['exit_code'], response['output']
+    except socket.timeout:
+        return 1, f"# Error: The rotation daemon did not answer within {REPLY_TIMEOUT} seconds. The rotation may have run, check the user before rotating it again.\n"
+    except (OSError, ValueError, KeyError, TypeError) as err:
+        return 1, f"# Error: The rotation daemon failed: {err}. The rotation may have run, check the user before rotating it again.\n"
+
+def main():
+    if len(sys.argv) > 2:
+        print("# Error: Usage: rotation_shim.py [backend]")
+        exit(1)
+    backend = sys.argv[1] if len(sys.argv) == 2 else None
+
+    base64_params = sys.stdin.readline()
+    if not base64_params.strip():
+        print("# Error: No params received on stdin.")
+        exit(1)
+
+    try:
+        client = connect()
+    except DaemonUnavailable:
+        # No trusted daemon, the payload was not sent. Run the rotation in this process.
+        import pam_rotate
+        exit_code, output = pam_rotate.run_payload(base64_params.strip(), backend)
+    else:
+        exit_code, output = forward(client, backend, base64_params)
+
+    sys.stdout.write(output)
+    sys.stdout.flush()
+    sys.exit(exit_code)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,150 @@
+#!/usr/local/bin/pam_rotation_venv_python3
+
+'''
+Streaming runner for large rotation campaigns.
+
+Every rotation script reads one base64 params line from stdin and handles exactly one rotation. This script
+reads any number of payload lines from stdin, runs them through the shared pam_rotate entry point with
+bounded concurrency and writes one NDJSON result line per job as soon as that job
+finishes. A campaign of thousands of rotations can be piped through one process instead of starting one
+interpreter per rotation.
+
+Input: one job per line, either a base64 params payload for the backend given on the command line, or a
+JSON object {"job": "<id>", "backend": "<name>", "params": "<base64 params>"} where job and backend are optional.
+Jobs without a backend use the one given on the command line, or the one selected from their records.
+
+Output: one JSON line per job, in completion order:
+    {"job": "<id>", "backend": "<name>", "exit_code": <int>, "output": "<script output>", "elapsed": <seconds>}
+Jobs without an id are numbered by their input line, starting at 1.
+The output of a rotation is what it prints on its own thread. What the worker threads of a rotation script print goes
+to stderr, so stdout only holds the result lines.
+
+Usage:
+    rotation_stream.py [--workers 8] [backend] < payloads > results.ndjson
+
+NOTE: If spaces are present in the path to the python interpreter, the script will fail to execute.
+    This is a known limitation of the shebang line in Linux and you will need to create a symlink
+    to the python interpreter in a path that does not contain spaces.
+    For example: sudo ln -s "/usr/local/bin/my python3.7" /usr/local/bin/pam_rotation_venv_python3
+'''
+
+import sys
+import json
+import time
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import rotation_runner
+import pam_rotate
+
+# Number of rotations run at the same time.
+DEFAULT_WORKERS = 8
+# Jobs read ahead of the running ones, per worker. Bounds the memory used for pending payloads.
+QUEUE_DEPTH_PER_WORKER = 2
+
+def parse_job(line, line_number, default_backend):
+    """
+    Parses one input line into a job.
+
+    Args:
+    - line (str): A base64 params payload, or a JSON object with "params" and optionally "job" and "backend".
+    - line_number (int): The number of the line in the input, used as the id of jobs without one.
+    - default_backend (str): The backend of jobs that do not name one, may be None.
+
+    Returns:
+    - (str, str, str): The job id, backend name or None, and base64 params payload.
+    """
+    if line.startswith('{'):
+        job = json.loads(line)
+        return str(job.get('job', line_number)), job.get('backend') or default_backend, job['params']
+    return str(line_number), default_backend, line
+
+def run_job(job_id, backend, base64_params):
+    """
+    Runs one rotation and builds its result line.
+
+    Args:
+    - job_id (str): The id of the job.
+    - backend (str): The backend name, or None to select it from the records of the payload.
+    - base64_params (str): The base64 params payload.
+
+    Returns:
+    - dict: The NDJSON result of the job.
+    """
+    start = time.monotonic()
+    try:
+        exit_code, output = pam_rotate.run_payload(base64_params, backend)
+    except Exception as err:
+        exit_code, output = 1, f"# Error: {err}\n"
+    return {'job': job_id, 'backend': backend, 'exit_code': exit_code, 'output': output,
+            'elapsed': round(time.monotonic() - start, 3)}
+
+def stream(input_stream, output_stream, default_backend, workers):
+    """
+    Runs all jobs of the input stream and writes their results as they complete.
+
+    Args:
+    - input_stream (file): The stream with one job per line.
+    - output_stream (file): The stream the NDJSON results are written to.
+    - default_backend (str): The backend of jobs that do not name one, may be None.
+    - workers (int): Number of rotations run at the same time.
+
+    Returns:
+    - (int, int): The number of jobs and the number of failed jobs.
+    """
+    # Only a bounded number of jobs is pending at any time, so memory does not grow with the campaign.
+    slots = threading.BoundedSemaphore(workers * QUEUE_DEPTH_PER_WORKER)
+    write_lock = threading.Lock()
+    counts = {'jobs': 0, 'failed': 0}
+
+    def write_result(result):
+        with write_lock:
+            counts['jobs'] += 1
+            if result['exit_code'] != 0:
+                counts['failed'] += 1
+            output_stream.write(json.dumps(result) + '\n')
+            output_stream.flush()
+
+    def run_and_write(job_id, backend, base64_params):
+        try:
+            write_result(run_job(job_id, backend, base64_params))
+        finally:
+            slots.release()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for line_number, line in enumerate(input_stream, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                job_id, backend, base64_params = parse_job(line, line_number, default_backend)
+            except (ValueError, KeyError) as err:
+                write_result({'job': str(line_number), 'backend': default_backend, 'exit_code': 1,
+                              'output': f"# Error: Invalid job line: {err}\n", 'elapsed': 0.0})
+                continue
+            slots.acquire()
+            executor.submit(run_and_write, job_id, backend, base64_params)
+
+    return counts['jobs'], counts['failed']
+
+def main():
+    parser = argparse.ArgumentParser(description='Runs many rotations from stdin and writes one NDJSON result line per job.')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help='Number of rotations run at the same time.')
+    parser.add_argument('backend', nargs='?', choices=list(rotation_runner.BACKENDS),
+                        help='Backend of the jobs that do not name one.')
+    args = parser.parse_args()
+
+    # Keep the real streams, rotation_runner replaces sys.stdin and sys.stdout with thread-local proxies.
+    input_stream, output_stream = sys.stdin, sys.stdout
+    # Only the results go to stdout. The proxies capture what a rotation prints on its own thread, but not what the
+    # worker threads of a rotation script print, e.g. the cache warnings of a multi-host Tenable.sc rotation.
+    # Send that output to stderr, with the summary.
+    sys.stdout = sys.stderr
+    jobs, failed = stream(input_stream, output_stream, args.backend, max(1, args.workers))
+
+    print(f"# {jobs - failed} of {jobs} rotations succeeded", file=sys.stderr)
+    sys.exit(1 if failed else 0)
+
+if __name__ == "__main__":
+    main()
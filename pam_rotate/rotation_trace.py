@@ -0,0 +1,83 @@
+'''
+Optional timing spans of the rotation scripts.
+
+Set the PAM_TRACE_FILE environment variable to a file path to append one JSON line per phase of each rotation.
+The fields follow the OpenTelemetry span model (trace_id, span_id, start/end in unix nanoseconds). Tracing is off
+when the variable is not set.
+
+All rotation scripts, and pam_rotate.py, record their spans with this module, so the spans of the shared entry
+point and of the backend it runs share one trace. Copy the pam_rotate directory to the Keeper Gateway together
+with the rotation scripts to enable tracing. A bundle built by build_bundle.py contains it.
+'''
+
+import os
+import json
+import time
+import threading
+from contextlib import contextmanager
+
+PAM_TRACE_FILE = os.environ.get('PAM_TRACE_FILE')
+
+_trace = threading.local()
+_trace_lock = threading.Lock()
+
+def start_trace(trace_id=None):
+    """
+    Starts a trace for one rotation. The spans recorded on this thread until the next call share its trace id.
+    Also used as the initializer of worker threads, so their spans join the trace of the rotation.
+
+    Args:
+    - trace_id (str): The trace to join. A new trace is started if None.
+
+    Returns:
+    - str: The trace id.
+    """
+    _trace.trace_id = trace_id or os.urandom(16).hex()
+    return _trace.trace_id
+
+def current_trace_id():
+    """
+    Returns:
+    - str: The trace id of the rotation on this thread, None if no trace was started. Pass it to start_trace() on
+      worker threads.
+    """
+    return getattr(_trace, 'trace_id', None)
+
+@contextmanager
+def trace_span(name, service, **attributes):
+    """
+    Records the duration of one phase of the rotation if PAM_TRACE_FILE is set. Does nothing otherwise.
+
+    Args:
+    - name (str): The phase, one of 'decode', 'record_lookup', 'connect', 'target_lookup' or 'update'.
+    - service (str): The backend that records the span, written as the service.name attribute.
+    - attributes: Additional span attributes, e.g. the target host. Must not contain secrets.
+    """
+    if not PAM_TRACE_FILE:
+        yield
+        return
+    start = time.time_ns()
+    status = 'OK'
+    try:
+        yield
+    except BaseException:
+        status = 'ERROR'
+        raise
+    finally:
+        end = time.time_ns()
+        span = {
+            'trace_id': current_trace_id() or start_trace(),
+            'span_id': os.urandom(8).hex(),
+            'name': name,
+            'start_time_unix_nano': start,
+            'end_time_unix_nano': end,
+            'duration_ms': round((end - start) / 1e6, 3),
+            'status': status,
+            'attributes': {'service.name': service, **attributes},
+        }
+        # Tracing must never fail a rotation
+        try:
+            with _trace_lock, open(PAM_TRACE_FILE, 'a') as trace_file:
+                trace_file.write(json.dumps(span) + '\n')
+        except OSError:
+            pass
@@ -0,0 +1,244 @@
+'''
+Helpers shared by the Tenable rotation scripts.
+
+The Tenable.io user, Tenable Credential and Tenable.sc user scripts all give every rotation a time budget, create
+their pyTenable clients with the time that is left, and pass their API calls through an adaptive concurrency
+limiter. This module holds that code once. The settings stay at the top of each script and are passed in.
+
+The scripts import this module from the pam_rotate directory of this repository, so copy that directory to the
+Keeper Gateway together with the Tenable scripts. A bundle built by build_bundle.py contains it. Without it the
+scripts still run, with plain pyTenable calls.
+'''
+
+import time
+import threading
+
+import requests
+import requests.adapters
+
+class DeadlineExceeded(Exception):
+    """
+    Raised instead of starting or retrying a Tenable API call when the time budget of the rotation is used up, and
+    when a call times out. It is not a requests exception, so restfly passes it on at once instead of pausing before it.
+    """
+
+class Throttled(Exception):
+    """
+    Raised by DeadlineAdapter when Tenable answers 429 or 503, so restfly does not wait for the Retry-After delay
+    itself. AdaptiveLimiter retries the call within the budget of the rotation.
+    """
+    def __init__(self, response):
+        super().__init__(f"{response.status_code} {response.reason} for url: {response.url}")
+        self.code = response.status_code
+        self.response = response
+
+_deadline = threading.local()
+
+def start_deadline(seconds):
+    """
+    Starts the time budget of a rotation on the current thread.
+
+    Args:
+    - seconds (float): The budget in seconds.
+
+    Returns:
+    - None
+    """
+    _deadline.seconds = seconds
+    _deadline.expires = time.monotonic() + seconds
+
+def remaining_time():
+    """
+    Returns the time left in the budget of the rotation on this thread.
+
+    Returns:
+    - float: The number of seconds left, or None if no budget was started. Raises DeadlineExceeded if no time is left.
+    """
+    expires = getattr(_deadline, 'expires', None)
+    if expires is None:
+        return None
+    remaining = expires - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceeded(f"the rotation did not complete within {_deadline.seconds} seconds")
+    return remaining
+
+class DeadlineAdapter(requests.adapters.HTTPAdapter):
+    """
+    Transport adapter of the pyTenable clients. It gives every request the time left in the budget of the rotation as
+    its timeout, and raises throttling and timeouts as Throttled and DeadlineExceeded.
+    restfly sleeps for the Retry-After delay of a 429 or 503 answer, and one second after a request that failed in
+    requests, before it retries or raises, even with retries=0. It passes on exceptions that are not requests
+    exceptions at once, so neither pause can run past the budget.
+    """
+    def __init__(self, connect_timeout):
+        super().__init__()
+        self.connect_timeout = connect_timeout
+
+    def send(self, request, **kwargs):
+        remaining = remaining_time()
+        if remaining is not None:
+            kwargs['timeout'] = (min(self.connect_timeout, remaining), remaining)
+        try:
+            response = super().send(request, **kwargs)
+        except requests.exceptions.Timeout as e:
+            raise DeadlineExceeded(f"the request timed out: {e}") from e
+        if response.status_code in (429, 503):
+            raise Throttled(response)
+        return response
+
+def client_options(connect_timeout):
+    """
+    Returns the options for a new pyTenable client: the timeout of its requests from the time left in the budget of
+    the rotation, no retries in pyTenable, and a DeadlineAdapter that keeps each request within the budget.
+    Throttling is retried by AdaptiveLimiter only, which also checks the budget before each call.
+
+    Args:
+    - connect_timeout (float): Maximum time to open a connection, in seconds, within the budget.
+
+    Returns:
+    - dict: The timeout, retries, backoff and adapter keyword arguments. Without a started budget, only the
+      connection time is limited.
+    """
+    remaining = remaining_time()
+    timeout = (connect_timeout, None) if remaining is None else (min(connect_timeout, remaining), remaining)
+    return {'timeout': timeout, 'retries': 0, 'backoff': 0, 'adapter': DeadlineAdapter(connect_timeout)}
+
+class AdaptiveLimiter:
+    """
+    Limits the number of concurrent Tenable API calls with additive increase / multiplicative decrease.
+    The limit grows by one after a full window of healthy calls, and is halved when Tenable answers 429 or 503.
+    It also keeps a moving average of the call latency.
+    """
+    def __init__(self, initial, maximum, throttle_retries):
+        self.limit = initial
+        self.maximum = maximum
+        self.throttle_retries = throttle_retries
+        self.in_flight = 0
+        self.healthy = 0
+        self.throttled = 0
+        self.latency = None
+        self.condition = threading.Condition()
+
+    def call(self, func, *args, **kwargs):
+        """
+        Calls a Tenable API function within the current concurrency limit.
+        A throttled call waits as long as Tenable asks for, or backs off exponentially, and is retried.
+
+        Args:
+        - func (callable): The pyTenable function to call.
+        - args, kwargs: Passed on to func.
+
+        Returns:
+        - The result of func. Errors other than 429/503, and throttling that outlasts the retries, are raised.
+          Raises DeadlineExceeded when the budget of the rotation runs out while waiting.
+        """
+        for attempt in range(self.throttle_retries + 1):
+            with self.condition:
+                while self.in_flight >= self.limit:
+                    self.condition.wait(timeout=remaining_time())
+                self.in_flight += 1
+            start = time.monotonic()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                self.release(time.monotonic() - start, throttled=getattr(e, 'code', None) in (429, 503))
+                if getattr(e, 'code', None) not in (429, 503) or attempt == self.throttle_retries:
+                    raise
+                retry_after = getattr(getattr(e, 'response', None), 'headers', {}).get('Retry-After')
+                try:
+                    delay = float(retry_after)
+                except (TypeError, ValueError):
+                    delay = min(2 ** attempt, 30)
+                remaining = remaining_time()
+                if remaining is not None and delay >= remaining:
+                    raise DeadlineExceeded(f"the rotation did not complete within {_deadline.seconds} seconds") from e
+                time.sleep(delay)
+                continue
+            self.release(time.monotonic() - start, throttled=False)
+            return result
+
+    def release(self, elapsed, throttled):
+        """
+        Ends a call and adjusts the concurrency limit.
+
+        Args:
+        - elapsed (float): The duration of the call in seconds.
+        - throttled (bool): True if Tenable answered 429 or 503.
+
+        Returns:
+        - None
+        """
+        with self.condition:
+            self.in_flight -= 1
+            self.latency = elapsed if self.latency is None else 0.8 * self.latency + 0.2 * elapsed
+            if throttled:
+                self.throttled += 1
+                self.healthy = 0
+                self.limit = max(1, self.limit // 2)
+            else:
+                self.healthy += 1
+                if self.healthy >= self.limit and self.limit < self.maximum:
+                    self.limit += 1
+                    self.healthy = 0
+            self.condition.notify_all()
+
+    def stats(self, since=0):
+        """
+        Args:
+        - since (int): The value of throttled when the rotation started. Only the calls throttled after it are counted.
+
+        Returns:
+        - str: The current concurrency limit, average latency and number of throttled calls.
+        """
+        latency = f"{self.latency * 1000:.0f} ms" if self.latency is not None else "n/a"
+        return f"Tenable API concurrency limit {self.limit}, average latency {latency}, {self.throttled - since} throttled calls"
+
+# Tenable.io answers an update of a deleted user with 404 Not Found or 410 Gone. 403 Forbidden is a permission error
+# and is reported as it is.
+TENABLE_IO_NOT_FOUND_STATUS_CODES = (404, 410)
+# Tenable.sc answers every failed API call with 403 and an error code in the body. 146 means that no user has the given id.
+TENABLE_SC_NOT_FOUND_ERROR_CODES = (146,)
+
+def is_stale_id_error(error):
+    """
+    Tells whether a failed update by a cached user id means that the id is stale, e.g. because the user was deleted
+    and created again. Only then is the user looked up again and the update retried. Other errors, e.g. a wrong
+    current password, would fail again, and retrying them could lock the account.
+
+    Args:
+    - error (Exception): The error raised by pyTenable.
+
+    Returns:
+    - bool: True if Tenable does not know a user with the id.
+    """
+    try:
+        body = error.response.json()
+    except (AttributeError, ValueError):
+        body = None
+    if isinstance(body, dict) and 'error_code' in body:
+        return body['error_code'] in TENABLE_SC_NOT_FOUND_ERROR_CODES
+    return getattr(error, 'code', None) in TENABLE_IO_NOT_FOUND_STATUS_CODES
+
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+def get_limiter(key, initial, maximum, throttle_retries):
+    """
+    Returns the limiter of one Tenable tenant or Security Center, and creates it on first use.
+    Every tenant has its own limiter, so throttling by one tenant does not slow down the rotations of another.
+    The limiter is kept while the process runs, so rotations in the rotation daemon start from the limit it learned.
+
+    Args:
+    - key (str): Identifies the tenant, e.g. a hash of its access key, or of the host and access key of a Security Center.
+    - initial (int): The concurrency limit of a new limiter.
+    - maximum (int): The highest concurrency limit.
+    - throttle_retries (int): The number of times a throttled call is retried.
+
+    Returns:
+    - AdaptiveLimiter: The limiter of the tenant.
+    """
+    with _limiters_lock:
+        limiter = _limiters.get(key)
+        if limiter is None:
+            limiter = _limiters[key] = AdaptiveLimiter(initial, maximum, throttle_retries)
+        return limiter
@@ -11,9 +11,17 @@ NOTE: If spaces are present in the path to the python interpreter, the script wi
     to the python interpreter in a path that does not contain spaces.
     For example: sudo ln -s "/usr/local/bin/my python3.7" /usr/local/bin/pam_rotation_venv_python3
 '''
+import os
+import re
 import json
 import sys
+import math
+import time
 import base64
+import hmac
+import hashlib
+import threading
+from contextlib import nullcontext
 
 '''
 Optionally display installed packages for debugging. Uncomment if needed.
@@ -25,14 +33,560 @@ for m in installed_packages_list:
     print(f"  {m}")
 '''
 
-# Import the snowflake connector package
+# The timing spans are recorded with rotation_trace of the pam_rotate directory of pam-scripts, when that directory is
+# next to the directory of this script, as in the repository. Without it the script runs without tracing.
 try:
-    import snowflake.connector
+    import rotation_trace
 except ImportError:
-    print("# Error: The 'snowflake connector' package could not be imported. Run 'pip install snowflake-connector-python' to install it.")
-    exit(1)
+    sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'pam_rotate'))
+    try:
+        import rotation_trace
+    except ImportError:
+        rotation_trace = None
+        if os.environ.get('PAM_TRACE_FILE'):
+            print("# Warning: PAM_TRACE_FILE is set, but the 'rotation_trace' module of the pam_rotate directory could not be imported. No spans are recorded.")
+
+# Directory of the OCSP caches shared by all rotations, so a new process does not revalidate every certificate.
+# The connector reads SF_OCSP_RESPONSE_CACHE_DIR for its OCSP response cache when it is imported, and load_sdk() moves
+# its OCSP response validation cache to the same directory. An existing value set by the operator is kept.
+SNOWFLAKE_OCSP_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'keeper-pam-scripts', 'snowflake_ocsp')
+os.environ.setdefault('SF_OCSP_RESPONSE_CACHE_DIR', SNOWFLAKE_OCSP_CACHE_DIR)
+
+# OCSP checks of the connections of the rotations. None keeps the default of the connector: snowflake-connector-python 4
+# makes no OCSP checks, older versions check and fail open. True checks and fails open when the OCSP responder cannot
+# be reached, False checks and fails closed. The --warm-ocsp warm-up uses the same setting.
+# Can be overridden with the SNOWFLAKE_OCSP_FAIL_OPEN environment variable, set to true or false.
+SNOWFLAKE_OCSP_FAIL_OPEN = {'true': True, 'false': False}.get(os.environ.get('SNOWFLAKE_OCSP_FAIL_OPEN', '').strip().lower())
+# The connector probes the AWS, Azure and GCP metadata endpoints on every login to report the platform it runs on.
+# On a gateway without access to them each probe waits for its timeout, which adds seconds to every rotation.
+os.environ.setdefault('SNOWFLAKE_DISABLE_PLATFORM_DETECTION', 'true')
+
+# The snowflake connector package is imported by load_sdk() when a rotation first needs it, after the payload has been
+# validated. Importing the connector takes longer than the rest of the script, and a payload that fails validation never needs it.
+snowflake = None
+
+def load_sdk():
+    """
+    Imports the snowflake connector package the first time it is needed.
+
+    Returns:
+    - None. Exits with an error if the package is not installed.
+    """
+    global snowflake
+    if snowflake is not None:
+        return
+    try:
+        import snowflake.connector
+    except ImportError:
+        print("# Error: The 'snowflake connector' package could not be imported. Run 'pip install snowflake-connector-python' to install it.")
+        exit(1)
+    use_shared_ocsp_validation_cache()
+
+def use_shared_ocsp_validation_cache():
+    """
+    Moves the connector's OCSP response validation cache into SF_OCSP_RESPONSE_CACHE_DIR, next to its OCSP response cache.
+    The connector does not read the variable for this cache and keeps it in ~/.cache/snowflake. If the cache cannot be
+    moved, e.g. with a connector version that does not have it, the connector keeps its own location.
+
+    Returns:
+    - None
+    """
+    try:
+        from snowflake.connector import ocsp_snowflake
+        cache = ocsp_snowflake.OCSP_RESPONSE_VALIDATION_CACHE
+        file_path = os.path.join(os.environ['SF_OCSP_RESPONSE_CACHE_DIR'], os.path.basename(cache.file_path))
+        if cache.file_path != file_path:
+            ocsp_snowflake.OCSP_RESPONSE_VALIDATION_CACHE = type(cache)(entry_lifetime=cache._entry_lifetime.total_seconds(), file_path=file_path)
+    except (ImportError, AttributeError, OSError):
+        pass
+
+# Batch mode settings: submit the ALTER USER statements asynchronously, at most this many at a time.
+SNOWFLAKE_BATCH_ASYNC = False
+SNOWFLAKE_ASYNC_MAX_IN_FLIGHT = 16
+# Seconds between two status checks of the asynchronous queries.
+SNOWFLAKE_ASYNC_POLL_INTERVAL = 0.2
+
+# Reuse the admin session between rotations against the same account instead of logging in every time.
+# The session and master tokens are kept in SNOWFLAKE_SESSION_CACHE_FILE, readable only by the gateway user.
+# The sessions are looked up by an HMAC of the account, admin user and admin password, keyed with a random secret
+# that is created in SNOWFLAKE_SESSION_CACHE_KEY_FILE on first use.
+SNOWFLAKE_SESSION_CACHE = False
+SNOWFLAKE_SESSION_CACHE_FILE = os.path.join(os.path.expanduser('~'), '.cache', 'keeper-pam-scripts', 'snowflake_sessions.json')
+SNOWFLAKE_SESSION_CACHE_KEY_FILE = os.path.join(os.path.expanduser('~'), '.cache', 'keeper-pam-scripts', 'snowflake_sessions.key')
+# Number of seconds a cached session is reused before logging in again. Snowflake master tokens are valid for 4 hours.
+SNOWFLAKE_SESSION_CACHE_TTL = 3600
+
+# Overall time budget of one rotation or batch, and of a sweep, in seconds. Logging in and running the statements draw
+# from the same budget. A statement still running when it is used up is cancelled and reported as timed out.
+# Can be overridden with the SNOWFLAKE_ROTATION_TIMEOUT environment variable.
+SNOWFLAKE_ROTATION_TIMEOUT = float(os.environ.get('SNOWFLAKE_ROTATION_TIMEOUT', 60))
+SNOWFLAKE_SWEEP_TIMEOUT = 900
+
+class DeadlineExceeded(TimeoutError):
+    """
+    Raised instead of starting a statement when the time budget of the rotation is used up.
+    """
+
+_deadline = threading.local()
+
+def start_deadline(seconds=None):
+    """
+    Starts the time budget of a rotation on the current thread.
+
+    Args:
+    - seconds (float): The budget in seconds, SNOWFLAKE_ROTATION_TIMEOUT if not given.
+
+    Returns:
+    - None
+    """
+    if seconds is None:
+        seconds = SNOWFLAKE_ROTATION_TIMEOUT
+    _deadline.seconds = seconds
+    _deadline.expires = time.monotonic() + seconds
+
+def remaining_timeout():
+    """
+    Returns the time left in the budget of the rotation on this thread, as the connector expects its timeouts.
+
+    Returns:
+    - int: The number of seconds left, rounded up. Raises DeadlineExceeded if no time is left.
+    """
+    expires = getattr(_deadline, 'expires', None)
+    if expires is None:
+        return SNOWFLAKE_ROTATION_TIMEOUT
+    remaining = expires - time.monotonic()
+    if remaining <= 0:
+        raise DeadlineExceeded(f"the rotation did not complete within {_deadline.seconds} seconds")
+    return math.ceil(remaining)
+
+def deadline_passed():
+    """
+    Returns:
+    - bool: True if the budget of the rotation on this thread is used up, i.e. a failed call was cut off by its timeout.
+    """
+    expires = getattr(_deadline, 'expires', None)
+    return expires is not None and time.monotonic() >= expires
+
+# Optional timing spans, recorded with rotation_trace of the pam_rotate directory. Set the PAM_TRACE_FILE environment
+# variable to a file path to append one JSON line per phase of each rotation. Without the pam_rotate directory next
+# to the directory of this script, the script runs without tracing.
+PAM_TRACE_SERVICE = 'snowflake'
+
+def start_trace(trace_id=None):
+    """
+    Starts a trace for one rotation, see rotation_trace.start_trace.
+
+    Args:
+    - trace_id (str): The trace to join. A new trace is started if None.
+
+    Returns:
+    - str: The trace id, None without tracing.
+    """
+    return rotation_trace.start_trace(trace_id) if rotation_trace else None
+
+def current_trace_id():
+    """
+    Returns:
+    - str: The trace id of the rotation on this thread, to pass to start_trace() on worker threads.
+    """
+    return rotation_trace.current_trace_id() if rotation_trace else None
+
+def trace_span(name, **attributes):
+    """
+    Records the duration of one phase of the rotation if PAM_TRACE_FILE is set, see rotation_trace.trace_span.
+    """
+    if rotation_trace is None:
+        return nullcontext()
+    return rotation_trace.trace_span(name, PAM_TRACE_SERVICE, **attributes)
+
+_session_cache_lock = threading.Lock()
+
+def load_session_cache_secret():
+    """
+    Reads the secret that keys the lookup of cached admin sessions, and creates it on first use, readable only by
+    the current user.
+
+    Returns:
+    - bytes: The secret, None if it can neither be read nor created.
+    """
+    for _ in range(2):
+        try:
+            with open(SNOWFLAKE_SESSION_CACHE_KEY_FILE, 'rb') as key_file:
+                return key_file.read()
+        except FileNotFoundError:
+            pass
+        except OSError:
+            return None
+        # Written to a temporary file and linked into place, so a concurrent rotation never reads a partial secret
+        temp_file = f"{SNOWFLAKE_SESSION_CACHE_KEY_FILE}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(SNOWFLAKE_SESSION_CACHE_KEY_FILE), mode=0o700, exist_ok=True)
+            with open(os.open(temp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'wb') as key_file:
+                key_file.write(os.urandom(32))
+            os.link(temp_file, SNOWFLAKE_SESSION_CACHE_KEY_FILE)
+        except FileExistsError:
+            # Created by a concurrent rotation, read that one
+            pass
+        except OSError:
+            return None
+        finally:
+            try:
+                os.unlink(temp_file)
+            except OSError:
+                pass
+    return None
 
-def rotate(snowflake_account_name, snowflake_admin_user, snowflake_admin_pass, snowflake_user_name, new_password):
+def session_cache_key(snowflake_account_name, snowflake_admin_user, snowflake_admin_pass):
+    """
+    Returns the key of the cached admin session of an account.
+    The admin password is part of the key, so changing it never resumes a session of the old password. The key is
+    an HMAC with a local secret, so the password cannot be guessed from the cache file.
+
+    Args:
+    - snowflake_account_name (str): The name of the Snowflake account.
+    - snowflake_admin_user (str): The username of the Snowflake admin account.
+    - snowflake_admin_pass (str): The password of the Snowflake admin account.
+
+    Returns:
+    - str: The key, None if the secret is not available and the session cannot be cached.
+    """
+    secret = load_session_cache_secret()
+    if not secret:
+        return None
+    message = f"{snowflake_account_name}\0{snowflake_admin_user}\0{snowflake_admin_pass}".encode()
+    return hmac.new(secret, message, hashlib.sha256).hexdigest()
+
+def load_session_cache():
+    """
+    Loads the cached admin sessions.
+
+    Returns:
+    - dict: {cache_key: {'session_token': ..., 'master_token': ..., 'updated': timestamp}}, empty if there is no usable cache file.
+    """
+    try:
+        with open(SNOWFLAKE_SESSION_CACHE_FILE) as cache_file:
+            return json.load(cache_file)
+    except (OSError, ValueError):
+        return {}
+
+def save_session_cache(cache):
+    """
+    Writes the cached admin sessions, readable only by the current user.
+
+    Args:
+    - cache (dict): The cached sessions, as returned by load_session_cache.
+
+    Returns:
+    - bool: True if the cache was written.
+    """
+    try:
+        os.makedirs(os.path.dirname(SNOWFLAKE_SESSION_CACHE_FILE), mode=0o700, exist_ok=True)
+        temp_file = f"{SNOWFLAKE_SESSION_CACHE_FILE}.{os.getpid()}.tmp"
+        with open(os.open(temp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as cache_file:
+            json.dump(cache, cache_file)
+        os.replace(temp_file, SNOWFLAKE_SESSION_CACHE_FILE)
+        return True
+    except OSError as E:
+        print(f"# Warning: Unable to write the Snowflake session cache: {E}")
+        return False
+
+def connection_options(timeout):
+    """
+    Returns:
+    - dict: The options of every connection of the script: the timeouts, and the OCSP checks of SNOWFLAKE_OCSP_FAIL_OPEN.
+    """
+    options = {'login_timeout': timeout, 'network_timeout': timeout, 'socket_timeout': timeout}
+    if SNOWFLAKE_OCSP_FAIL_OPEN is not None:
+        options['ocsp_fail_open'] = SNOWFLAKE_OCSP_FAIL_OPEN
+    return options
+
+def connect(snowflake_account_name, snowflake_admin_user, snowflake_admin_pass, session_cache=None):
+    """
+    Connects with Snowflake as the admin user.
+    When the session cache is enabled, a still valid session of an earlier rotation is resumed
+    with its session and master tokens. The admin logs in again when there is none or it has expired.
+    Only sessions in the cache are kept open on Snowflake when their connection is closed. Sessions that leave the
+    cache are logged out.
+
+    Args:
+    - snowflake_account_name (str): The name of the Snowflake account to connect to.
+    - snowflake_admin_user (str): The username of the Snowflake admin account.
+    - snowflake_admin_pass (str): The password of the Snowflake admin account.
+    - session_cache (bool): Reuse the admin session between rotations. SNOWFLAKE_SESSION_CACHE if None.
+
+    Returns:
+    - SnowflakeConnection: The open connection.
+    """
+    load_sdk()
+    if session_cache is None:
+        session_cache = SNOWFLAKE_SESSION_CACHE
+
+    # Logging in, and every request of the connection, are bounded by the time left in the budget of the rotation.
+    # login_timeout only stops retrying the login, socket_timeout cuts off a request that is still running.
+    timeout = remaining_timeout()
+    if not session_cache:
+        return snowflake.connector.connect(
+        user=snowflake_admin_user,
+        password=snowflake_admin_pass,
+        account=snowflake_account_name,
+        **connection_options(timeout)
+        )
+
+    cache_key = session_cache_key(snowflake_account_name, snowflake_admin_user, snowflake_admin_pass)
+    if cache_key is None:
+        print("# Warning: Unable to read or create the Snowflake session cache key, logging in without the session cache")
+        return snowflake.connector.connect(
+        user=snowflake_admin_user,
+        password=snowflake_admin_pass,
+        account=snowflake_account_name,
+        **connection_options(timeout)
+        )
+
+    # A session is only resumed if the rotation ends before the session leaves the cache, so it is never logged out
+    # while a rotation still uses it
+    cached = load_session_cache().get(cache_key)
+    rejected = None
+    if cached and time.time() - cached['updated'] + timeout < SNOWFLAKE_SESSION_CACHE_TTL:
+        try:
+            return snowflake.connector.connect(
+            user=snowflake_admin_user,
+            account=snowflake_account_name,
+            session_token=cached['session_token'],
+            master_token=cached['master_token'],
+            server_session_keep_alive=True,
+            **connection_options(timeout)
+            )
+        except Exception:
+            # The cached session has expired, log in again
+            rejected = cached
+
+    # Keep the session alive on the server when the connection is closed, so the next rotation can resume it
+    timeout = remaining_timeout()
+    conn = snowflake.connector.connect(
+    user=snowflake_admin_user,
+    password=snowflake_admin_pass,
+    account=snowflake_account_name,
+    server_session_keep_alive=True,
+    **connection_options(timeout)
+    )
+
+    with _session_cache_lock:
+        cache = load_session_cache()
+        current = cache.get(cache_key)
+        now = time.time()
+        if current and current['session_token'] != (cached or {}).get('session_token') and now - current['updated'] < SNOWFLAKE_SESSION_CACHE_TTL:
+            # A concurrent rotation already cached a new session, keep that one
+            stored = False
+            dropped = []
+        else:
+            if current and current['session_token'] != (rejected or {}).get('session_token'):
+                # The replaced session may still be in use by another rotation until it leaves the cache. It is kept
+                # under its own key until then, and logged out below once it is dropped.
+                cache[f"retired-{hashlib.sha256(current['session_token'].encode()).hexdigest()}"] = current
+            cache[cache_key] = {'session_token': conn.rest.token, 'master_token': conn.rest.master_token, 'updated': now,
+                                'account': snowflake_account_name, 'user': snowflake_admin_user}
+            stored = save_session_cache({key: value for key, value in cache.items() if now - value['updated'] < SNOWFLAKE_SESSION_CACHE_TTL})
+            dropped = [value for value in cache.values() if now - value['updated'] >= SNOWFLAKE_SESSION_CACHE_TTL] if stored else []
+    if not stored:
+        # Only cached sessions are kept alive, this one is logged out when the connection is closed
+        conn._server_session_keep_alive = False
+    for entry in dropped:
+        end_cached_session(entry)
+    return conn
+
+def end_cached_session(entry):
+    """
+    Logs out a session that was dropped from the session cache, so it does not stay open on Snowflake until its
+    master token expires. Errors are ignored, e.g. a session that Snowflake already ended.
+
+    Args:
+    - entry (dict): The cached session, as stored by connect().
+
+    Returns:
+    - None
+    """
+    if 'account' not in entry or 'user' not in entry:
+        return
+    try:
+        timeout = min(remaining_timeout(), 10)
+        snowflake.connector.connect(
+        user=entry['user'],
+        account=entry['account'],
+        session_token=entry['session_token'],
+        master_token=entry['master_token'],
+        **connection_options(timeout)
+        ).close()
+    except Exception:
+        pass
+
+def ocsp_cache_counters():
+    """
+    Reads how often the connector's OCSP response validation cache was used by this process.
+
+    Returns:
+    - (int, int): The number of certificate checks answered from the cache, and the number of checks the cache could
+      not answer. (0, 0) if no OCSP check ran yet.
+    """
+    ocsp_snowflake = sys.modules.get('snowflake.connector.ocsp_snowflake')
+    telemetry = getattr(getattr(ocsp_snowflake, 'OCSP_RESPONSE_VALIDATION_CACHE', None), 'telemetry', None) or {}
+    return telemetry.get('hit', 0), telemetry.get('miss', 0)
+
+def report_ocsp_cache(counters_before):
+    """
+    Prints whether the certificate checks of a connection were answered from the OCSP cache.
+    Nothing is printed if the connection made no OCSP check, e.g. because OCSP checks are disabled, which is the
+    default of snowflake-connector-python 4, or the check failed before the cache was read.
+
+    Args:
+    - counters_before ((int, int)): The result of ocsp_cache_counters() before the connection was opened.
+
+    Returns:
+    - None
+    """
+    hits, misses = (max(0, after - before) for after, before in zip(ocsp_cache_counters(), counters_before))
+    if misses > 0:
+        print(f"OCSP cache miss: {misses} certificates checked with the OCSP responder")
+    elif hits > 0:
+        print(f"OCSP cache hit: {hits} certificates checked from the cache")
+
+def warm_ocsp_cache(snowflake_account_names):
+    """
+    Pre-populates the shared OCSP response cache for the given Snowflake accounts.
+    Opens a TLS connection to each account through the connector's OCSP checking, without logging in.
+    The certificates are checked in the OCSP mode of the rotations, see SNOWFLAKE_OCSP_FAIL_OPEN. If the rotations make
+    no OCSP checks, nothing would read the cache and no connection is opened.
+
+    Args:
+    - snowflake_account_names (list): The Snowflake account names, e.g. xy12345.us-east-2.aws.
+
+    Returns:
+    - bool: True if the certificates of all accounts were validated, or the rotations make no OCSP checks.
+    """
+    load_sdk()
+    from snowflake.connector import ssl_wrap_socket
+    from snowflake.connector.constants import OCSPMode
+    from snowflake.connector.vendored import requests as snowflake_requests
+
+    # Validate certificates with OCSP exactly like the connections of the rotations do
+    if SNOWFLAKE_OCSP_FAIL_OPEN is None:
+        ocsp_mode = getattr(ssl_wrap_socket, 'DEFAULT_OCSP_MODE', OCSPMode.FAIL_OPEN)
+    else:
+        ocsp_mode = OCSPMode.FAIL_OPEN if SNOWFLAKE_OCSP_FAIL_OPEN else OCSPMode.FAIL_CLOSED
+    if ocsp_mode in (getattr(OCSPMode, 'DISABLE_OCSP_CHECKS', None), getattr(OCSPMode, 'INSECURE', None)):
+        print("The rotations make no OCSP checks, so there is no OCSP cache to warm. "
+              "snowflake-connector-python 4 only checks certificates with OCSP when SNOWFLAKE_OCSP_FAIL_OPEN is set.")
+        return True
+    if hasattr(ssl_wrap_socket, 'apply_feature_ocsp_mode'):
+        ssl_wrap_socket.apply_feature_ocsp_mode(ocsp_mode)
+    else:
+        ssl_wrap_socket.FEATURE_OCSP_MODE = ocsp_mode
+    ssl_wrap_socket.inject_into_urllib3()
+
+    success = True
+    for snowflake_account_name in snowflake_account_names:
+        counters_before = ocsp_cache_counters()
+        try:
+            snowflake_requests.get(f"https://{snowflake_account_name}.snowflakecomputing.com/", timeout=60)
+            print(f"{snowflake_account_name}: ", end='')
+            if ocsp_cache_counters() == counters_before:
+                print("No OCSP check was made")
+            else:
+                report_ocsp_cache(counters_before)
+        except Exception as E:
+            print(f"{snowflake_account_name}: Unable to validate the certificate. Error: {E}")
+            success = False
+    print(f"OCSP cache directory: {os.environ['SF_OCSP_RESPONSE_CACHE_DIR']}")
+    return success
+
+def build_change_pass_query(snowflake_user_name, new_password):
+    """
+    Builds the statement that changes the password of a Snowflake user.
+    The name and the password are bound as parameters, the connector escapes them, so no value can change the statement.
+
+    Args:
+    - snowflake_user_name (str): The name of the Snowflake user whose password needs to be rotated. Enclose it in
+      double quotes to match the name exactly, as stored.
+    - new_password (str): The new password to be set for the Snowflake user.
+
+    Returns:
+    - (str, tuple): The ALTER USER statement and its parameters.
+    """
+    return "ALTER USER IDENTIFIER(%s) SET PASSWORD = %s", (snowflake_user_name, new_password)
+
+def run_async_queries(conn, queries, max_in_flight=SNOWFLAKE_ASYNC_MAX_IN_FLIGHT):
+    """
+    Runs statements asynchronously on one connection, with at most max_in_flight of them running at a time.
+
+    Args:
+    - conn (SnowflakeConnection): The open connection.
+    - queries (iterable): (key, (statement, params)) tuples.
+    - max_in_flight (int): Maximum number of statements submitted and not yet completed.
+
+    Returns:
+    - generator: Yields (key, error) as soon as each statement completes. error is None on success.
+      When the budget of the rotation is used up, the running statements are cancelled and the rest are not submitted,
+      all of them are yielded with a DeadlineExceeded error.
+    """
+    cur = conn.cursor()
+    queries = iter(queries)
+    running = {}
+    try:
+        while True:
+            if deadline_passed():
+                for query_id, key in running.items():
+                    try:
+                        cur.abort_query(query_id)
+                    except Exception:
+                        # The statement may complete anyway, it is still reported as timed out
+                        pass
+                    yield key, DeadlineExceeded(f"cancelled after {_deadline.seconds} seconds")
+                for key, _ in queries:
+                    yield key, DeadlineExceeded(f"not submitted within {_deadline.seconds} seconds")
+                return
+
+            # Keep up to max_in_flight statements running
+            for key, query in queries:
+                try:
+                    cur.execute_async(*query)
+                    running[cur.sfqid] = key
+                except Exception as E:
+                    yield key, E
+                if len(running) >= max_in_flight:
+                    break
+            if not running:
+                return
+
+            completed = 0
+            for query_id, key in list(running.items()):
+                try:
+                    if conn.is_still_running(conn.get_query_status(query_id)):
+                        continue
+                    conn.get_query_status_throw_if_error(query_id)
+                    error = None
+                except Exception as E:
+                    error = E
+                del running[query_id]
+                completed += 1
+                yield key, error
+
+            # Wait before the next status check when nothing completed in this one
+            if not completed:
+                time.sleep(SNOWFLAKE_ASYNC_POLL_INTERVAL)
+    finally:
+        cur.close()
+
+def query_status(error):
+    """
+    Returns:
+    - str: The outcome of a statement: 'updated', 'timed out', or the error.
+    """
+    if error is None:
+        return "updated"
+    if isinstance(error, DeadlineExceeded) or deadline_passed():
+        return "timed out"
+    return f"failed: {error}"
+
+def rotate(snowflake_account_name, snowflake_admin_user, snowflake_admin_pass, snowflake_user_name, new_password, session_cache=None):
     """
     Connects with Snowflake using the snowflake.connector module.
     Rotate the password for a given Snowflake user.
@@ -43,31 +597,40 @@ def rotate(snowflake_account_name, snowflake_admin_user, snowflake_admin_pass, s
     - snowflake_admin_pass (str): The password of the Snowflake admin account.
     - snowflake_user_name (str): The name of the Snowflake user whose password needs to be rotated.
     - new_password (str): The new password to be set for the Snowflake user.
+    - session_cache (bool): Reuse the admin session between rotations, see connect.
 
     Returns:
     - None
     """
 
+    start_deadline()
+
     # Connect with snowflake account using snowflake.connector module
+    counters_before = ocsp_cache_counters()
     try:
-        conn = snowflake.connector.connect(
-        user=snowflake_admin_user,
-        password=snowflake_admin_pass,
-        account=snowflake_account_name
-        )
+        with trace_span('connect', account=snowflake_account_name):
+            conn = connect(snowflake_account_name, snowflake_admin_user, snowflake_admin_pass, session_cache)
     except Exception as E:
-        print(f"Unable to connect to snowflake account. Error: {E}")
+        if deadline_passed():
+            print(f"Timed out while connecting to snowflake account. Error: {E}")
+        else:
+            print(f"Unable to connect to snowflake account. Error: {E}")
         exit(1)
+    report_ocsp_cache(counters_before)
     
     # Create a cursor object
     cur = conn.cursor()
     
     # Change new user's password
     try:
-        change_pass_query = f"ALTER USER {snowflake_user_name} SET PASSWORD = '{new_password}'"
-        cur.execute(change_pass_query)
+        change_pass_query = build_change_pass_query(snowflake_user_name, new_password)
+        with trace_span('update', account=snowflake_account_name):
+            cur.execute(*change_pass_query, timeout=remaining_timeout())
     except Exception as E:
-        print(f"Unable to update the password. Error: {E}")
+        if deadline_passed():
+            print(f"Timed out while updating the password, the statement was cancelled. Error: {E}")
+        else:
+            print(f"Unable to update the password. Error: {E}")
         exit(1)
 
     # Close the cursor and connection
@@ -76,6 +639,204 @@ def rotate(snowflake_account_name, snowflake_admin_user, snowflake_admin_pass, s
 
     print(f"Password successfully rotated for the given Snowflake User - {snowflake_user_name}")
 
+def rotate_batch(snowflake_account_name, snowflake_admin_user, snowflake_admin_pass, new_passwords, use_async=SNOWFLAKE_BATCH_ASYNC, session_cache=None):
+    """
+    Connects with Snowflake once and rotates the passwords for several Snowflake users on that session.
+
+    Args:
+    - snowflake_account_name (str): The name of the Snowflake account to connect to.
+    - snowflake_admin_user (str): The username of the Snowflake admin account.
+    - snowflake_admin_pass (str): The password of the Snowflake admin account.
+    - new_passwords (dict): The new password to be set, by Snowflake user name.
+    - use_async (bool): Submit the statements asynchronously and poll for their completion.
+    - session_cache (bool): Reuse the admin session between rotations, see connect.
+
+    Returns:
+    - dict: The outcome per Snowflake user name: 'updated', 'timed out', or the error.
+    """
+
+    start_deadline()
+
+    # Connect with snowflake account using snowflake.connector module
+    counters_before = ocsp_cache_counters()
+    try:
+        with trace_span('connect', account=snowflake_account_name):
+            conn = connect(snowflake_account_name, snowflake_admin_user, snowflake_admin_pass, session_cache)
+    except Exception as E:
+        if deadline_passed():
+            print(f"Timed out while connecting to snowflake account. Error: {E}")
+        else:
+            print(f"Unable to connect to snowflake account. Error: {E}")
+        exit(1)
+    report_ocsp_cache(counters_before)
+
+    queries = [(snowflake_user_name, build_change_pass_query(snowflake_user_name, new_password)) for snowflake_user_name, new_password in new_passwords.items()]
+    results = {}
+    try:
+        with trace_span('update', account=snowflake_account_name, users=len(queries), mode='async' if use_async else 'sequential'):
+            if use_async:
+                for snowflake_user_name, error in run_async_queries(conn, queries):
+                    results[snowflake_user_name] = query_status(error)
+            else:
+                cur = conn.cursor()
+                for snowflake_user_name, change_pass_query in queries:
+                    try:
+                        cur.execute(*change_pass_query, timeout=remaining_timeout())
+                        results[snowflake_user_name] = "updated"
+                    except Exception as E:
+                        results[snowflake_user_name] = query_status(E)
+                cur.close()
+    finally:
+        conn.close()
+
+    # Print the per-user outcome
+    width = max(len(snowflake_user_name) for snowflake_user_name in new_passwords)
+    for snowflake_user_name in new_passwords:
+        print(f"{snowflake_user_name:<{width}}  {results[snowflake_user_name]}")
+    updated = sum(1 for status in results.values() if status == "updated")
+    print(f"Password successfully rotated for {updated} of {len(new_passwords)} Snowflake Users")
+    return results
+
+def quote_identifier(name):
+    """
+    Quotes a Snowflake identifier given in the params, so it cannot change the statement it is used in.
+
+    Args:
+    - name (str): The identifier. A name that is a valid unquoted identifier is matched case-insensitively, as
+      Snowflake does, i.e. upper-cased. A name in double quotes is used exactly as given.
+
+    Returns:
+    - str: The identifier in double quotes.
+    """
+    if len(name) >= 2 and name.startswith('"') and name.endswith('"'):
+        name = name[1:-1].replace('""', '"')
+    elif re.fullmatch(r'[A-Za-z_][A-Za-z0-9_$]*', name):
+        name = name.upper()
+    return '"' + name.replace('"', '""') + '"'
+
+def discover_users(conn, pattern=None, role=None):
+    """
+    Finds the Snowflake users to rotate with a single query.
+
+    Args:
+    - conn (SnowflakeConnection): The open connection.
+    - pattern (str): SHOW USERS LIKE pattern, e.g. 'SVC_%'.
+    - role (str): Name of a role whose directly granted users are rotated.
+
+    Returns:
+    - list: The user names.
+    """
+    cur = conn.cursor()
+    try:
+        if role:
+            cur.execute(f"SHOW GRANTS OF ROLE {quote_identifier(role)}", timeout=remaining_timeout())
+            columns = [column[0].lower() for column in cur.description]
+            rows = [dict(zip(columns, row)) for row in cur.fetchall()]
+            return [row['grantee_name'] for row in rows if row.get('granted_to') == 'USER']
+        cur.execute("SHOW USERS LIKE %s", (pattern,), timeout=remaining_timeout())
+        name_index = [column[0].lower() for column in cur.description].index('name')
+        return [row[name_index] for row in cur.fetchall()]
+    finally:
+        cur.close()
+
+def match_sweep_passwords(snowflake_user_names, new_passwords):
+    """
+    Matches the users found by a sweep with the new passwords given in the params.
+    A user name in the params matches a found user exactly, or case-insensitively if it is a valid unquoted identifier.
+
+    Args:
+    - snowflake_user_names (list): The user names found by the sweep, exactly as stored.
+    - new_passwords (dict): The new password, by Snowflake user name as given in the params.
+
+    Returns:
+    - (dict, dict): The new password by found user name, and the outcome of the users that are not rotated, by name.
+    """
+    found = {name: name for name in snowflake_user_names}
+    found_upper = {name.upper(): name for name in snowflake_user_names if name == name.upper()}
+    matched = {}
+    skipped = {}
+    for given_name, new_password in new_passwords.items():
+        name = found.get(given_name)
+        if name is None and re.fullmatch(r'[A-Za-z_][A-Za-z0-9_$]*', given_name):
+            name = found_upper.get(given_name.upper())
+        if name is None:
+            skipped[given_name] = "not found by the sweep"
+        else:
+            matched[name] = new_password
+    for name in snowflake_user_names:
+        if name not in matched:
+            skipped[name] = "no new password in the params"
+    return matched, skipped
+
+def rotate_sweep(snowflake_account_name, snowflake_admin_user, snowflake_admin_pass, new_passwords, pattern=None, role=None, max_in_flight=SNOWFLAKE_ASYNC_MAX_IN_FLIGHT, session_cache=None):
+    """
+    Discovers the Snowflake users matching a pattern or granted a role, and rotates them on one connection to the
+    new passwords given in the params. The passwords come from the Keeper records of the users, the script never
+    generates or prints one. The ALTER USER statements are pipelined with at most max_in_flight running at a time,
+    and one JSON line with the outcome is printed per user as soon as its statement completes.
+
+    Args:
+    - snowflake_account_name (str): The name of the Snowflake account to connect to.
+    - snowflake_admin_user (str): The username of the Snowflake admin account.
+    - snowflake_admin_pass (str): The password of the Snowflake admin account.
+    - new_passwords (dict): The new password, by Snowflake user name.
+    - pattern (str): SHOW USERS LIKE pattern of the users to rotate.
+    - role (str): Name of the role whose users are rotated.
+    - max_in_flight (int): Maximum number of ALTER USER statements running at a time.
+    - session_cache (bool): Reuse the admin session between rotations, see connect.
+
+    Returns:
+    - dict: The outcome per Snowflake user name: 'updated', 'timed out', or the error. Found users without a new
+      password and users of the params that were not found are not rotated and have an outcome that says so.
+    """
+
+    start_deadline(SNOWFLAKE_SWEEP_TIMEOUT)
+
+    # Connect with snowflake account using snowflake.connector module
+    counters_before = ocsp_cache_counters()
+    try:
+        with trace_span('connect', account=snowflake_account_name):
+            conn = connect(snowflake_account_name, snowflake_admin_user, snowflake_admin_pass, session_cache)
+    except Exception as E:
+        if deadline_passed():
+            print(f"Timed out while connecting to snowflake account. Error: {E}")
+        else:
+            print(f"Unable to connect to snowflake account. Error: {E}")
+        exit(1)
+    report_ocsp_cache(counters_before)
+
+    results = {}
+    try:
+        try:
+            # The admin user is never rotated by a sweep, it would lock out the rest of the sweep
+            with trace_span('target_lookup', account=snowflake_account_name):
+                snowflake_user_names = [name for name in discover_users(conn, pattern, role) if name.upper() != snowflake_admin_user.upper()]
+        except Exception as E:
+            if deadline_passed():
+                print(f"Timed out while discovering the users to rotate. Error: {E}")
+            else:
+                print(f"Unable to discover the users to rotate. Error: {E}")
+            exit(1)
+        matched, skipped = match_sweep_passwords(snowflake_user_names, new_passwords)
+        print(f"Rotating {len(matched)} of {len(snowflake_user_names)} Snowflake Users found by the sweep")
+        for snowflake_user_name, status in skipped.items():
+            results[snowflake_user_name] = status
+            print(json.dumps({'user': snowflake_user_name, 'status': status}), flush=True)
+
+        # Quote the discovered names, they are returned exactly as stored. The quoted name and the password are bound
+        # as parameters of the statement.
+        queries = ((snowflake_user_name, build_change_pass_query('"' + snowflake_user_name.replace('"', '""') + '"', new_password)) for snowflake_user_name, new_password in matched.items())
+        with trace_span('update', account=snowflake_account_name, users=len(matched), mode='async'):
+            for snowflake_user_name, error in run_async_queries(conn, queries, max_in_flight):
+                results[snowflake_user_name] = query_status(error)
+                print(json.dumps({'user': snowflake_user_name, 'status': results[snowflake_user_name]}), flush=True)
+    finally:
+        conn.close()
+
+    updated = sum(1 for status in results.values() if status == "updated")
+    print(f"Password successfully rotated for {updated} of {len(results)} Snowflake Users")
+    return results
+
 def main():
     """
     Main function to rotate the password for a given Snowflake User.
@@ -93,9 +854,11 @@ def main():
     admin_credential_record = None
     params = None
     
+    start_trace()
     # Read and decode input parameters from stdin
     for base64_params in sys.stdin:
-        params = json.loads(base64.b64decode(base64_params).decode())
+        with trace_span('decode'):
+            params = json.loads(base64.b64decode(base64_params).decode())
         '''
         # Optionally print available params for debugging. Uncomment if needed.
         # print(f"# \n# Available params for the script:")
@@ -103,16 +866,52 @@ def main():
         #     print(f"#     {key}={value}")
         '''
 
-        records = json.loads(base64.b64decode(params.get('records')).decode()) # Decode and load records that are passed into the record as JSON strings in the PAM Script section as "Rotation Credential" records
+        with trace_span('record_lookup'):
+            records = json.loads(base64.b64decode(params.get('records')).decode()) # Decode and load records that are passed into the record as JSON strings in the PAM Script section as "Rotation Credential" records
 
-        # Find the Record that contains the admin account details by its Title
-        admin_credential_record = next((record for record in records if record['title'].lower() == record_title.lower()), None)
+            # Find the Record that contains the admin account details by its Title
+            admin_credential_record = next((record for record in records if record['title'].lower() == record_title.lower()), None)
         break
 
     if admin_credential_record is None:
         print(f"# Error: No Record with the access token found. Title: {record_title}")
         exit(1)
 
+    rotate_from_params(params, [admin_credential_record])
+
+def option_param(params, name):
+    """
+    Reads an optional true/false option from the params, e.g. a custom text field of the PAM User record.
+
+    Args:
+    - params (dict): The decoded params payload.
+    - name (str): The name of the option.
+
+    Returns:
+    - bool: The value of the option, None if it is not given. Exits with an error if it is not true or false.
+    """
+    value = params.get(name)
+    if value is None or isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().lower() in ('true', 'false'):
+        return value.strip().lower() == 'true'
+    print(f"# Error: The {name} option must be true or false.")
+    exit(1)
+
+def rotate_from_params(params, admin_credential_records):
+    """
+    Rotates the password(s) described by a decoded params payload.
+    Used by main() and by the shared pam_rotate entry point, which decode the payload and find the records.
+
+    Args:
+    - params (dict): The decoded params payload.
+    - admin_credential_records (list): The Rotation Credential records titled 'Snowflake Authentication Record'. The first one is used.
+
+    Returns:
+    - None. Exits with an error if a password was not updated.
+    """
+    admin_credential_record = admin_credential_records[0]
+
     # Extract Details from the record
     snowflake_account_name = admin_credential_record.get('snowflake_account_name')
     snowflake_admin_user = admin_credential_record.get('login')
@@ -123,13 +922,52 @@ def main():
 
     # Extract new rotated password..
     new_password = params.get('newPassword')
+
+    # Optional list of {"user": ..., "newPassword": ...} entries to rotate several users with one login
+    batch = params.get('users')
+    # Optional {"pattern": ...} or {"role": ...} to discover the users of the batch that are rotated
+    sweep = params.get('sweep')
+    # Optional true or false to override SNOWFLAKE_SESSION_CACHE for this rotation
+    session_cache = option_param(params, 'sessionCache')
+    # Optional true or false to override SNOWFLAKE_BATCH_ASYNC for a batch
+    batch_async = option_param(params, 'batchAsync')
     
     if not all([snowflake_account_name, snowflake_admin_user, snowflake_admin_pass]):
         print("# Error: One or more required fields are missing in the authentication record.")
         exit(1)
+
+    if batch:
+        if not isinstance(batch, list) or not all(isinstance(entry, dict) and entry.get('user') and entry.get('newPassword') for entry in batch):
+            print("# Error: Every entry of the users list needs a user and a newPassword.")
+            exit(1)
    
+    if sweep:
+        # Rotate the passwords for all Snowflake users matching the pattern or granted the role.
+        if not isinstance(sweep, dict) or not (sweep.get('pattern') or sweep.get('role')):
+            print("# Error: A sweep requires a pattern or a role.")
+            exit(1)
+        if not batch:
+            print("# Error: A sweep requires the new passwords of the users as a users list.")
+            exit(1)
+        results = rotate_sweep(snowflake_account_name, snowflake_admin_user, snowflake_admin_pass, {entry['user']: entry['newPassword'] for entry in batch},
+                               sweep.get('pattern'), sweep.get('role'), session_cache=session_cache)
+        if any(status != "updated" for status in results.values()):
+            exit(1)
+        return
+
+    if batch:
+        # Rotate the passwords for all given Snowflake users on one connection.
+        results = rotate_batch(snowflake_account_name, snowflake_admin_user, snowflake_admin_pass, {entry['user']: entry['newPassword'] for entry in batch},
+                               SNOWFLAKE_BATCH_ASYNC if batch_async is None else batch_async, session_cache)
+        if any(status != "updated" for status in results.values()):
+            exit(1)
+        return
+
     # Rotate the password for a given Snowflake user.
-    rotate(snowflake_account_name, snowflake_admin_user, snowflake_admin_pass, snowflake_user_name, new_password)
+    rotate(snowflake_account_name, snowflake_admin_user, snowflake_admin_pass, snowflake_user_name, new_password, session_cache)
 
 if __name__ == "__main__":
+    # "update_snowflake_user.py --warm-ocsp <account> [<account> ...]" pre-populates the OCSP cache for the given accounts.
+    if len(sys.argv) > 1 and sys.argv[1] == '--warm-ocsp':
+        sys.exit(0 if warm_ocsp_cache(sys.argv[2:]) else 1)
     main()
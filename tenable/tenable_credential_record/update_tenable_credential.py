@@ -12,9 +12,35 @@ NOTE: If spaces are present in the path to the python interpreter, the script wi
     For example: sudo ln -s "/usr/local/bin/my python3.7" /usr/local/bin/pam_rotation_venv_python3
 '''
 
+import os
 import json
 import sys
+import time
 import base64
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+import requests
+
+# The code shared by the Tenable scripts (time budget, client options and API limiter) is in tenable_common of the
+# pam_rotate directory of pam-scripts, when that directory is next to the tenable directory, as in the repository.
+# Without it the script runs on its own, see DirectCalls.
+try:
+    import tenable_common
+except ImportError:
+    sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'pam_rotate'))
+    try:
+        import tenable_common
+    except ImportError:
+        tenable_common = None
+
+# The timing spans are recorded with rotation_trace of the same directory. Without it the script runs without tracing.
+try:
+    import rotation_trace
+except ImportError:
+    rotation_trace = None
+    if os.environ.get('PAM_TRACE_FILE'):
+        print("# Warning: PAM_TRACE_FILE is set, but the 'rotation_trace' module of the pam_rotate directory could not be imported. No spans are recorded.")
 
 '''
 Optionally display installed packages for debugging. Uncomment if needed.
@@ -26,12 +52,130 @@ for m in installed_packages_list:
     print(f"  {m}")
 '''
 
-# Import the TenableIO package
-try:
-    from tenable.io import TenableIO
-except ImportError:
-    print("# Error: The 'TenableIO' package could not be imported. Run 'pip install pytenable' to install it.")
-    exit(1)
+# pyTenable defines pydantic models, and pydantic reads the entry points of every installed package on first use to
+# look for plugins. The script uses none, and when it runs from a bundle (pam_rotate/build_bundle.py) the scan reads
+# the whole archive.
+os.environ.setdefault('PYDANTIC_DISABLE_PLUGINS', 'true')
+
+# The TenableIO package is imported by load_sdk() when a rotation first needs it, after the payload has been validated.
+# Importing pyTenable takes longer than the rest of the script, and a payload that fails validation never needs it.
+TenableIO = None
+
+def load_sdk():
+    """
+    Imports the TenableIO package the first time it is needed.
+
+    Returns:
+    - None. Exits with an error if the package is not installed.
+    """
+    global TenableIO
+    if TenableIO is not None:
+        return
+    try:
+        from tenable.io import TenableIO as tenable_client
+    except ImportError:
+        print("# Error: The 'TenableIO' package could not be imported. Run 'pip install pytenable' to install it.")
+        exit(1)
+    TenableIO = tenable_client
+
+# Adaptive (AIMD) concurrency for the Tenable API calls. The limit grows by one after a full window of healthy calls,
+# and is halved when Tenable answers 429 or 503. Throttled calls are retried up to TENABLE_THROTTLE_RETRIES times.
+TENABLE_INITIAL_CONCURRENCY = 4
+TENABLE_MAX_CONCURRENCY = 16
+TENABLE_THROTTLE_RETRIES = 5
+
+# Overall time budget of one rotation, in seconds. Connecting, looking up the target and updating the password all draw
+# from the same budget. A call that would run past it is cut off and the rotation is reported as timed out.
+# Can be overridden with the TENABLE_ROTATION_TIMEOUT environment variable.
+TENABLE_ROTATION_TIMEOUT = float(os.environ.get('TENABLE_ROTATION_TIMEOUT', 60))
+# Maximum time to open the connection to Tenable, in seconds, within the budget.
+TENABLE_CONNECT_TIMEOUT = 10
+
+class DirectCalls:
+    """
+    Stands in for the limiter of tenable_common when the script runs without the pam_rotate directory. Every API call
+    is made once, with the retries of pyTenable, and each request may take up to TENABLE_ROTATION_TIMEOUT seconds.
+    """
+    throttled = 0
+
+    def call(self, func, *args, **kwargs):
+        return func(*args, **kwargs)
+
+    def stats(self, since=0):
+        return "Tenable API calls are not limited, the tenable_common module of the pam_rotate directory is not available"
+
+# Errors of a Tenable API call that timed out, or that would have run past the budget of the rotation.
+TIMEOUT_ERRORS = (requests.exceptions.Timeout,) + ((tenable_common.DeadlineExceeded,) if tenable_common else ())
+
+def start_deadline():
+    """
+    Starts the time budget of the rotation on this thread, see tenable_common.start_deadline.
+    Without tenable_common there is no overall budget, only the timeout of each request.
+
+    Returns:
+    - None
+    """
+    if tenable_common is not None:
+        tenable_common.start_deadline(TENABLE_ROTATION_TIMEOUT)
+
+def client_options():
+    """
+    Returns:
+    - dict: The options of a new pyTenable client, see tenable_common.client_options.
+    """
+    if tenable_common is None:
+        return {'timeout': (TENABLE_CONNECT_TIMEOUT, TENABLE_ROTATION_TIMEOUT)}
+    return tenable_common.client_options(TENABLE_CONNECT_TIMEOUT)
+
+def get_limiter(tenable_access_key):
+    """
+    Returns the limiter of the Tenable API calls to one tenant, see tenable_common.get_limiter.
+
+    Args:
+    - tenable_access_key (str): The access key of the tenant. The limiter is kept under a hash of it.
+
+    Returns:
+    - AdaptiveLimiter: The limiter of the tenant, DirectCalls without tenable_common.
+    """
+    tenant_key = hashlib.sha256(tenable_access_key.encode()).hexdigest()
+    if tenable_common is None:
+        return DirectCalls()
+    return tenable_common.get_limiter(tenant_key, TENABLE_INITIAL_CONCURRENCY, TENABLE_MAX_CONCURRENCY, TENABLE_THROTTLE_RETRIES)
+
+# Optional timing spans, recorded with rotation_trace of the pam_rotate directory. Set the PAM_TRACE_FILE environment
+# variable to a file path to append one JSON line per phase of each rotation. Without the pam_rotate directory next
+# to the tenable directory, the script runs without tracing.
+PAM_TRACE_SERVICE = 'tenable-credential'
+
+def start_trace(trace_id=None):
+    """
+    Starts a trace for one rotation, see rotation_trace.start_trace.
+
+    Args:
+    - trace_id (str): The trace to join. A new trace is started if None.
+
+    Returns:
+    - str: The trace id, None without tracing.
+    """
+    return rotation_trace.start_trace(trace_id) if rotation_trace else None
+
+def current_trace_id():
+    """
+    Returns:
+    - str: The trace id of the rotation on this thread, to pass to start_trace() on worker threads.
+    """
+    return rotation_trace.current_trace_id() if rotation_trace else None
+
+def trace_span(name, **attributes):
+    """
+    Records the duration of one phase of the rotation if PAM_TRACE_FILE is set, see rotation_trace.trace_span.
+    """
+    if rotation_trace is None:
+        return nullcontext()
+    return rotation_trace.trace_span(name, PAM_TRACE_SERVICE, **attributes)
+
+# Number of threads editing credentials in bulk mode. The limiter of the tenant decides how many of them call Tenable at the same time.
+TENABLE_BULK_WORKERS = TENABLE_MAX_CONCURRENCY
 
 def rotate(tenable_access_key, tenable_secret_key, tenable_credential_name, new_password):
     """
@@ -48,24 +192,119 @@ def rotate(tenable_access_key, tenable_secret_key, tenable_credential_name, new_
     - None
     """
 
-    # Connect with tenable using TenableIO package
-    tio = TenableIO(tenable_access_key, tenable_secret_key)
+    load_sdk()
+    start_deadline()
+    limiter = get_limiter(tenable_access_key)
+    # The limiter is shared by all rotations of the tenant, report only the calls throttled during this one
+    throttled = limiter.throttled
+    try:
+        # Connect with tenable using TenableIO package
+        with trace_span('connect'):
+            tio = TenableIO(tenable_access_key, tenable_secret_key, **client_options())
     
-    # Retrieve a list of credentials matching the specified Tenable Credential Name and store them in the variable 'credential'.
-    credential = list(tio.credentials.list(('name', 'eq', tenable_credential_name)))
+        # Retrieve a list of credentials matching the specified Tenable Credential Name and store them in the variable 'credential'.
+        with trace_span('target_lookup'):
+            credential = limiter.call(lambda: list(tio.credentials.list(('name', 'eq', tenable_credential_name))))
     
-    # If more than one or no credentials found with the given Credential Name, exit the program and print an error for debugging
-    if len(credential)!=1:
-        print("# ERROR: There should be exactly one credential with the given Tenable Credential Name.")
-        exit(1)
+        # If more than one or no credentials found with the given Credential Name, exit the program and print an error for debugging
+        if len(credential)!=1:
+            print("# ERROR: There should be exactly one credential with the given Tenable Credential Name.")
+            exit(1)
     
-    # Extract the UUID of the credential from the list
-    credentials_uuid = credential[0]['uuid']
+        # Extract the UUID of the credential from the list
+        credentials_uuid = credential[0]['uuid']
     
-    # Updating the password of the Tenable Crdential using its UUID
-    tio.credentials.edit(credentials_uuid,password=new_password)
+        # Updating the password of the Tenable Crdential using its UUID
+        with trace_span('update'):
+            limiter.call(tio.credentials.edit, credentials_uuid, password=new_password)
     
-    print(f"Password successfully rotated for the given Tenable Credential Name - {tenable_credential_name}")
+        print(f"Password successfully rotated for the given Tenable Credential Name - {tenable_credential_name}")
+        if limiter.throttled > throttled:
+            print(limiter.stats(since=throttled))
+    except TIMEOUT_ERRORS as e:
+        print(f"# Error: Timed out while rotating the password for the given Tenable Credential Name - {tenable_credential_name}: {e}")
+        exit(1)
+
+def edit_credential(tio, limiter, credentials_uuid, new_password):
+    """
+    Updates the password of a Tenable Credential.
+
+    Args:
+    - tio (TenableIO): An instance of the TenableIO class for connecting to Tenable.
+    - limiter (AdaptiveLimiter): The limiter for the API calls to the tenant.
+    - credentials_uuid (str): The UUID of the Tenable Credential.
+    - new_password (str): The new password to be set for the Tenable Credential.
+
+    Returns:
+    - str: 'updated', 'timed out', or the error.
+    """
+    # Every credential has its own budget, waiting for a free worker is not counted
+    start_deadline()
+    try:
+        with trace_span('update'):
+            limiter.call(tio.credentials.edit, credentials_uuid, password=new_password)
+        return "updated"
+    except TIMEOUT_ERRORS:
+        return "timed out"
+    except Exception as e:
+        return f"failed: {e}"
+
+def rotate_bulk(tenable_access_key, tenable_secret_key, new_passwords, max_workers=TENABLE_BULK_WORKERS):
+    """
+    Connects with Tenable once and rotates the passwords for many Tenable Credentials.
+    The UUIDs of all credentials are resolved with a single listing, then the edits run concurrently on the shared client.
+
+    Args:
+    - tenable_access_key (str): The access key for connecting to Tenable.
+    - tenable_secret_key (str): The secret key for connecting to Tenable.
+    - new_passwords (dict): The new password to be set, by Tenable Credential Name.
+    - max_workers (int): Maximum number of credentials edited at the same time.
+
+    Returns:
+    - dict: The outcome per Tenable Credential Name.
+    """
+
+    load_sdk()
+
+    limiter = get_limiter(tenable_access_key)
+    throttled = limiter.throttled
+
+    # Connecting and listing the credentials share one budget, then every edit gets its own
+    start_deadline()
+    try:
+        # Connect with tenable using TenableIO package
+        with trace_span('connect'):
+            tio = TenableIO(tenable_access_key, tenable_secret_key, **client_options())
+
+        # Resolve the UUIDs of all credentials in one listing pass
+        with trace_span('target_lookup'):
+            credentials = limiter.call(lambda: list(tio.credentials.list()))
+    except TIMEOUT_ERRORS as e:
+        print(f"# Error: Timed out while listing the Tenable Credentials: {e}")
+        exit(1)
+    credential_uuids = {name: [] for name in new_passwords}
+    for credential in credentials:
+        if credential['name'] in credential_uuids:
+            credential_uuids[credential['name']].append(credential['uuid'])
+
+    results = {}
+    for name, uuids in credential_uuids.items():
+        # There should be exactly one credential with each Tenable Credential Name
+        if len(uuids) != 1:
+            results[name] = "not found" if not uuids else f"failed: {len(uuids)} credentials with this name"
+
+    with ThreadPoolExecutor(max_workers=max_workers, initializer=start_trace, initargs=(current_trace_id(),)) as executor:
+        futures = {name: executor.submit(edit_credential, tio, limiter, uuids[0], new_passwords[name]) for name, uuids in credential_uuids.items() if name not in results}
+        results.update({name: future.result() for name, future in futures.items()})
+
+    # Print the per-credential outcome
+    width = max(len(name) for name in new_passwords)
+    for name in new_passwords:
+        print(f"{name:<{width}}  {results[name]}")
+    updated = sum(1 for status in results.values() if status == "updated")
+    print(f"Password successfully rotated for {updated} of {len(new_passwords)} Tenable Credentials")
+    print(limiter.stats(since=throttled))
+    return results
 
 def main():
     """
@@ -85,9 +324,11 @@ def main():
     api_access_token_record = None
     params = None
     
+    start_trace()
     # Read and decode input parameters from stdin
     for base64_params in sys.stdin:
-        params = json.loads(base64.b64decode(base64_params).decode())
+        with trace_span('decode'):
+            params = json.loads(base64.b64decode(base64_params).decode())
         '''
         # Optionally print available params for debugging. Uncomment if needed.
         # print(f"# \n# Available params for the script:")
@@ -95,16 +336,33 @@ def main():
         #     print(f"#     {key}={value}")
         '''
 
-        records = json.loads(base64.b64decode(params.get('records')).decode()) # Decode and load records that are passed into the record as JSON strings in the PAM Script section as "Rotation Credential" records
+        with trace_span('record_lookup'):
+            records = json.loads(base64.b64decode(params.get('records')).decode()) # Decode and load records that are passed into the record as JSON strings in the PAM Script section as "Rotation Credential" records
 
-        # Find the Record that contains the access token by its Title
-        api_access_token_record = next((record for record in records if record['title'].lower() == record_title.lower()), None)
+            # Find the Record that contains the access token by its Title
+            api_access_token_record = next((record for record in records if record['title'].lower() == record_title.lower()), None)
         break
 
     if api_access_token_record is None:
         print(f"# Error: No Record with the access token found. Title: {record_title}")
         exit(1)
 
+    rotate_from_params(params, [api_access_token_record])
+
+def rotate_from_params(params, api_access_token_records):
+    """
+    Rotates the password(s) described by a decoded params payload.
+    Used by main() and by the shared pam_rotate entry point, which decode the payload and find the records.
+
+    Args:
+    - params (dict): The decoded params payload.
+    - api_access_token_records (list): The Rotation Credential records titled 'Tenable Authentication Record'. The first one is used.
+
+    Returns:
+    - None. Exits with an error if a password was not updated.
+    """
+    api_access_token_record = api_access_token_records[0]
+
     # Extract Details from the record
     tenable_access_key = api_access_token_record.get('tenable_access_key')
     tenable_secret_key = api_access_token_record.get('tenable_secret_key')
@@ -114,10 +372,23 @@ def main():
 
     # Extract new rotated password to be updated using pyTenable.
     new_password = params.get('newPassword')
+
+    # Optional list of {"user": <credential name>, "newPassword": ...} entries to rotate many credentials at once
+    batch = params.get('users')
  
-    if not all([tenable_access_key, tenable_secret_key, tenable_credential_name]):
+    if not all([tenable_access_key, tenable_secret_key, tenable_credential_name or batch]):
         print("# Error: One or more required fields are missing in the access token record.")
         exit(1)
+
+    if batch:
+        if not isinstance(batch, list) or not all(isinstance(entry, dict) and entry.get('user') and entry.get('newPassword') for entry in batch):
+            print("# Error: Every entry of the users list needs a user and a newPassword.")
+            exit(1)
+        # Rotate the passwords for all given Tenable Credential Names with one client.
+        results = rotate_bulk(tenable_access_key, tenable_secret_key, {entry['user']: entry['newPassword'] for entry in batch})
+        if any(status != "updated" for status in results.values()):
+            exit(1)
+        return
     
     # Rotate the password for a given Tenable Credential Name.
     rotate(tenable_access_key, tenable_secret_key, tenable_credential_name, new_password)
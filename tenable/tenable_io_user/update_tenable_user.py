@@ -12,10 +12,34 @@ NOTE: If spaces are present in the path to the python interpreter, the script wi
     For example: sudo ln -s "/usr/local/bin/my python3.7" /usr/local/bin/pam_rotation_venv_python3
 '''
 
+import os
 import json
 import sys
+import time
 import base64
-from restfly.errors import UnauthorizedError
+import hashlib
+from contextlib import nullcontext
+import requests
+
+# The code shared by the Tenable scripts (time budget, client options and API limiter) is in tenable_common of the
+# pam_rotate directory of pam-scripts, when that directory is next to the tenable directory, as in the repository.
+# Without it the script runs on its own, see DirectCalls.
+try:
+    import tenable_common
+except ImportError:
+    sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'pam_rotate'))
+    try:
+        import tenable_common
+    except ImportError:
+        tenable_common = None
+
+# The timing spans are recorded with rotation_trace of the same directory. Without it the script runs without tracing.
+try:
+    import rotation_trace
+except ImportError:
+    rotation_trace = None
+    if os.environ.get('PAM_TRACE_FILE'):
+        print("# Warning: PAM_TRACE_FILE is set, but the 'rotation_trace' module of the pam_rotate directory could not be imported. No spans are recorded.")
 '''
 Optionally display installed packages for debugging. Uncomment if needed.
 import pkg_resources
@@ -26,29 +50,217 @@ for m in installed_packages_list:
     print(f"  {m}")
 '''
 
-# Import the TenableIO package
-try:
-    from tenable.io import TenableIO
-except ImportError:
-    print("# Error: The 'TenableIO' package could not be imported. Run 'pip install pytenable' to install it.")
-    exit(1)
+# pyTenable defines pydantic models, and pydantic reads the entry points of every installed package on first use to
+# look for plugins. The script uses none, and when it runs from a bundle (pam_rotate/build_bundle.py) the scan reads
+# the whole archive.
+os.environ.setdefault('PYDANTIC_DISABLE_PLUGINS', 'true')
+
+# The TenableIO package is imported by load_sdk() when a rotation first needs it, after the payload has been validated.
+# Importing pyTenable takes longer than the rest of the script, and a payload that fails validation never needs it.
+TenableIO = None
+UnauthorizedError = None
+
+def load_sdk():
+    """
+    Imports the TenableIO package the first time it is needed.
+
+    Returns:
+    - None. Exits with an error if the package is not installed.
+    """
+    global TenableIO, UnauthorizedError
+    if TenableIO is not None:
+        return
+    try:
+        from tenable.io import TenableIO as tenable_client
+        from restfly.errors import UnauthorizedError as unauthorized_error
+    except ImportError:
+        print("# Error: The 'TenableIO' package could not be imported. Run 'pip install pytenable' to install it.")
+        exit(1)
+    TenableIO, UnauthorizedError = tenable_client, unauthorized_error
+
+# Adaptive (AIMD) concurrency for the Tenable API calls. The limit grows by one after a full window of healthy calls,
+# and is halved when Tenable answers 429 or 503. Throttled calls are retried up to TENABLE_THROTTLE_RETRIES times.
+TENABLE_INITIAL_CONCURRENCY = 4
+TENABLE_MAX_CONCURRENCY = 16
+TENABLE_THROTTLE_RETRIES = 5
+
+# Overall time budget of one rotation, in seconds. Connecting, looking up the target and updating the password all draw
+# from the same budget. A call that would run past it is cut off and the rotation is reported as timed out.
+# Can be overridden with the TENABLE_ROTATION_TIMEOUT environment variable.
+TENABLE_ROTATION_TIMEOUT = float(os.environ.get('TENABLE_ROTATION_TIMEOUT', 60))
+# Maximum time to open the connection to Tenable, in seconds, within the budget.
+TENABLE_CONNECT_TIMEOUT = 10
+
+class DirectCalls:
+    """
+    Stands in for the limiter of tenable_common when the script runs without the pam_rotate directory. Every API call
+    is made once, with the retries of pyTenable, and each request may take up to TENABLE_ROTATION_TIMEOUT seconds.
+    """
+    throttled = 0
+
+    def call(self, func, *args, **kwargs):
+        return func(*args, **kwargs)
+
+    def stats(self, since=0):
+        return "Tenable API calls are not limited, the tenable_common module of the pam_rotate directory is not available"
+
+# Errors of a Tenable API call that timed out, or that would have run past the budget of the rotation.
+TIMEOUT_ERRORS = (requests.exceptions.Timeout,) + ((tenable_common.DeadlineExceeded,) if tenable_common else ())
+
+def start_deadline():
+    """
+    Starts the time budget of the rotation on this thread, see tenable_common.start_deadline.
+    Without tenable_common there is no overall budget, only the timeout of each request.
+
+    Returns:
+    - None
+    """
+    if tenable_common is not None:
+        tenable_common.start_deadline(TENABLE_ROTATION_TIMEOUT)
+
+def client_options():
+    """
+    Returns:
+    - dict: The options of a new pyTenable client, see tenable_common.client_options.
+    """
+    if tenable_common is None:
+        return {'timeout': (TENABLE_CONNECT_TIMEOUT, TENABLE_ROTATION_TIMEOUT)}
+    return tenable_common.client_options(TENABLE_CONNECT_TIMEOUT)
+
+def get_limiter(tenant_key):
+    """
+    Returns the limiter of the Tenable API calls to one tenant, see tenable_common.get_limiter.
+
+    Args:
+    - tenant_key (str): The hash of the tenant's access key.
+
+    Returns:
+    - AdaptiveLimiter: The limiter of the tenant, DirectCalls without tenable_common.
+    """
+    if tenable_common is None:
+        return DirectCalls()
+    return tenable_common.get_limiter(tenant_key, TENABLE_INITIAL_CONCURRENCY, TENABLE_MAX_CONCURRENCY, TENABLE_THROTTLE_RETRIES)
+
+# Optional timing spans, recorded with rotation_trace of the pam_rotate directory. Set the PAM_TRACE_FILE environment
+# variable to a file path to append one JSON line per phase of each rotation. Without the pam_rotate directory next
+# to the tenable directory, the script runs without tracing.
+PAM_TRACE_SERVICE = 'tenable-io-user'
+
+def start_trace(trace_id=None):
+    """
+    Starts a trace for one rotation, see rotation_trace.start_trace.
+
+    Args:
+    - trace_id (str): The trace to join. A new trace is started if None.
+
+    Returns:
+    - str: The trace id, None without tracing.
+    """
+    return rotation_trace.start_trace(trace_id) if rotation_trace else None
 
-def fetch_user_id(tio, username):
+def trace_span(name, **attributes):
+    """
+    Records the duration of one phase of the rotation if PAM_TRACE_FILE is set, see rotation_trace.trace_span.
+    """
+    if rotation_trace is None:
+        return nullcontext()
+    return rotation_trace.trace_span(name, PAM_TRACE_SERVICE, **attributes)
+
+# File with the username to user ID index of each tenant, kept between runs. Tenants are identified by a hash of their access key.
+TENABLE_USER_CACHE_FILE = os.path.join(os.path.expanduser('~'), '.cache', 'keeper-pam-scripts', 'tenable_io_users.json')
+# Number of seconds the index of a tenant is used before the users are listed again. 0 disables the index.
+TENABLE_USER_CACHE_TTL = 3600
+
+def load_user_index():
+    """
+    Loads the username to user ID index of all tenants from the cache file.
+
+    Returns:
+    - dict: {tenant_key: {'updated': timestamp, 'users': {username: user_id}}}, empty if there is no usable cache file.
+    """
+    try:
+        with open(TENABLE_USER_CACHE_FILE) as cache_file:
+            return json.load(cache_file)
+    except (OSError, ValueError):
+        return {}
+
+def save_user_index(index):
+    """
+    Writes the username to user ID index of all tenants to the cache file.
+
+    Args:
+    - index (dict): The index, as returned by load_user_index.
+
+    Returns:
+    - None
+    """
+    try:
+        os.makedirs(os.path.dirname(TENABLE_USER_CACHE_FILE), mode=0o700, exist_ok=True)
+        temp_file = f"{TENABLE_USER_CACHE_FILE}.{os.getpid()}.tmp"
+        with open(os.open(temp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as cache_file:
+            json.dump(index, cache_file)
+        os.replace(temp_file, TENABLE_USER_CACHE_FILE)
+    except OSError as e:
+        print(f"# Warning: Unable to write the Tenable user cache: {e}")
+
+def get_cached_user_id(tenant_key, username):
+    """
+    Looks up the ID of a user in the cached index of the tenant.
+
+    Args:
+    - tenant_key (str): The hash of the tenant's access key.
+    - username (str): The username of the user.
+
+    Returns:
+    - user_id(int) or None: The ID of the user if the index of the tenant is still valid and contains it, None otherwise.
+    """
+    # Without tenable_common a stale id cannot be told from other errors, so the users are always listed
+    if TENABLE_USER_CACHE_TTL <= 0 or tenable_common is None:
+        return None
+    entry = load_user_index().get(tenant_key)
+    if not entry or time.time() - entry['updated'] > TENABLE_USER_CACHE_TTL:
+        return None
+    return entry['users'].get(username)
+
+def cache_tenant_users(tenant_key, user_ids):
+    """
+    Replaces the cached index of the tenant. Passing None drops it.
+
+    Args:
+    - tenant_key (str): The hash of the tenant's access key.
+    - user_ids (dict): The user ID by username, or None.
+
+    Returns:
+    - None
+    """
+    if TENABLE_USER_CACHE_TTL <= 0:
+        return
+    index = load_user_index()
+    if user_ids is None:
+        index.pop(tenant_key, None)
+    else:
+        index[tenant_key] = {'updated': time.time(), 'users': user_ids}
+    save_user_index(index)
+
+def fetch_user_id(tio, username, limiter, tenant_key=None):
     """
     Fetches the user ID from Tenable using the TenableIO package.
 
     Args:
     - tio (TenableIO): An instance of the TenableIO class for connecting to Tenable.
     - username (str): The username of the user whose ID needs to be fetched.
+    - limiter (AdaptiveLimiter): The limiter for the API calls to the tenant.
+    - tenant_key (str): Optional hash of the tenant's access key. If given, the IDs of all listed users are cached.
 
     Returns:
     - user_id(int) or None: The ID of the user if found, None otherwise.
     """
     try:
-        for user in tio.users.list():
-            if user["username"] == username:
-                return user["id"]
-        return None
+        with trace_span('target_lookup'):
+            user_ids = {user["username"]: user["id"] for user in limiter.call(tio.users.list)}
+        if tenant_key is not None:
+            cache_tenant_users(tenant_key, user_ids)
+        return user_ids.get(username)
     except UnauthorizedError as e:
         print(f"# Error: Access Key or Secret Key Invalid")
         exit(1)
@@ -69,19 +281,49 @@ def rotate(tenable_access_key, tenable_secret_key, tenable_user_name, old_passwo
     - None
     """
 
-    # Connect with tenable using TenableIO package
-    tio = TenableIO(tenable_access_key, tenable_secret_key)
+    load_sdk()
+    start_deadline()
+    tenant_key = hashlib.sha256(tenable_access_key.encode()).hexdigest()
+    limiter = get_limiter(tenant_key)
+    # The limiter is shared by all rotations of the tenant, report only the calls throttled during this one
+    throttled = limiter.throttled
+    try:
+        # Connect with tenable using TenableIO package
+        with trace_span('connect'):
+            tio = TenableIO(tenable_access_key, tenable_secret_key, **client_options())
+
+        # Try the cached user id first, to skip listing all users of the tenant
+        user_id = get_cached_user_id(tenant_key, tenable_user_name)
+        if user_id is not None:
+            try:
+                with trace_span('update'):
+                    limiter.call(tio.users.change_password, user_id, old_password, new_password)
+                print(f"Password successfully rotated for the given Tenable User - {tenable_user_name}")
+                if limiter.throttled > throttled:
+                    print(limiter.stats(since=throttled))
+                return
+            except Exception as e:
+                # Only a stale id is retried. Other errors, e.g. a wrong current password, would fail again.
+                if not tenable_common.is_stale_id_error(e):
+                    raise
+                cache_tenant_users(tenant_key, None)
     
-    # Fetch user id of the given Tenable User
-    user_id = fetch_user_id(tio, tenable_user_name)
+        # Fetch user id of the given Tenable User
+        user_id = fetch_user_id(tio, tenable_user_name, limiter, tenant_key)
 
-    if user_id is None:
-        print(f"# Error: No user id fetched for the given username: {tenable_user_name}")
-        exit(1)
+        if user_id is None:
+            print(f"# Error: No user id fetched for the given username: {tenable_user_name}")
+            exit(1)
     
-    tio.users.change_password(user_id, old_password, new_password)
+        with trace_span('update'):
+            limiter.call(tio.users.change_password, user_id, old_password, new_password)
     
-    print(f"Password successfully rotated for the given Tenable User - {tenable_user_name}")
+        print(f"Password successfully rotated for the given Tenable User - {tenable_user_name}")
+        if limiter.throttled > throttled:
+            print(limiter.stats(since=throttled))
+    except TIMEOUT_ERRORS as e:
+        print(f"# Error: Timed out while rotating the password for the given Tenable User - {tenable_user_name}: {e}")
+        exit(1)
 
 def main():
     """
@@ -101,9 +343,11 @@ def main():
     api_access_token_record = None
     params = None
     
+    start_trace()
     # Read and decode input parameters from stdin
     for base64_params in sys.stdin:
-        params = json.loads(base64.b64decode(base64_params).decode())
+        with trace_span('decode'):
+            params = json.loads(base64.b64decode(base64_params).decode())
         '''
         # Optionally print available params for debugging. Uncomment if needed.
         # print(f"# \n# Available params for the script:")
@@ -111,16 +355,33 @@ def main():
         #     print(f"#     {key}={value}")
         '''
 
-        records = json.loads(base64.b64decode(params.get('records')).decode()) # Decode and load records that are passed into the record as JSON strings in the PAM Script section as "Rotation Credential" records
+        with trace_span('record_lookup'):
+            records = json.loads(base64.b64decode(params.get('records')).decode()) # Decode and load records that are passed into the record as JSON strings in the PAM Script section as "Rotation Credential" records
 
-        # Find the Record that contains the access token by its Title
-        api_access_token_record = next((record for record in records if record['title'].lower() == record_title.lower()), None)
+            # Find the Record that contains the access token by its Title
+            api_access_token_record = next((record for record in records if record['title'].lower() == record_title.lower()), None)
         break
 
     if api_access_token_record is None:
         print(f"# Error: No Record with the access token found. Title: {record_title}")
         exit(1)
 
+    rotate_from_params(params, [api_access_token_record])
+
+def rotate_from_params(params, api_access_token_records):
+    """
+    Rotates the password(s) described by a decoded params payload.
+    Used by main() and by the shared pam_rotate entry point, which decode the payload and find the records.
+
+    Args:
+    - params (dict): The decoded params payload.
+    - api_access_token_records (list): The Rotation Credential records titled 'Tenable Authentication Record'. The first one is used.
+
+    Returns:
+    - None. Exits with an error if a password was not updated.
+    """
+    api_access_token_record = api_access_token_records[0]
+
     # Extract Details from the record
     tenable_access_key = api_access_token_record.get('tenable_access_key')
     tenable_secret_key = api_access_token_record.get('tenable_secret_key')
@@ -12,10 +12,36 @@ NOTE: If spaces are present in the path to the python interpreter, the script wi
     For example: sudo ln -s "/usr/local/bin/my python3.7" /usr/local/bin/pam_rotation_venv_python3
 '''
 
+import os
 import json
 import sys
+import time
 import base64
-from restfly.errors import UnauthorizedError
+import threading
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+import requests
+
+# The code shared by the Tenable scripts (time budget, client options and API limiter) is in tenable_common of the
+# pam_rotate directory of pam-scripts, when that directory is next to the tenable directory, as in the repository.
+# Without it the script runs on its own, see DirectCalls.
+try:
+    import tenable_common
+except ImportError:
+    sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), 'pam_rotate'))
+    try:
+        import tenable_common
+    except ImportError:
+        tenable_common = None
+
+# The timing spans are recorded with rotation_trace of the same directory. Without it the script runs without tracing.
+try:
+    import rotation_trace
+except ImportError:
+    rotation_trace = None
+    if os.environ.get('PAM_TRACE_FILE'):
+        print("# Warning: PAM_TRACE_FILE is set, but the 'rotation_trace' module of the pam_rotate directory could not be imported. No spans are recorded.")
 '''
 Optionally display installed packages for debugging. Uncomment if needed.
 import pkg_resources
@@ -26,29 +52,250 @@ for m in installed_packages_list:
     print(f"  {m}")
 '''
 
-# Import the TenableSC package
-try:
-    from tenable.sc import TenableSC
-except ImportError:
-    print("# Error: The 'TenableSC' package could not be imported. Run 'pip install pytenable' to install it.")
-    exit(1)
+# pyTenable defines pydantic models, and pydantic reads the entry points of every installed package on first use to
+# look for plugins. The script uses none, and when it runs from a bundle (pam_rotate/build_bundle.py) the scan reads
+# the whole archive.
+os.environ.setdefault('PYDANTIC_DISABLE_PLUGINS', 'true')
+
+# The TenableSC package is imported by load_sdk() when a rotation first needs it, after the payload has been validated.
+# Importing pyTenable takes longer than the rest of the script, and a payload that fails validation never needs it.
+TenableSC = None
+UnauthorizedError = None
+
+def load_sdk():
+    """
+    Imports the TenableSC package the first time it is needed.
+
+    Returns:
+    - None. Exits with an error if the package is not installed.
+    """
+    global TenableSC, UnauthorizedError
+    if TenableSC is not None:
+        return
+    try:
+        from tenable.sc import TenableSC as tenable_client
+        from restfly.errors import UnauthorizedError as unauthorized_error
+    except ImportError:
+        print("# Error: The 'TenableSC' package could not be imported. Run 'pip install pytenable' to install it.")
+        exit(1)
+    TenableSC, UnauthorizedError = tenable_client, unauthorized_error
+
+# Adaptive (AIMD) concurrency for the Tenable API calls. The limit grows by one after a full window of healthy calls,
+# and is halved when Tenable answers 429 or 503. Throttled calls are retried up to TENABLE_THROTTLE_RETRIES times.
+TENABLE_INITIAL_CONCURRENCY = 4
+TENABLE_MAX_CONCURRENCY = 16
+TENABLE_THROTTLE_RETRIES = 5
 
-def fetch_user_id(sc, username):
+# Overall time budget of one rotation, in seconds. Connecting, looking up the target and updating the password all draw
+# from the same budget. A call that would run past it is cut off and the rotation is reported as timed out.
+# Can be overridden with the TENABLE_ROTATION_TIMEOUT environment variable.
+TENABLE_ROTATION_TIMEOUT = float(os.environ.get('TENABLE_ROTATION_TIMEOUT', 60))
+# Maximum time to open the connection to Tenable, in seconds, within the budget.
+TENABLE_CONNECT_TIMEOUT = 10
+
+class DirectCalls:
+    """
+    Stands in for the limiter of tenable_common when the script runs without the pam_rotate directory. Every API call
+    is made once, with the retries of pyTenable, and each request may take up to TENABLE_ROTATION_TIMEOUT seconds.
+    """
+    throttled = 0
+
+    def call(self, func, *args, **kwargs):
+        return func(*args, **kwargs)
+
+    def stats(self, since=0):
+        return "Tenable API calls are not limited, the tenable_common module of the pam_rotate directory is not available"
+
+# Errors of a Tenable API call that timed out, or that would have run past the budget of the rotation.
+TIMEOUT_ERRORS = (requests.exceptions.Timeout,) + ((tenable_common.DeadlineExceeded,) if tenable_common else ())
+
+def start_deadline():
+    """
+    Starts the time budget of the rotation on this thread, see tenable_common.start_deadline.
+    Without tenable_common there is no overall budget, only the timeout of each request.
+
+    Returns:
+    - None
+    """
+    if tenable_common is not None:
+        tenable_common.start_deadline(TENABLE_ROTATION_TIMEOUT)
+
+def client_options():
+    """
+    Returns:
+    - dict: The options of a new pyTenable client, see tenable_common.client_options.
+    """
+    if tenable_common is None:
+        return {'timeout': (TENABLE_CONNECT_TIMEOUT, TENABLE_ROTATION_TIMEOUT)}
+    return tenable_common.client_options(TENABLE_CONNECT_TIMEOUT)
+
+def get_limiter(sc_key):
+    """
+    Returns the limiter of the Tenable API calls to one Security Center, see tenable_common.get_limiter.
+
+    Args:
+    - sc_key (str): The hash of the Security Center's host and access key.
+
+    Returns:
+    - AdaptiveLimiter: The limiter of the Security Center, DirectCalls without tenable_common.
+    """
+    if tenable_common is None:
+        return DirectCalls()
+    return tenable_common.get_limiter(sc_key, TENABLE_INITIAL_CONCURRENCY, TENABLE_MAX_CONCURRENCY, TENABLE_THROTTLE_RETRIES)
+
+# Optional timing spans, recorded with rotation_trace of the pam_rotate directory. Set the PAM_TRACE_FILE environment
+# variable to a file path to append one JSON line per phase of each rotation. Without the pam_rotate directory next
+# to the tenable directory, the script runs without tracing.
+PAM_TRACE_SERVICE = 'tenable-sc-user'
+
+def start_trace(trace_id=None):
+    """
+    Starts a trace for one rotation, see rotation_trace.start_trace.
+
+    Args:
+    - trace_id (str): The trace to join. A new trace is started if None.
+
+    Returns:
+    - str: The trace id, None without tracing.
+    """
+    return rotation_trace.start_trace(trace_id) if rotation_trace else None
+
+def current_trace_id():
+    """
+    Returns:
+    - str: The trace id of the rotation on this thread, to pass to start_trace() on worker threads.
+    """
+    return rotation_trace.current_trace_id() if rotation_trace else None
+
+def trace_span(name, **attributes):
+    """
+    Records the duration of one phase of the rotation if PAM_TRACE_FILE is set, see rotation_trace.trace_span.
+    """
+    if rotation_trace is None:
+        return nullcontext()
+    return rotation_trace.trace_span(name, PAM_TRACE_SERVICE, **attributes)
+
+# Optional file with the username to user ID index of each Security Center, kept between runs.
+# Security Centers are identified by a hash of their host and access key.
+TENABLE_SC_USER_CACHE_FILE = os.path.join(os.path.expanduser('~'), '.cache', 'keeper-pam-scripts', 'tenable_sc_users.json')
+# Number of seconds the index of a Security Center is used before the users are listed again. 0 disables the index.
+TENABLE_SC_USER_CACHE_TTL = 0
+_cache_lock = threading.Lock()
+
+# Maximum number of Security Centers rotated at the same time in multi-host mode.
+TENABLE_SC_MAX_HOSTS = 16
+
+def load_user_index():
+    """
+    Loads the username to user ID index of all Security Centers from the cache file.
+
+    Returns:
+    - dict: {sc_key: {'updated': timestamp, 'users': {username: user_id}}}, empty if there is no usable cache file.
+    """
+    try:
+        with open(TENABLE_SC_USER_CACHE_FILE) as cache_file:
+            return json.load(cache_file)
+    except (OSError, ValueError):
+        return {}
+
+def save_user_index(index):
+    """
+    Writes the username to user ID index of all Security Centers to the cache file.
+
+    Args:
+    - index (dict): The index, as returned by load_user_index.
+
+    Returns:
+    - None
+    """
+    try:
+        os.makedirs(os.path.dirname(TENABLE_SC_USER_CACHE_FILE), mode=0o700, exist_ok=True)
+        temp_file = f"{TENABLE_SC_USER_CACHE_FILE}.{os.getpid()}.tmp"
+        with open(os.open(temp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as cache_file:
+            json.dump(index, cache_file)
+        os.replace(temp_file, TENABLE_SC_USER_CACHE_FILE)
+    except OSError as e:
+        print(f"# Warning: Unable to write the Tenable SC user cache: {e}")
+
+def get_cached_user_id(sc_key, username):
+    """
+    Looks up the ID of a user in the cached index of the Security Center.
+
+    Args:
+    - sc_key (str): The hash of the Security Center's host and access key.
+    - username (str): The username of the user.
+
+    Returns:
+    - user_id(int) or None: The ID of the user if the index is enabled, still valid and contains it, None otherwise.
+    """
+    # Without tenable_common a stale id cannot be told from other errors, so the users are always listed
+    if TENABLE_SC_USER_CACHE_TTL <= 0 or tenable_common is None:
+        return None
+    entry = load_user_index().get(sc_key)
+    if not entry or time.time() - entry['updated'] > TENABLE_SC_USER_CACHE_TTL:
+        return None
+    return entry['users'].get(username)
+
+def cache_sc_users(sc_key, user_ids):
+    """
+    Replaces the cached index of the Security Center. Passing None drops it.
+
+    Args:
+    - sc_key (str): The hash of the Security Center's host and access key.
+    - user_ids (dict): The user ID by username, or None.
+
+    Returns:
+    - None
+    """
+    if TENABLE_SC_USER_CACHE_TTL <= 0:
+        return
+    # Hosts are rotated concurrently in multi-host mode, keep their read-modify-write cycles apart
+    with _cache_lock:
+        index = load_user_index()
+        if user_ids is None:
+            index.pop(sc_key, None)
+        else:
+            index[sc_key] = {'updated': time.time(), 'users': user_ids}
+        save_user_index(index)
+
+def find_user_id(sc, username, limiter, sc_key=None):
+    """
+    Looks up the user ID on a Security Center.
+    Only the id and username fields are requested, instead of the full user objects with their roles, groups and preferences.
+
+    Args:
+    - sc (TenableSC): An instance of the TenableSC class for connecting to Tenable.
+    - username (str): The username of the user whose ID needs to be fetched.
+    - limiter (AdaptiveLimiter): The limiter for the API calls to this Security Center.
+    - sc_key (str): Optional hash of the Security Center's host and access key. If given and the cache is enabled, the IDs of all listed users are cached.
+
+    Returns:
+    - user_id(int) or None: The ID of the user if found, None otherwise. API errors are raised.
+    """
+    with trace_span('target_lookup'):
+        users = limiter.call(sc.users.list, fields=['id', 'username'])
+    if sc_key is not None and TENABLE_SC_USER_CACHE_TTL > 0:
+        cache_sc_users(sc_key, {user["username"]: user["id"] for user in users})
+    for user in users:
+        if user["username"] == username:
+            return user["id"]
+    return None
+
+def fetch_user_id(sc, username, limiter, sc_key=None):
     """
     Fetches the user ID from Tenable using the TenableSC package.
 
     Args:
     - sc (TenableSC): An instance of the TenableSC class for connecting to Tenable.
     - username (str): The username of the user whose ID needs to be fetched.
+    - limiter (AdaptiveLimiter): The limiter for the API calls to this Security Center.
+    - sc_key (str): Optional hash of the Security Center's host and access key, see find_user_id.
 
     Returns:
     - user_id(int) or None: The ID of the user if found, None otherwise.
     """
     try:
-        for user in sc.users.list():
-            if user["username"] == username:
-                return user["id"]
-        return None
+        return find_user_id(sc, username, limiter, sc_key)
     except UnauthorizedError as e:
         print(f"# Error: Access Key or Secret Key Invalid")
         exit(1)
@@ -70,23 +317,130 @@ def rotate(host, tenable_access_key, tenable_secret_key, tenable_user_name, old_
     - None
     """
 
-    # Connect with tenable using TenableSC class
-    sc = TenableSC(host,
-                    access_key=tenable_access_key,
-                    secret_key=tenable_secret_key
-                    )
+    load_sdk()
+    start_deadline()
+    sc_key = hashlib.sha256(f"{host}\0{tenable_access_key}".encode()).hexdigest()
+    limiter = get_limiter(sc_key)
+    # The limiter is shared by all rotations on the Security Center, report only the calls throttled during this one
+    throttled = limiter.throttled
+    try:
+        # Connect with tenable using TenableSC class
+        with trace_span('connect', host=host):
+            sc = TenableSC(host,
+                            access_key=tenable_access_key,
+                            secret_key=tenable_secret_key,
+                            **client_options()
+                            )
     
-    # Fetch user id of the given TenableSC User
-    user_id = fetch_user_id(sc, tenable_user_name)
+        # Try the cached user id first, if the cache is enabled
+        user_id = get_cached_user_id(sc_key, tenable_user_name)
+        if user_id is not None:
+            try:
+                with trace_span('update', host=host):
+                    limiter.call(sc.users.edit, user_id, currentPassword=old_password, password=new_password)
+                print(f"Password successfully rotated for the given TenableSC User - {tenable_user_name}")
+                if limiter.throttled > throttled:
+                    print(limiter.stats(since=throttled))
+                return
+            except Exception as e:
+                # Only a stale id is retried. Other errors, e.g. a wrong current password, would fail again.
+                if not tenable_common.is_stale_id_error(e):
+                    raise
+                cache_sc_users(sc_key, None)
 
-    if user_id is None:
-        print(f"# Error: No user id fetched for the given username: {tenable_user_name}")
-        exit(1)
+        # Fetch user id of the given TenableSC User
+        user_id = fetch_user_id(sc, tenable_user_name, limiter, sc_key)
+
+        if user_id is None:
+            print(f"# Error: No user id fetched for the given username: {tenable_user_name}")
+            exit(1)
     
-    # Update Tenable SC user password.
-    sc.users.edit(user_id, currentPassword=old_password, password=new_password)
+        # Update Tenable SC user password.
+        with trace_span('update', host=host):
+            limiter.call(sc.users.edit, user_id, currentPassword=old_password, password=new_password)
     
-    print(f"Password successfully rotated for the given TenableSC User - {tenable_user_name}")
+        print(f"Password successfully rotated for the given TenableSC User - {tenable_user_name}")
+        if limiter.throttled > throttled:
+            print(limiter.stats(since=throttled))
+    except TIMEOUT_ERRORS as e:
+        print(f"# Error: Timed out while rotating the password for the given TenableSC User - {tenable_user_name}: {e}")
+        exit(1)
+
+def rotate_host(console, tenable_user_name, old_password, new_password):
+    """
+    Rotate the password for a Tenable SC user on one Security Center of a multi-host rotation.
+    Each Security Center gets its own limiter, so throttling by one console does not slow down the others.
+
+    Args:
+    - console (dict): The Security Center with its 'host', 'access_key' and 'secret_key'.
+    - tenable_user_name (str): The username of the Tenable SC User whose password needs to be rotated.
+    - old_password (str): The current password of the Tenable SC User.
+    - new_password (str): The new password to be set for the Tenable SC User.
+
+    Returns:
+    - (bool, str): True if the password was updated, and the status of the Security Center.
+    """
+    start_deadline()
+    sc_key = hashlib.sha256(f"{console['host']}\0{console['access_key']}".encode()).hexdigest()
+    limiter = get_limiter(sc_key)
+    try:
+        with trace_span('connect', host=console['host']):
+            sc = TenableSC(console['host'], access_key=console['access_key'], secret_key=console['secret_key'], **client_options())
+
+        user_id = get_cached_user_id(sc_key, tenable_user_name)
+        if user_id is not None:
+            try:
+                with trace_span('update', host=console['host']):
+                    limiter.call(sc.users.edit, user_id, currentPassword=old_password, password=new_password)
+                return True, "updated"
+            except Exception as e:
+                # Only a stale id is retried, as in rotate
+                if not tenable_common.is_stale_id_error(e):
+                    raise
+                cache_sc_users(sc_key, None)
+
+        user_id = find_user_id(sc, tenable_user_name, limiter, sc_key)
+        if user_id is None:
+            return False, "user not found"
+        with trace_span('update', host=console['host']):
+            limiter.call(sc.users.edit, user_id, currentPassword=old_password, password=new_password)
+        return True, "updated"
+    except UnauthorizedError:
+        return False, "access key or secret key invalid"
+    except TIMEOUT_ERRORS:
+        return False, "timed out"
+    except Exception as err:
+        return False, f"error: {err}"
+
+def rotate_hosts(consoles, tenable_user_name, old_password, new_password, max_workers=TENABLE_SC_MAX_HOSTS):
+    """
+    Rotate the password for the same Tenable SC user on many Security Centers concurrently.
+    The rotation takes as long as the slowest Security Center instead of the sum of all of them.
+
+    Args:
+    - consoles (list): The Security Centers to update, see rotate_host.
+    - tenable_user_name (str): The username of the Tenable SC User whose password needs to be rotated.
+    - old_password (str): The current password of the Tenable SC User.
+    - new_password (str): The new password to be set for the Tenable SC User.
+    - max_workers (int): Maximum number of Security Centers rotated at the same time.
+
+    Returns:
+    - list: One (console, success, status) tuple per Security Center, in the order of the given consoles.
+    """
+    load_sdk()
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(consoles)), initializer=start_trace, initargs=(current_trace_id(),)) as executor:
+        futures = [executor.submit(rotate_host, console, tenable_user_name, old_password, new_password) for console in consoles]
+        results = [(console, *future.result()) for console, future in zip(consoles, futures)]
+
+    # Print the per-host result table
+    width = max(len('Host'), *(len(console['host']) for console in consoles))
+    print(f"{'Host':<{width}}  Status")
+    for console, success, status in results:
+        print(f"{console['host']:<{width}}  {status}")
+
+    updated = sum(1 for _, success, _ in results if success)
+    print(f"Password rotated for TenableSC User {tenable_user_name} on {updated} of {len(results)} Security Centers")
+    return results
 
 def main():
     """
@@ -103,12 +457,14 @@ def main():
     """
     
     record_title = 'Tenable Authentication Record' #This should be same as the title of the record containing access key and secret key.
-    api_access_token_record = None
+    api_access_token_records = []
     params = None
     
+    start_trace()
     # Read and decode input parameters from stdin
     for base64_params in sys.stdin:
-        params = json.loads(base64.b64decode(base64_params).decode())
+        with trace_span('decode'):
+            params = json.loads(base64.b64decode(base64_params).decode())
         '''
         # Optionally print available params for debugging. Uncomment if needed.
         # print(f"# \n# Available params for the script:")
@@ -116,20 +472,42 @@ def main():
         #     print(f"#     {key}={value}")
         '''
 
-        records = json.loads(base64.b64decode(params.get('records')).decode()) # Decode and load records that are passed into the record as JSON strings in the PAM Script section as "Rotation Credential" records
+        with trace_span('record_lookup'):
+            records = json.loads(base64.b64decode(params.get('records')).decode()) # Decode and load records that are passed into the record as JSON strings in the PAM Script section as "Rotation Credential" records
 
-        # Find the Record that contains the access token by its Title
-        api_access_token_record = next((record for record in records if record['title'].lower() == record_title.lower()), None)
+            # Find the Records that contain the access token by their Title. Several records are rotated in multi-host mode.
+            api_access_token_records = [record for record in records if record['title'].lower() == record_title.lower()]
         break
 
-    if api_access_token_record is None:
+    if not api_access_token_records:
         print(f"# Error: No Record with the access token found. Title: {record_title}")
         exit(1)
 
-    # Extract Tenable authentication details from the record
-    host = api_access_token_record.get('tenable_sc_host')
-    tenable_access_key = api_access_token_record.get('tenable_access_key')
-    tenable_secret_key = api_access_token_record.get('tenable_secret_key')
+    rotate_from_params(params, api_access_token_records)
+
+def rotate_from_params(params, api_access_token_records):
+    """
+    Rotates the password described by a decoded params payload, on every Security Center of the records.
+    Used by main() and by the shared pam_rotate entry point, which decode the payload and find the records.
+
+    Args:
+    - params (dict): The decoded params payload.
+    - api_access_token_records (list): The Rotation Credential records titled 'Tenable Authentication Record'.
+
+    Returns:
+    - None. Exits with an error if the password was not updated.
+    """
+
+    # Extract Tenable authentication details from the records. The host field may hold several hosts separated by commas.
+    consoles = []
+    for api_access_token_record in api_access_token_records:
+        tenable_access_key = api_access_token_record.get('tenable_access_key')
+        tenable_secret_key = api_access_token_record.get('tenable_secret_key')
+        hosts = [host.strip() for host in (api_access_token_record.get('tenable_sc_host') or '').split(',') if host.strip()]
+        if not all([hosts, tenable_access_key, tenable_secret_key]):
+            print("# Error: One or more required fields are missing in the access token record.")
+            exit(1)
+        consoles.extend({'host': host, 'access_key': tenable_access_key, 'secret_key': tenable_secret_key} for host in hosts)
     
     # User name of the user whose password needs to be rotated.
     tenable_user_name = params.get('user')
@@ -138,12 +516,20 @@ def main():
     old_password = params.get('oldPassword')
     new_password = params.get('newPassword')
     
-    if not all([host, tenable_access_key, tenable_secret_key, tenable_user_name, old_password, new_password]):
+    if not all([tenable_user_name, old_password, new_password]):
         print("# Error: One or more required fields are missing in the access token record.")
         exit(1)
-    
+
+    # Rotate the password on all Security Centers at once in multi-host mode
+    if len(consoles) > 1:
+        results = rotate_hosts(consoles, tenable_user_name, old_password, new_password)
+        if not all(success for _, success, _ in results):
+            exit(1)
+        return
+
     # Rotate the password for a given TenableSC user.
-    rotate(host, tenable_access_key, tenable_secret_key, tenable_user_name, old_password, new_password)
+    console = consoles[0]
+    rotate(console['host'], console['access_key'], console['secret_key'], tenable_user_name, old_password, new_password)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,74 @@
+'''
+Shared fixtures of the tests.
+
+The tests run the rotation scripts against the stand-in servers of benchmarks/mock_backends.py, loaded the way
+pam_rotate.py loads them, so they need the same Python packages as the scripts. Run them from the root of this
+repository with python3 -m pytest.
+'''
+
+import os
+import sys
+import functools
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, 'pam_rotate'))
+sys.path.insert(0, os.path.join(ROOT, 'benchmarks'))
+
+import mock_backends
+import bench_rotation
+import rotation_runner
+
+@pytest.fixture
+def start_backend():
+    """
+    Starts stand-in servers for the test and stops them after it.
+
+    Returns:
+    - callable: start(backend, **options) starts the stand-in of a backend with the BackendState options and returns
+      (state, port).
+    """
+    servers = []
+
+    def start(backend, **options):
+        state = mock_backends.BackendState(**options)
+        server = mock_backends.start_backend(backend, state)
+        servers.append(server)
+        return state, server.server_address[1]
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+@pytest.fixture
+def load_script(monkeypatch, tmp_path):
+    """
+    Loads rotation scripts with their cache files in the temporary directory of the test.
+    The scripts stay loaded between tests, so every setting a test changes must be changed with monkeypatch.
+
+    Returns:
+    - callable: load(backend, port=None) returns the loaded script, pointed at the stand-in server on the port if given.
+    """
+    def load(backend, port=None):
+        module = rotation_runner.load_backend(backend)
+        if hasattr(module, 'load_sdk'):
+            module.load_sdk()
+        for name in bench_rotation.CACHE_FILE_SETTINGS:
+            if hasattr(module, name):
+                monkeypatch.setattr(module, name, str(tmp_path / os.path.basename(getattr(module, name))))
+        if port is None:
+            return module
+        if backend == 'cisco-meraki':
+            monkeypatch.setattr(module, 'MERAKI_API_URL', f"http://127.0.0.1:{port}/api/v1")
+        elif backend in ('tenable-io-user', 'tenable-credential'):
+            monkeypatch.setattr(module, 'TenableIO', functools.partial(module.TenableIO, url=f"http://127.0.0.1:{port}"))
+        elif backend == 'tenable-sc-user':
+            monkeypatch.setattr(module, 'TenableSC', functools.partial(module.TenableSC, scheme='http', port=port))
+        elif backend == 'snowflake':
+            connect = module.snowflake.connector.connect
+            monkeypatch.setattr(module.snowflake.connector, 'connect', functools.partial(connect, host='127.0.0.1', port=port, protocol='http'))
+        return module
+
+    return load
@@ -0,0 +1,56 @@
+'''
+Batch mode of the Cisco IOS XE script: several users of a device in one PATCH, on one device or on many devices
+at once.
+'''
+
+import time
+
+def device(endpoint, port, site=None):
+    """
+    Returns:
+    - dict: A device served by the stand-in on the port.
+    """
+    return {'endpoint': endpoint, 'site': site or endpoint, 'url': f"http://127.0.0.1:{port}/restconf/data/Cisco-IOS-XE-native:native/",
+            'login': 'admin', 'password': 'admin'}
+
+NEW_PASSWORDS = {'user1': 'NewPassword1', 'user2': 'NewPassword2', 'user9': 'NewPassword9'}
+
+def test_batch_updates_found_users_in_one_patch(start_backend, load_script, capsys):
+    state, port = start_backend('cisco-ios-xe', users=5)
+    module = load_script('cisco-ios-xe')
+
+    results = module.rotate_batch(device('r1', port)['url'], 'admin', 'admin', NEW_PASSWORDS)
+
+    assert results == {'user1': 'updated', 'user2': 'updated', 'user9': 'user not found'}
+    assert state.paths['PATCH /restconf/data/Cisco-IOS-XE-native:native/'] == 1
+    assert 'user9  user not found' in capsys.readouterr().out
+
+def test_batch_on_several_devices_runs_concurrently(start_backend, load_script, capsys):
+    backends = [start_backend('cisco-ios-xe', users=5, latency=0.3) for _ in range(4)]
+    module = load_script('cisco-ios-xe')
+    devices = [device(f"r{i}", port) for i, (_, port) in enumerate(backends)]
+
+    start = time.monotonic()
+    results = module.rotate_fleet_batch(devices, NEW_PASSWORDS)
+    elapsed = time.monotonic() - start
+
+    # Each device needs two requests of 0.3 s, the four devices one after the other would take 2.4 s
+    assert elapsed < 1.5
+    assert [statuses for _, statuses in results] == [{'user1': 'updated', 'user2': 'updated', 'user9': 'user not found'}] * 4
+    assert all(state.paths['PATCH /restconf/data/Cisco-IOS-XE-native:native/'] == 1 for state, _ in backends)
+    output = capsys.readouterr().out
+    assert 'r3      r3    user2  updated' in output
+    assert 'Passwords updated for 3 users on 0 of 4 devices' in output
+
+def test_budget_is_checked_while_the_body_is_read(start_backend, load_script, monkeypatch, capsys):
+    # The username list arrives in pieces of 256 bytes every 0.1 s, no single read waits long enough to time out
+    _, port = start_backend('cisco-ios-xe', users=200, trickle=0.1)
+    module = load_script('cisco-ios-xe')
+    monkeypatch.setattr(module, 'CISCO_ROTATION_TIMEOUT', 1)
+
+    start = time.monotonic()
+    results = module.rotate_batch(device('r1', port)['url'], 'admin', 'admin', NEW_PASSWORDS)
+
+    # The whole list would take more than 2 s
+    assert time.monotonic() - start < 1.6
+    assert set(results.values()) == {'timed out'}
@@ -0,0 +1,72 @@
+'''
+Fleet mode of the Cisco IOS XE script: site scheduling and the outcome of every device.
+'''
+
+import time
+import socket
+
+def fleet(site, port, count):
+    """
+    Returns:
+    - list: count devices of the site, all served by the stand-in on the port.
+    """
+    url = f"http://127.0.0.1:{port}/restconf/data/Cisco-IOS-XE-native:native/"
+    return [{'endpoint': f"{site}-{i}", 'site': site, 'url': url, 'login': 'admin', 'password': 'admin'} for i in range(count)]
+
+def test_fleet_respects_per_site_limit(start_backend, load_script, capsys):
+    slow_state, slow_port = start_backend('cisco-ios-xe', latency=0.2)
+    fast_state, fast_port = start_backend('cisco-ios-xe', latency=0.05)
+    module = load_script('cisco-ios-xe')
+
+    results = module.rotate_fleet(fleet('slow', slow_port, 6) + fleet('fast', fast_port, 6), 'user1', 'NewPassword1',
+                                  max_workers=4, per_site_limit=2)
+
+    assert all(success for _, success, _ in results)
+    assert slow_state.max_in_flight == 2
+    assert fast_state.max_in_flight == 2
+    assert 'Password updated for user user1 on 12 of 12 devices' in capsys.readouterr().out
+
+def test_busy_site_does_not_hold_back_other_sites(start_backend, load_script, monkeypatch):
+    slow_state, slow_port = start_backend('cisco-ios-xe', latency=0.2)
+    fast_state, fast_port = start_backend('cisco-ios-xe', latency=0.02)
+    module = load_script('cisco-ios-xe')
+
+    finished = {}
+    rotate_device = module.rotate_device
+
+    def timed_rotate_device(device, cisco_user_name, new_password):
+        result = rotate_device(device, cisco_user_name, new_password)
+        finished[device['endpoint']] = time.monotonic()
+        return result
+
+    monkeypatch.setattr(module, 'rotate_device', timed_rotate_device)
+
+    # The devices of the slow site come first, with more workers than the slow site may use
+    start = time.monotonic()
+    module.rotate_fleet(fleet('slow', slow_port, 6) + fleet('fast', fast_port, 6), 'user1', 'NewPassword1',
+                        max_workers=3, per_site_limit=1)
+
+    # Each slow device takes two requests of 0.2 s, one at a time, so the slow site needs about 2.4 s. The fast
+    # site is rotated by the other workers in the meantime.
+    fast_done = max(finished[f"fast-{i}"] for i in range(6)) - start
+    slow_done = max(finished[f"slow-{i}"] for i in range(6)) - start
+    assert slow_done >= 2.4
+    assert fast_done < 1.0
+    assert slow_state.max_in_flight == 1
+
+def test_failed_devices_are_reported_per_device(start_backend, load_script, capsys):
+    state, port = start_backend('cisco-ios-xe', users=2)
+    module = load_script('cisco-ios-xe')
+    devices = fleet('a', port, 2)
+    # Nothing listens on the port of the second site
+    with socket.socket() as unused:
+        unused.bind(('127.0.0.1', 0))
+        devices += fleet('b', unused.getsockname()[1], 1)
+
+    results = module.rotate_fleet(devices, 'user1', 'NewPassword1', max_workers=4, per_site_limit=2)
+    missing_user = module.rotate_fleet(fleet('a', port, 1), 'user7', 'NewPassword1')
+
+    assert [(device['endpoint'], success) for device, success, _ in results] == [('a-0', True), ('a-1', True), ('b-0', False)]
+    assert results[2][2].startswith('error:')
+    assert missing_user[0][1:] == (False, 'user not found')
+    assert 'Password updated for user user1 on 2 of 3 devices' in capsys.readouterr().out
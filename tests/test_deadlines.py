@@ -0,0 +1,104 @@
+'''
+Time budget of a rotation: a slow or throttling backend fails the rotation when the budget is used up, instead of
+holding the Keeper Gateway.
+'''
+
+import time
+import uuid
+
+import pytest
+import restfly.errors
+import restfly.session
+
+def run_rotation(rotate, *args):
+    """
+    Runs a rotation that is expected to fail.
+
+    Returns:
+    - (int, float): The exit code and the duration in seconds.
+    """
+    start = time.monotonic()
+    with pytest.raises(SystemExit) as exit_info:
+        rotate(*args)
+    return exit_info.value.code, time.monotonic() - start
+
+def test_cisco_rotation_timeout(start_backend, load_script, monkeypatch, capsys):
+    _, port = start_backend('cisco-ios-xe', latency=3)
+    module = load_script('cisco-ios-xe')
+    monkeypatch.setattr(module, 'CISCO_ROTATION_TIMEOUT', 1)
+
+    url = f"http://127.0.0.1:{port}/restconf/data/Cisco-IOS-XE-native:native/"
+    code, elapsed = run_rotation(module.rotate, url, 'admin', 'admin', 'user1', 'NewPassword1')
+
+    assert code == 1
+    assert elapsed < 2
+    assert 'Timed out' in capsys.readouterr().out
+
+def test_meraki_rotation_timeout(start_backend, load_script, monkeypatch, capsys):
+    _, port = start_backend('cisco-meraki', latency=3)
+    module = load_script('cisco-meraki', port)
+    monkeypatch.setattr(module, 'MERAKI_ROTATION_TIMEOUT', 1)
+
+    code, elapsed = run_rotation(module.rotate, 'N1', f"key-{uuid.uuid4()}", 'user1@example.com', 'NewPassword1')
+
+    assert code == 1
+    assert elapsed < 2
+    assert 'Timed out' in capsys.readouterr().out
+
+def test_tenable_retry_after_beyond_budget(start_backend, load_script, monkeypatch, capsys):
+    _, port = start_backend('tenable-io-user', rate_limit=1, retry_after=10)
+    module = load_script('tenable-io-user', port)
+    monkeypatch.setattr(module, 'TENABLE_ROTATION_TIMEOUT', 3)
+
+    code, elapsed = run_rotation(module.rotate, f"access-{uuid.uuid4()}", 'secret', 'user1', 'OldPassword1', 'NewPassword1')
+
+    # The stand-in asks to retry after 10 s, the rotation gives up instead of waiting past its budget
+    assert code == 1
+    assert elapsed < 3
+    assert '# Error:' in capsys.readouterr().out
+    # Only the client of the rotation is limited, restfly itself still retries and pauses for other pyTenable users
+    assert restfly.errors.TooManyRequestsError.retryable
+    assert restfly.session.time is time
+
+def test_tenable_rotation_timeout(start_backend, load_script, monkeypatch, capsys):
+    _, port = start_backend('tenable-io-user', latency=3)
+    module = load_script('tenable-io-user', port)
+    monkeypatch.setattr(module, 'TENABLE_ROTATION_TIMEOUT', 1)
+
+    code, elapsed = run_rotation(module.rotate, f"access-{uuid.uuid4()}", 'secret', 'user1', 'OldPassword1', 'NewPassword1')
+
+    assert code == 1
+    assert elapsed < 2
+    assert '# Error:' in capsys.readouterr().out
+
+def test_tenable_credential_rotation_timeout(start_backend, load_script, monkeypatch, capsys):
+    _, port = start_backend('tenable-credential', latency=3)
+    module = load_script('tenable-credential', port)
+    monkeypatch.setattr(module, 'TENABLE_ROTATION_TIMEOUT', 1)
+
+    code, elapsed = run_rotation(module.rotate, f"access-{uuid.uuid4()}", 'secret', 'user1', 'NewPassword1')
+
+    assert code == 1
+    assert elapsed < 2
+    assert '# Error:' in capsys.readouterr().out
+
+def test_tenable_sc_rotation_timeout(start_backend, load_script, monkeypatch, capsys):
+    _, port = start_backend('tenable-sc-user', latency=3)
+    module = load_script('tenable-sc-user', port)
+    monkeypatch.setattr(module, 'TENABLE_ROTATION_TIMEOUT', 1)
+
+    code, elapsed = run_rotation(module.rotate, '127.0.0.1', f"access-{uuid.uuid4()}", 'secret', 'user1', 'OldPassword1', 'NewPassword1')
+
+    assert code == 1
+    assert elapsed < 2
+    assert '# Error:' in capsys.readouterr().out
+
+def test_snowflake_rotation_timeout(start_backend, load_script, monkeypatch, capsys):
+    _, port = start_backend('snowflake', latency=3)
+    module = load_script('snowflake', port)
+    monkeypatch.setattr(module, 'SNOWFLAKE_ROTATION_TIMEOUT', 1)
+
+    code, elapsed = run_rotation(module.rotate, 'test', 'admin', 'AdminPassword1', 'user1', 'NewPassword1')
+
+    assert code == 1
+    assert elapsed < 3
@@ -0,0 +1,50 @@
+'''
+Bulk rotation of the Meraki script with action batches.
+'''
+
+import time
+import uuid
+
+import pytest
+
+@pytest.fixture
+def meraki(start_backend, load_script, monkeypatch):
+    """
+    Returns:
+    - (BackendState, module): The Meraki stand-in holding 250 users, and the script pointed at it with a short poll interval.
+    """
+    state, port = start_backend('cisco-meraki', users=250)
+    module = load_script('cisco-meraki', port)
+    monkeypatch.setattr(module, 'MERAKI_ACTION_BATCH_POLL_INTERVAL', 0.05)
+    return state, module
+
+def test_users_are_updated_in_batches_of_batch_size(meraki, capsys):
+    state, module = meraki
+    new_passwords = {f"user{i}@example.com": f"NewPassword{i}" for i in range(250)}
+
+    results = module.rotate_bulk('N1', f"key-{uuid.uuid4()}", 'O1', new_passwords)
+
+    assert set(results.values()) == {'updated'}
+    # 250 actions in batches of at most 100
+    assert state.paths['POST /api/v1/organizations/O1/actionBatches'] == 3
+    assert state.paths['GET /api/v1/networks/N1/merakiAuthUsers'] == 1
+    assert 'Password updated for 250 of 250 users' in capsys.readouterr().out
+
+def test_unknown_user_does_not_fail_the_batch(meraki, capsys):
+    state, module = meraki
+
+    results = module.rotate_bulk('N1', f"key-{uuid.uuid4()}", 'O1', {'user1@example.com': 'NewPassword1', 'nobody@example.com': 'NewPassword2'})
+
+    assert results == {'user1@example.com': 'updated', 'nobody@example.com': 'user not found'}
+    assert state.paths['POST /api/v1/organizations/O1/actionBatches'] == 1
+
+def test_stale_cached_id_is_retried_after_listing_users(meraki, capsys):
+    state, module = meraki
+    module.save_user_index({'N1': {'updated': time.time(), 'users': {'user1@example.com': 'deleted', 'user2@example.com': '2'}}})
+
+    results = module.rotate_bulk('N1', f"key-{uuid.uuid4()}", 'O1', {'user1@example.com': 'NewPassword1', 'user2@example.com': 'NewPassword2'})
+
+    # The batch of cached IDs fails as a whole on the stale one, both are retried after the users are listed
+    assert results == {'user1@example.com': 'updated', 'user2@example.com': 'updated'}
+    assert state.paths['POST /api/v1/organizations/O1/actionBatches'] == 2
+    assert module.get_cached_user_id('N1', 'user1@example.com') == '1'
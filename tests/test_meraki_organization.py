@@ -0,0 +1,39 @@
+'''
+Organization-wide rotation of the Meraki script: every network of the organization that holds the user.
+'''
+
+import uuid
+
+def test_user_is_rotated_in_every_network_holding_it(start_backend, load_script, capsys):
+    state, port = start_backend('cisco-meraki')
+    module = load_script('cisco-meraki', port)
+
+    results = module.rotate_organization('O1', f"key-{uuid.uuid4()}", 'user1@example.com', 'NewPassword1')
+
+    assert results == {'N1': 'updated', 'N2': 'updated', 'N3': 'user not found'}
+    output = capsys.readouterr().out
+    assert 'Network N3' not in output
+    assert 'in 2 of 2 networks containing the user (3 networks searched)' in output
+
+def test_index_of_all_networks_is_written_once(start_backend, load_script, capsys):
+    state, port = start_backend('cisco-meraki')
+    module = load_script('cisco-meraki', port)
+    key = f"key-{uuid.uuid4()}"
+
+    module.rotate_organization('O1', key, 'user1@example.com', 'NewPassword1')
+    results = module.rotate_organization('O1', key, 'user2@example.com', 'NewPassword2')
+
+    # The second rotation finds both users in the index the first one wrote
+    assert results['N1'] == results['N2'] == 'updated'
+    assert state.paths['GET /api/v1/networks/N1/merakiAuthUsers'] == 1
+    assert state.paths['GET /api/v1/networks/N2/merakiAuthUsers'] == 1
+    assert set(module.load_user_index()) == {'N1', 'N2'}
+
+def test_unknown_user_is_reported(start_backend, load_script, capsys):
+    state, port = start_backend('cisco-meraki', users=3)
+    module = load_script('cisco-meraki', port)
+
+    results = module.rotate_organization('O1', f"key-{uuid.uuid4()}", 'user7@example.com', 'NewPassword1')
+
+    assert set(results.values()) == {'user not found'}
+    assert 'in 0 of 0 networks containing the user (3 networks searched)' in capsys.readouterr().out
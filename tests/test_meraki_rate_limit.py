@@ -0,0 +1,57 @@
+'''
+Rate limiting of the Meraki script: the token bucket of each organization and the retries of throttled requests.
+'''
+
+import time
+import uuid
+
+import pytest
+
+def test_token_bucket_paces_requests_beyond_capacity(load_script):
+    module = load_script('cisco-meraki')
+    module.start_deadline(60)
+    bucket = module.TokenBucket(rate=10, capacity=5)
+
+    start = time.monotonic()
+    waits = [bucket.acquire() for _ in range(10)]
+
+    # The first five requests use the capacity, the next five wait for a token each
+    assert waits[:5] == [0.0] * 5
+    assert time.monotonic() - start >= 0.45
+    assert bucket.waited == pytest.approx(sum(waits))
+
+def test_token_bucket_gives_up_when_wait_outlasts_budget(load_script):
+    module = load_script('cisco-meraki')
+    module.start_deadline(1)
+    bucket = module.TokenBucket(rate=10, capacity=1)
+    bucket.acquire()
+    # After a 429 with Retry-After: 5 the bucket stays empty for longer than the budget
+    bucket.pause(5)
+
+    with pytest.raises(module.DeadlineExceeded):
+        bucket.acquire()
+    assert bucket.throttled == 1
+
+def test_meraki_retries_throttled_requests(start_backend, load_script, capsys):
+    state, port = start_backend('cisco-meraki', rate_limit=1, retry_after=1)
+    module = load_script('cisco-meraki', port)
+
+    # A new API key gets its own token bucket
+    module.rotate('N1', f"key-{uuid.uuid4()}", 'user1@example.com', 'NewPassword1')
+
+    output = capsys.readouterr().out
+    assert 'Password updated successfully' in output
+    assert state.throttled >= 1
+    assert 'throttled responses' in output
+
+def test_meraki_fails_when_throttling_outlasts_retries(start_backend, load_script, monkeypatch, capsys):
+    state, port = start_backend('cisco-meraki', rate_limit=1, retry_after=0)
+    module = load_script('cisco-meraki', port)
+    monkeypatch.setattr(module, 'MERAKI_MAX_RETRIES', 0)
+    monkeypatch.setattr(module, 'MERAKI_RATE_LIMIT', 100)
+
+    with pytest.raises(SystemExit) as exit_info:
+        module.rotate('N1', f"key-{uuid.uuid4()}", 'user1@example.com', 'NewPassword1')
+
+    assert exit_info.value.code == 1
+    assert 'rate limit still exceeded' in capsys.readouterr().out
@@ -0,0 +1,44 @@
+'''
+Email to user ID index of the Meraki script, kept in MERAKI_USER_CACHE_FILE between rotations.
+'''
+
+import time
+import uuid
+
+USERS_PATH = '/api/v1/networks/N1/merakiAuthUsers'
+
+def test_second_rotation_uses_cached_id(start_backend, load_script, capsys):
+    state, port = start_backend('cisco-meraki')
+    module = load_script('cisco-meraki', port)
+    key = f"key-{uuid.uuid4()}"
+
+    module.rotate('N1', key, 'user1@example.com', 'NewPassword1')
+    module.rotate('N1', key, 'user2@example.com', 'NewPassword1')
+
+    assert capsys.readouterr().out.count('Password updated successfully') == 2
+    assert state.paths[f"GET {USERS_PATH}"] == 1
+    assert module.get_cached_user_id('N1', 'user2@example.com') == '2'
+
+def test_stale_cached_id_is_looked_up_again(start_backend, load_script, capsys):
+    state, port = start_backend('cisco-meraki')
+    module = load_script('cisco-meraki', port)
+    module.save_user_index({'N1': {'updated': time.time(), 'users': {'user1@example.com': 'deleted'}}})
+
+    module.rotate('N1', f"key-{uuid.uuid4()}", 'user1@example.com', 'NewPassword1')
+
+    assert 'Password updated successfully' in capsys.readouterr().out
+    assert state.paths[f"PUT {USERS_PATH}/deleted"] == 1
+    assert state.paths[f"GET {USERS_PATH}"] == 1
+    assert module.get_cached_user_id('N1', 'user1@example.com') == '1'
+
+def test_expired_index_is_not_used(start_backend, load_script, monkeypatch, capsys):
+    state, port = start_backend('cisco-meraki')
+    module = load_script('cisco-meraki', port)
+    monkeypatch.setattr(module, 'MERAKI_USER_CACHE_TTL', 60)
+    module.save_user_index({'N1': {'updated': time.time() - 120, 'users': {'user1@example.com': 'deleted'}}})
+
+    module.rotate('N1', f"key-{uuid.uuid4()}", 'user1@example.com', 'NewPassword1')
+
+    assert 'Password updated successfully' in capsys.readouterr().out
+    assert state.paths[f"PUT {USERS_PATH}/deleted"] == 0
+    assert state.paths[f"PUT {USERS_PATH}/1"] == 1
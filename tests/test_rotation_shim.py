@@ -0,0 +1,102 @@
+'''
+rotation_daemon.py and rotation_shim.py: rotations forwarded to the daemon run with the scripts it keeps loaded, and
+the shim runs the rotation in its own process when no daemon is listening.
+'''
+
+import io
+import os
+import sys
+import json
+import socket
+import base64
+import threading
+import subprocess
+
+import pytest
+
+import rotation_shim
+import rotation_daemon
+import rotation_runner
+
+SHIM = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'pam_rotate', 'rotation_shim.py')
+
+def meraki_payload(**params):
+    """
+    Returns:
+    - str: A base64 params payload for the Meraki script, with a Cisco Authentication Record of network N1.
+    """
+    records = [{'title': 'Cisco Authentication Record', 'network_id': 'N1', 'organization_id': 'O1', 'password': 'api-key'}]
+    params['records'] = base64.b64encode(json.dumps(records).encode()).decode()
+    return base64.b64encode(json.dumps(params).encode()).decode()
+
+def run_shim(monkeypatch, capsys, payload, *args):
+    """
+    Runs rotation_shim.main() in this process with the payload on stdin.
+
+    Returns:
+    - (int, str): The exit code and the output of the shim.
+    """
+    monkeypatch.setattr(sys, 'argv', ['rotation_shim.py', *args])
+    monkeypatch.setattr(sys, 'stdin', io.StringIO(payload + '\n'))
+    with pytest.raises(SystemExit) as exit_info:
+        rotation_shim.main()
+    return exit_info.value.code, capsys.readouterr().out
+
+def test_shim_runs_rotation_without_daemon(tmp_path):
+    # The users entry has no newPassword, the Meraki script rejects the payload before any request
+    payload = meraki_payload(users=[{'user': 'user1@example.com'}])
+    env = dict(os.environ, PAM_ROTATE_SOCKET=str(tmp_path / 'missing.sock'))
+
+    process = subprocess.run([sys.executable, SHIM, 'cisco-meraki'], input=payload + '\n', capture_output=True, text=True, env=env, timeout=60)
+
+    assert process.returncode == 1
+    assert '# Error: Every entry of the users list needs a user and a newPassword.' in process.stdout
+
+def test_shim_fallback_rotates_in_process(start_backend, load_script, monkeypatch, capsys, tmp_path):
+    state, port = start_backend('cisco-meraki')
+    load_script('cisco-meraki', port)
+    monkeypatch.setattr(rotation_shim, 'SOCKET_PATH', str(tmp_path / 'missing.sock'))
+
+    code, output = run_shim(monkeypatch, capsys, meraki_payload(user='user1@example.com', newPassword='NewPassword1'), 'cisco-meraki')
+
+    assert code == 0
+    assert 'Password updated successfully for user with email user1@example.com' in output
+    assert state.paths['PUT /api/v1/networks/N1/merakiAuthUsers/1'] == 1
+
+@pytest.fixture
+def daemon(tmp_path, monkeypatch):
+    """
+    Serves rotation_daemon.py on a socket in the temporary directory of the test, with rotation_shim.py pointed at it.
+
+    Returns:
+    - RotationServer: The running daemon.
+    """
+    socket_path = str(tmp_path / 'daemon.sock')
+    server = rotation_daemon.RotationServer(socket_path, rotation_daemon.RotationRequestHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(rotation_shim, 'SOCKET_PATH', socket_path)
+    yield server
+    server.shutdown()
+    server.server_close()
+
+def test_daemon_rotates_with_loaded_script(start_backend, load_script, daemon, monkeypatch, capsys):
+    state, port = start_backend('cisco-meraki')
+    module = load_script('cisco-meraki', port)
+
+    for user in ('user1@example.com', 'user2@example.com'):
+        code, output = run_shim(monkeypatch, capsys, meraki_payload(user=user, newPassword='NewPassword1'), 'cisco-meraki')
+        assert code == 0
+        assert f"Password updated successfully for user with email {user}" in output
+
+    # Both rotations ran in the daemon with the script loaded by the test, sharing its user index
+    assert rotation_runner.load_backend('cisco-meraki') is module
+    assert state.paths['GET /api/v1/networks/N1/merakiAuthUsers'] == 1
+
+def test_daemon_rejects_invalid_request(daemon):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(daemon.server_address)
+        client.sendall(b'not json\n')
+        reply = json.loads(client.makefile().readline())
+
+    assert reply['exit_code'] == 1
+    assert reply['output'].startswith('# Error: Invalid rotation request:')
@@ -0,0 +1,46 @@
+'''
+rotation_stream.py: one NDJSON result line per job on stdout, whatever the rotation scripts print on their worker threads.
+'''
+
+import io
+import sys
+import json
+import base64
+
+import pytest
+
+import rotation_stream
+
+def tenable_sc_payload(**params):
+    """
+    Returns:
+    - str: A base64 params payload for the Tenable.sc script, with a Tenable Authentication Record of two Security
+      Centers, so the rotation runs on worker threads of the script.
+    """
+    records = [{'title': 'Tenable Authentication Record', 'tenable_sc_host': '127.0.0.1,localhost',
+                'tenable_access_key': 'access-key', 'tenable_secret_key': 'secret-key'}]
+    params['records'] = base64.b64encode(json.dumps(records).encode()).decode()
+    return base64.b64encode(json.dumps(params).encode()).decode()
+
+def test_stdout_holds_only_results(start_backend, load_script, monkeypatch, tmp_path):
+    _, port = start_backend('tenable-sc-user', users=5)
+    module = load_script('tenable-sc-user', port)
+    # The worker threads fail to write the user index and print a warning
+    (tmp_path / 'not-a-directory').write_text('')
+    monkeypatch.setattr(module, 'TENABLE_SC_USER_CACHE_FILE', str(tmp_path / 'not-a-directory' / 'users.json'))
+    monkeypatch.setattr(module, 'TENABLE_SC_USER_CACHE_TTL', 3600)
+    payloads = [tenable_sc_payload(user=f"user{i}", oldPassword='OldPassword1', newPassword='NewPassword1') for i in range(3)]
+
+    stdout, stderr = io.StringIO(), io.StringIO()
+    monkeypatch.setattr(sys, 'argv', ['rotation_stream.py', '--workers', '2', 'tenable-sc-user'])
+    monkeypatch.setattr(sys, 'stdin', io.StringIO('\n'.join(payloads) + '\n'))
+    monkeypatch.setattr(sys, 'stdout', stdout)
+    monkeypatch.setattr(sys, 'stderr', stderr)
+    with pytest.raises(SystemExit) as exit_info:
+        rotation_stream.main()
+
+    assert exit_info.value.code == 0
+    results = [json.loads(line) for line in stdout.getvalue().splitlines()]
+    assert sorted(result['job'] for result in results) == ['1', '2', '3']
+    assert all('on 2 of 2 Security Centers' in result['output'] for result in results)
+    assert '# Warning: Unable to write the Tenable SC user cache' in stderr.getvalue()
@@ -0,0 +1,42 @@
+'''
+Batch rotation of the Snowflake script: several users on one session, one statement after the other or
+asynchronously.
+'''
+
+import pytest
+
+# Every character the connector has to escape in a string literal
+PASSWORDS = {'user1': "New'Password1", 'user2': 'New\\Password2', 'user3': "New'); DROP USER user4; --"}
+
+@pytest.mark.parametrize('use_async', [False, True])
+def test_batch_binds_user_names_and_passwords(start_backend, load_script, capsys, use_async):
+    state, port = start_backend('snowflake', users=5)
+    module = load_script('snowflake', port)
+
+    results = module.rotate_batch('test', 'admin', 'AdminPassword1', dict(PASSWORDS, user9='NewPassword9'), use_async=use_async)
+
+    assert results == {'user1': 'updated', 'user2': 'updated', 'user3': 'updated', 'user9': results['user9']}
+    assert results['user9'].startswith('failed:')
+    assert state.passwords == PASSWORDS
+    assert 'Password successfully rotated for 3 of 4 Snowflake Users' in capsys.readouterr().out
+
+def test_single_rotation_binds_password(start_backend, load_script, capsys):
+    state, port = start_backend('snowflake')
+    module = load_script('snowflake', port)
+
+    module.rotate('test', 'admin', 'AdminPassword1', 'user1', "New'Password1")
+
+    assert 'Password successfully rotated' in capsys.readouterr().out
+    assert state.passwords == {'user1': "New'Password1"}
+
+@pytest.mark.parametrize('value, polled', [('True', True), (False, False)])
+def test_async_mode_is_chosen_by_params(start_backend, load_script, capsys, value, polled):
+    state, port = start_backend('snowflake')
+    module = load_script('snowflake', port)
+    record = {'snowflake_account_name': 'test', 'login': 'admin', 'password': 'AdminPassword1'}
+
+    module.rotate_from_params({'users': [{'user': 'user1', 'newPassword': 'NewPassword1'}], 'batchAsync': value}, [record])
+
+    assert state.passwords == {'user1': 'NewPassword1'}
+    # Only asynchronous statements are polled for their status
+    assert any(path.startswith('GET /monitoring/queries/') for path in state.paths) == polled
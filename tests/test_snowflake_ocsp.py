@@ -0,0 +1,58 @@
+'''
+OCSP checks of the Snowflake script: the SNOWFLAKE_OCSP_FAIL_OPEN setting and the --warm-ocsp warm-up.
+'''
+
+import functools
+
+import pytest
+
+def recorded_connect(module, monkeypatch):
+    """
+    Records the options of every connection the script opens.
+
+    Returns:
+    - list: Receives the keyword arguments of each snowflake.connector.connect call.
+    """
+    calls = []
+    connect = module.snowflake.connector.connect
+
+    def record(**options):
+        calls.append(options)
+        return connect(**options)
+
+    monkeypatch.setattr(module.snowflake.connector, 'connect', record)
+    return calls
+
+@pytest.mark.parametrize('fail_open', [True, False])
+def test_rotation_connects_with_ocsp_setting(start_backend, load_script, monkeypatch, capsys, fail_open):
+    state, port = start_backend('snowflake')
+    module = load_script('snowflake', port)
+    monkeypatch.setattr(module, 'SNOWFLAKE_OCSP_FAIL_OPEN', fail_open)
+    calls = recorded_connect(module, monkeypatch)
+
+    module.rotate('test', 'admin', 'AdminPassword1', 'user1', 'NewPassword1')
+
+    assert 'Password successfully rotated' in capsys.readouterr().out
+    assert [call['ocsp_fail_open'] for call in calls] == [fail_open]
+
+def test_rotation_keeps_connector_default(start_backend, load_script, monkeypatch, capsys):
+    state, port = start_backend('snowflake')
+    module = load_script('snowflake', port)
+    monkeypatch.setattr(module, 'SNOWFLAKE_OCSP_FAIL_OPEN', None)
+    calls = recorded_connect(module, monkeypatch)
+
+    module.rotate('test', 'admin', 'AdminPassword1', 'user1', 'NewPassword1')
+
+    assert 'ocsp_fail_open' not in calls[0]
+
+def test_warm_up_skips_when_rotations_make_no_ocsp_checks(load_script, monkeypatch, capsys):
+    module = load_script('snowflake')
+    from snowflake.connector import ssl_wrap_socket
+    from snowflake.connector.constants import OCSPMode
+    if getattr(ssl_wrap_socket, 'DEFAULT_OCSP_MODE', None) != getattr(OCSPMode, 'DISABLE_OCSP_CHECKS', None):
+        pytest.skip('this connector checks certificates with OCSP by default')
+    monkeypatch.setattr(module, 'SNOWFLAKE_OCSP_FAIL_OPEN', None)
+    monkeypatch.setattr(ssl_wrap_socket, 'inject_into_urllib3', functools.partial(pytest.fail, 'no connection expected'))
+
+    assert module.warm_ocsp_cache(['xy12345'])
+    assert 'The rotations make no OCSP checks' in capsys.readouterr().out
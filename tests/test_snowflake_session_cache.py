@@ -0,0 +1,51 @@
+'''
+Session cache of the Snowflake script: back-to-back rotations against the same account resume the admin session
+instead of logging in again.
+'''
+
+import pytest
+
+LOGIN_PATH = 'POST /session/v1/login-request'
+
+RECORD = {'snowflake_account_name': 'test', 'login': 'admin', 'password': 'AdminPassword1'}
+
+def test_cached_session_is_resumed(start_backend, load_script, monkeypatch, capsys):
+    state, port = start_backend('snowflake')
+    module = load_script('snowflake', port)
+    monkeypatch.setattr(module, 'SNOWFLAKE_SESSION_CACHE', True)
+
+    module.rotate('test', 'admin', 'AdminPassword1', 'user1', 'NewPassword1')
+    module.rotate('test', 'admin', 'AdminPassword1', 'user2', 'NewPassword1')
+
+    assert capsys.readouterr().out.count('Password successfully rotated') == 2
+    assert state.paths[LOGIN_PATH] == 1
+
+def test_every_rotation_logs_in_without_session_cache(start_backend, load_script, capsys):
+    state, port = start_backend('snowflake')
+    module = load_script('snowflake', port)
+
+    module.rotate('test', 'admin', 'AdminPassword1', 'user1', 'NewPassword1')
+    module.rotate('test', 'admin', 'AdminPassword1', 'user2', 'NewPassword1')
+
+    assert capsys.readouterr().out.count('Password successfully rotated') == 2
+    assert state.paths[LOGIN_PATH] == 2
+
+@pytest.mark.parametrize('value', [True, 'True', 'true'])
+def test_session_cache_is_enabled_by_params(start_backend, load_script, capsys, value):
+    state, port = start_backend('snowflake')
+    module = load_script('snowflake', port)
+
+    module.rotate_from_params({'user': 'user1', 'newPassword': 'NewPassword1', 'sessionCache': value}, [RECORD])
+    module.rotate_from_params({'users': [{'user': 'user2', 'newPassword': 'NewPassword2'}], 'sessionCache': value}, [RECORD])
+
+    assert state.paths[LOGIN_PATH] == 1
+    assert state.passwords == {'user1': 'NewPassword1', 'user2': 'NewPassword2'}
+
+def test_invalid_session_cache_option_is_rejected(load_script, capsys):
+    module = load_script('snowflake')
+
+    with pytest.raises(SystemExit) as exit_info:
+        module.rotate_from_params({'user': 'user1', 'newPassword': 'NewPassword1', 'sessionCache': 'yes'}, [RECORD])
+
+    assert exit_info.value.code == 1
+    assert capsys.readouterr().out == "# Error: The sessionCache option must be true or false.\n"
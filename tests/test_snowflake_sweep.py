@@ -0,0 +1,29 @@
+'''
+Sweep mode of the Snowflake script: the users found by SHOW USERS LIKE are rotated to the passwords given in
+the params, with one JSON line per user.
+'''
+
+import json
+
+def test_sweep_binds_passwords_with_quotes(start_backend, load_script, capsys):
+    state, port = start_backend('snowflake', users=12)
+    module = load_script('snowflake', port)
+    new_passwords = {'user1': "New'Password1", 'user10': "New''Password10'", 'user11': "x' OR '1'='1"}
+
+    results = module.rotate_sweep('test', 'admin', 'AdminPassword1', new_passwords, pattern='user1%')
+
+    assert results == {'user1': 'updated', 'user10': 'updated', 'user11': 'updated'}
+    assert state.passwords == new_passwords
+    lines = [json.loads(line) for line in capsys.readouterr().out.splitlines() if line.startswith('{')]
+    assert sorted(line['user'] for line in lines) == ['user1', 'user10', 'user11']
+
+def test_sweep_skips_users_without_password(start_backend, load_script, capsys):
+    state, port = start_backend('snowflake', users=12)
+    module = load_script('snowflake', port)
+
+    results = module.rotate_sweep('test', 'admin', 'AdminPassword1', {'user1': 'NewPassword1', 'svc': 'NewPassword2'}, pattern='user1%')
+
+    assert results == {'user1': 'updated', 'svc': 'not found by the sweep',
+                       'user10': 'no new password in the params', 'user11': 'no new password in the params'}
+    assert state.passwords == {'user1': 'NewPassword1'}
+    assert 'Password successfully rotated for 1 of 4 Snowflake Users' in capsys.readouterr().out
@@ -0,0 +1,28 @@
+'''
+Bulk mode of the Tenable Credential script: one listing for all names, then concurrent edits on one client.
+'''
+
+import uuid
+
+def test_credentials_are_listed_once_and_edited_concurrently(start_backend, load_script, capsys):
+    state, port = start_backend('tenable-credential', users=20, latency=0.05)
+    module = load_script('tenable-credential', port)
+    new_passwords = {f"user{i}": f"NewPassword{i}" for i in range(12)}
+
+    results = module.rotate_bulk(f"access-{uuid.uuid4()}", 'secret', new_passwords, max_workers=4)
+
+    assert set(results.values()) == {'updated'}
+    assert state.paths['GET /credentials'] == 1
+    assert sum(count for path, count in state.paths.items() if path.startswith('PUT /credentials/')) == 12
+    assert 1 < state.max_in_flight <= 4
+    assert 'Password successfully rotated for 12 of 12 Tenable Credentials' in capsys.readouterr().out
+
+def test_unknown_credential_is_reported(start_backend, load_script, capsys):
+    state, port = start_backend('tenable-credential', users=3)
+    module = load_script('tenable-credential', port)
+
+    results = module.rotate_bulk(f"access-{uuid.uuid4()}", 'secret', {'user1': 'NewPassword1', 'user7': 'NewPassword7'})
+
+    assert results == {'user1': 'updated', 'user7': 'not found'}
+    assert not any(path.startswith('PUT /credentials/cred-7') for path in state.paths)
+    assert 'Password successfully rotated for 1 of 2 Tenable Credentials' in capsys.readouterr().out
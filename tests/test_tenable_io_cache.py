@@ -0,0 +1,47 @@
+'''
+Username to user ID index of the Tenable.io user script.
+'''
+
+import time
+import uuid
+import hashlib
+from types import SimpleNamespace
+
+import tenable_common
+
+def test_second_rotation_uses_cached_id(start_backend, load_script, capsys):
+    state, port = start_backend('tenable-io-user')
+    module = load_script('tenable-io-user', port)
+    access_key = f"access-{uuid.uuid4()}"
+
+    module.rotate(access_key, 'secret', 'user1', 'OldPassword1', 'NewPassword1')
+    module.rotate(access_key, 'secret', 'user2', 'OldPassword1', 'NewPassword1')
+
+    assert capsys.readouterr().out.count('Password successfully rotated') == 2
+    assert state.paths['GET /users'] == 1
+    assert state.paths['PUT /users/2/chpasswd'] == 1
+
+def test_stale_cached_id_is_looked_up_again(start_backend, load_script, capsys):
+    state, port = start_backend('tenable-io-user', users=10)
+    module = load_script('tenable-io-user', port)
+    access_key = f"access-{uuid.uuid4()}"
+    tenant_key = hashlib.sha256(access_key.encode()).hexdigest()
+    module.save_user_index({tenant_key: {'updated': time.time(), 'users': {'user1': 99}}})
+
+    module.rotate(access_key, 'secret', 'user1', 'OldPassword1', 'NewPassword1')
+
+    assert 'Password successfully rotated' in capsys.readouterr().out
+    # The stand-in answers 404 for the unknown id
+    assert state.paths['PUT /users/99/chpasswd'] == 1
+    assert state.paths['PUT /users/1/chpasswd'] == 1
+    assert module.get_cached_user_id(tenant_key, 'user1') == 1
+
+def test_only_not_found_answers_are_stale():
+    def error(code):
+        return SimpleNamespace(code=code, response=SimpleNamespace(json=lambda: {'error': 'denied'}))
+
+    assert tenable_common.is_stale_id_error(error(404))
+    assert tenable_common.is_stale_id_error(error(410))
+    # A permission error would fail again after the users are listed, it is reported as it is
+    assert not tenable_common.is_stale_id_error(error(403))
+    assert not tenable_common.is_stale_id_error(error(400))
@@ -0,0 +1,119 @@
+'''
+Backoff of tenable_common.AdaptiveLimiter under 429 throttling.
+'''
+
+import time
+import uuid
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+import tenable_common
+
+class Throttled(Exception):
+    """
+    A 429 answer, shaped like the errors pyTenable raises.
+    """
+    def __init__(self, retry_after):
+        super().__init__('429 Too Many Requests')
+        self.code = 429
+        self.response = SimpleNamespace(headers={'Retry-After': retry_after})
+
+def throttled_calls(count, retry_after='0'):
+    """
+    Returns:
+    - callable: Raises Throttled on the first count calls, then returns 'ok'.
+    """
+    calls = []
+
+    def call():
+        calls.append(time.monotonic())
+        if len(calls) <= count:
+            raise Throttled(retry_after)
+        return 'ok'
+
+    call.calls = calls
+    return call
+
+@pytest.fixture(autouse=True)
+def deadline():
+    # The budget is kept per thread, start a fresh one so a rotation of an earlier test does not end these calls
+    tenable_common.start_deadline(60)
+
+def test_adaptive_limiter_halves_limit_and_retries():
+    limiter = tenable_common.AdaptiveLimiter(8, 16, throttle_retries=5)
+    call = throttled_calls(2)
+
+    assert limiter.call(call) == 'ok'
+    assert len(call.calls) == 3
+    assert limiter.throttled == 2
+    assert limiter.limit == 2
+
+def test_adaptive_limiter_honours_retry_after():
+    limiter = tenable_common.AdaptiveLimiter(4, 16, throttle_retries=5)
+    call = throttled_calls(1, retry_after='0.5')
+
+    assert limiter.call(call) == 'ok'
+    assert call.calls[1] - call.calls[0] >= 0.5
+
+def test_adaptive_limiter_raises_after_throttle_retries():
+    limiter = tenable_common.AdaptiveLimiter(4, 16, throttle_retries=2)
+    call = throttled_calls(10)
+
+    with pytest.raises(Throttled):
+        limiter.call(call)
+    assert len(call.calls) == 3
+
+def test_adaptive_limiter_stops_at_deadline():
+    limiter = tenable_common.AdaptiveLimiter(4, 16, throttle_retries=5)
+    call = throttled_calls(10, retry_after='10')
+
+    tenable_common.start_deadline(1)
+    start = time.monotonic()
+    with pytest.raises(tenable_common.DeadlineExceeded):
+        limiter.call(call)
+    # Retry-After asks for more than the budget, so the limiter gives up without waiting
+    assert time.monotonic() - start < 0.5
+    assert len(call.calls) == 1
+
+def test_adaptive_limiter_caps_concurrent_calls():
+    # The limit grows after a window of healthy calls, the maximum keeps it at 2
+    limiter = tenable_common.AdaptiveLimiter(2, 2, throttle_retries=0)
+    running = []
+    peak = []
+    lock = threading.Lock()
+
+    def call():
+        with lock:
+            running.append(None)
+            peak.append(len(running))
+        time.sleep(0.1)
+        with lock:
+            running.pop()
+
+    threads = [threading.Thread(target=limiter.call, args=(call,)) for _ in range(6)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert max(peak) == 2
+
+def test_adaptive_limiter_grows_after_healthy_window():
+    limiter = tenable_common.AdaptiveLimiter(2, 3, throttle_retries=0)
+    for _ in range(10):
+        limiter.call(lambda: None)
+    assert limiter.limit == 3
+
+def test_tenable_retries_throttled_requests(start_backend, load_script, capsys):
+    state, port = start_backend('tenable-io-user', rate_limit=1, retry_after=1)
+    module = load_script('tenable-io-user', port)
+
+    # A new access key gets its own limiter
+    module.rotate(f"access-{uuid.uuid4()}", 'secret', 'user1', 'OldPassword1', 'NewPassword1')
+
+    output = capsys.readouterr().out
+    assert 'Password successfully rotated' in output
+    assert state.throttled >= 1
+    assert 'throttled calls' in output
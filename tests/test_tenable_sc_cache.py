@@ -0,0 +1,52 @@
+'''
+User lookup of the Tenable.sc script: the trimmed user listing and the username to user ID index.
+'''
+
+import time
+import uuid
+import hashlib
+
+import pytest
+
+@pytest.fixture
+def sc(start_backend, load_script, monkeypatch):
+    """
+    Returns:
+    - (BackendState, module, str, str): The Tenable.sc stand-in, the script pointed at it, a new access key and the
+      key of its Security Center in the user index.
+    """
+    state, port = start_backend('tenable-sc-user', users=10)
+    module = load_script('tenable-sc-user', port)
+    monkeypatch.setattr(module, 'TENABLE_SC_USER_CACHE_TTL', 3600)
+    access_key = f"access-{uuid.uuid4()}"
+    return state, module, access_key, hashlib.sha256(f"127.0.0.1\0{access_key}".encode()).hexdigest()
+
+def test_users_are_listed_with_id_and_username_only(sc, capsys):
+    state, module, access_key, _ = sc
+
+    module.rotate('127.0.0.1', access_key, 'secret', 'user3', 'OldPassword1', 'NewPassword1')
+
+    assert 'Password successfully rotated' in capsys.readouterr().out
+    assert [query.get('fields') for query in state.queries['GET /rest/user']] == [['id,username']]
+    assert state.paths['PATCH /rest/user/3'] == 1
+
+def test_second_rotation_uses_cached_id(sc, capsys):
+    state, module, access_key, sc_key = sc
+
+    module.rotate('127.0.0.1', access_key, 'secret', 'user1', 'OldPassword1', 'NewPassword1')
+    module.rotate('127.0.0.1', access_key, 'secret', 'user2', 'OldPassword1', 'NewPassword1')
+
+    assert state.paths['GET /rest/user'] == 1
+    assert module.get_cached_user_id(sc_key, 'user2') == '2'
+
+def test_stale_cached_id_is_looked_up_again(sc, capsys):
+    state, module, access_key, sc_key = sc
+    module.save_user_index({sc_key: {'updated': time.time(), 'users': {'user1': '99'}}})
+
+    module.rotate('127.0.0.1', access_key, 'secret', 'user1', 'OldPassword1', 'NewPassword1')
+
+    assert 'Password successfully rotated' in capsys.readouterr().out
+    # Tenable.sc answers the stale id with 403 and error code 146
+    assert state.paths['PATCH /rest/user/99'] == 1
+    assert state.paths['PATCH /rest/user/1'] == 1
+    assert module.get_cached_user_id(sc_key, 'user1') == '1'
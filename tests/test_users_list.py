@@ -0,0 +1,31 @@
+'''
+Validation of the users list of a batch, the same in every script that takes one.
+'''
+
+import pytest
+
+# One Rotation Credential record with every field the script needs, by backend
+RECORDS = {
+    'cisco-ios-xe': {'host_endpoint': '127.0.0.1', 'login': 'admin', 'password': 'admin'},
+    'cisco-meraki': {'network_id': 'N1', 'organization_id': 'O1', 'password': 'api-key'},
+    'tenable-credential': {'tenable_access_key': 'access', 'tenable_secret_key': 'secret'},
+    'snowflake': {'snowflake_account_name': 'test', 'login': 'admin', 'password': 'AdminPassword1'},
+}
+
+INVALID_USERS = [
+    {'user': 'user1'},
+    [{'user': 'user1', 'newPassword': 'NewPassword1'}, {'newPassword': 'NewPassword2'}],
+    [{'user': 'user1', 'newPassword': ''}],
+    ['user1'],
+]
+
+@pytest.mark.parametrize('backend', sorted(RECORDS))
+@pytest.mark.parametrize('users', INVALID_USERS)
+def test_invalid_users_list_is_rejected(load_script, capsys, backend, users):
+    module = load_script(backend)
+
+    with pytest.raises(SystemExit) as exit_info:
+        module.rotate_from_params({'users': users}, [RECORDS[backend]])
+
+    assert exit_info.value.code == 1
+    assert capsys.readouterr().out == "# Error: Every entry of the users list needs a user and a newPassword.\n"